@@ -0,0 +1,518 @@
+import asyncio
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import loguru
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import selectinload
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from aiwrite.ingest import IngestStats
+from aiwrite.jobs import IngestionJob
+from aiwrite.workflow import (Workflow, Manuscript, Project, ABSTRACT_PROMPT, CRITIQUE_PROMPT, ENHANCE_PROMPT,
+                              SECTION_PROMPT, TITLE_PROMPT, outline_section_names, parse_manuscript_text,
+                              section_slug, strip_section_heading)
+
+logger = loguru.logger
+
+T = TypeVar("T")
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def async_dburl(dburl: str) -> str:
+    """
+    Translate a database URL to the equivalent URL for an asyncio driver
+    :param dburl: Database connection URL, e.g. ``sqlite:///data/aiwrite.db``
+    :return: URL using an async driver, e.g. ``sqlite+aiosqlite:///data/aiwrite.db``
+    """
+    scheme, sep, rest = dburl.partition("://")
+    if scheme in ASYNC_DRIVERS.values():
+        return dburl
+    if scheme not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver known for database URL scheme '{scheme}'")
+    return f"{ASYNC_DRIVERS[scheme]}{sep}{rest}"
+
+
+class AsyncWorkflow:
+    """Asyncio counterpart of ``Workflow``.
+
+    Uses the configuration, AI model and knowledge base of a ``Workflow`` but
+    accesses the database through an async SQLAlchemy engine. Model, embedding
+    and PDF calls, whose libraries are synchronous, run on a dedicated thread
+    pool, so the event loop stays free while they are in flight.
+
+    Attributes:
+        workflow: Synchronous workflow providing configuration, model and knowledge base
+        engine: Async database engine
+    """
+
+    def __init__(self, workflow: Workflow, max_threads: int = 64):
+        """Initialize the async workflow.
+
+        Args:
+            workflow: Workflow to share configuration, model and knowledge base with
+            max_threads: Maximum number of model, embedding and PDF calls in flight
+        """
+        self.workflow = workflow
+        self.engine = create_async_engine(async_dburl(workflow.dburl))
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="aiwrite-async")
+        self._schema_ready = False
+        self._schema_lock = asyncio.Lock()
+
+    async def close(self) -> None:
+        """Dispose of the database engine and the thread pool."""
+        await self.engine.dispose()
+        self._executor.shutdown(wait=False)
+
+    @asynccontextmanager
+    async def _session(self, **kwargs: Any) -> AsyncIterator[AsyncSession]:
+        """Open a database session, creating the tables on first use like ``Workflow.engine`` does."""
+        if not self._schema_ready:
+            async with self._schema_lock:
+                if not self._schema_ready:
+                    async with self.engine.begin() as connection:
+                        await connection.run_sync(SQLModel.metadata.create_all)
+                    self._schema_ready = True
+        async with AsyncSession(self.engine, **kwargs) as session:
+            yield session
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run a blocking call on the thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
+
+    async def _iterate(self, iterator: Iterator[T]) -> AsyncIterator[T]:
+        """Consume a blocking iterator on the thread pool, yielding its items as they arrive."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def pump():
+            try:
+                for item in iterator:
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except Exception as exc:
+                loop.call_soon_threadsafe(queue.put_nowait, (None, exc))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+        pumping = loop.run_in_executor(self._executor, pump)
+        while True:
+            item, exc = await queue.get()
+            if exc is not None:
+                raise exc
+            if item is done:
+                break
+            yield item
+        await pumping
+
+    async def _ask_stream(self, question: str, context: str) -> AsyncIterator[str]:
+        async for chunk in self._iterate(self.workflow._ask_stream(question, context)):
+            yield chunk
+
+    async def retrieve_docs(self, query: str, num_docs: int = 15) -> str:
+        """Retrieve knowledge base passages relevant to a query.
+
+        Args:
+            query: Query text
+            num_docs: Number of passages to retrieve
+
+        Returns:
+            Retrieved passages as text
+        """
+        return await self._run(partial(self.workflow.retrieve_docs, query, num_docs=num_docs))
+
+    async def embed_document(self, file_name: str, batch_size: Optional[int] = None,
+                             max_concurrency: Optional[int] = None) -> IngestStats:
+        """Embed the contents of a document into the knowledge base.
+
+        Args:
+            file_name: Path to the document file to embed
+            batch_size: Number of pages per embedding batch
+            max_concurrency: Maximum number of batches embedded at the same time
+
+        Returns:
+            Throughput statistics of the ingestion
+        """
+        return await self._run(self.workflow.embed_document, file_name, batch_size, max_concurrency)
+
+    async def queue_document(self, file_name: str, collection_name: Optional[str] = None) -> IngestionJob:
+        """Embed a document in the background.
+
+        Args:
+            file_name: Path to the document file to embed
+            collection_name: Collection to embed into, defaults to the current knowledge base collection
+
+        Returns:
+            The queued job
+        """
+        return await self._run(self.workflow.queue_document, file_name, collection_name)
+
+    async def get_ingestion_jobs(self, n: int = 50) -> List[IngestionJob]:
+        """Get the most recent background ingestion jobs.
+
+        Args:
+            n: Maximum number of jobs to return
+
+        Returns:
+            Jobs, most recent first
+        """
+        return await self._run(self.workflow.ingestion_queue.get_jobs, n)
+
+    async def cancel_ingestion_job(self, job_id: int) -> bool:
+        """Cancel a background ingestion job.
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            Whether the job was still active
+        """
+        return await self._run(self.workflow.ingestion_queue.cancel, job_id)
+
+    async def set_knowledge_base(self, collection_name: str) -> None:
+        """Set the knowledge base collection to use.
+
+        Args:
+            collection_name: Name of the knowledge base collection
+        """
+        await self._run(self.workflow.set_knowledge_base, collection_name)
+
+    async def get_man_list(self, n: int = 100) -> List[Manuscript]:
+        """Get a list of manuscripts from the database.
+
+        Args:
+            n: Maximum number of manuscripts to return
+
+        Returns:
+            List of Manuscript objects
+        """
+        async with self._session() as session:
+            statement = select(Manuscript).options(selectinload(Manuscript.sections)).limit(n)
+            manuscripts = (await session.exec(statement)).all()
+        return list(manuscripts)
+
+    async def get_manuscript(self, manuscript_id: int) -> Optional[Manuscript]:
+        """Retrieve a manuscript from the database by ID.
+
+        Args:
+            manuscript_id: ID of the manuscript to retrieve
+
+        Returns:
+            Manuscript object if found, None otherwise
+        """
+        async with self._session(expire_on_commit=False) as session:
+            statement = (select(Manuscript)
+                         .where(Manuscript.id == manuscript_id)
+                         .options(selectinload(Manuscript.sections)))
+            manuscript = (await session.exec(statement)).first()
+            if manuscript and manuscript.legacy_source and not manuscript.sections:
+                manuscript.set_source(manuscript.legacy_source)
+                session.add(manuscript)
+                await session.commit()
+        return manuscript
+
+    async def get_manuscript_text(self, manuscript_id: int) -> str:
+        """Get the markdown text content of a manuscript.
+
+        Args:
+            manuscript_id: ID of the manuscript to retrieve
+
+        Returns:
+            Markdown text content of the manuscript
+        """
+        manuscript = await self.get_manuscript(manuscript_id)
+        return manuscript.source if manuscript else ""
+
+    async def get_manuscript_sections(self, manuscript_id: int) -> Dict[str, str]:
+        """Get all sections from a manuscript as a dictionary.
+
+        Args:
+            manuscript_id: ID of the manuscript to retrieve sections from
+
+        Returns:
+            Dictionary mapping section names to their content
+        """
+        return parse_manuscript_text(await self.get_manuscript_text(manuscript_id))
+
+    async def update_from_text(self, manuscript_id: int, text: str) -> None:
+        """Update a manuscript's content from markdown text.
+
+        Args:
+            manuscript_id: ID of the manuscript to update
+            text: New markdown text content
+        """
+        manuscript = await self.get_manuscript(manuscript_id)
+        if not parse_manuscript_text(text) or manuscript is None or manuscript.source == text:
+            return
+        manuscript.set_source(text)
+        await self._save_manuscript(manuscript)
+
+    async def delete_manuscript(self, manuscript_id: int) -> None:
+        """Delete a manuscript from the database.
+
+        Args:
+            manuscript_id: ID of the manuscript to delete
+        """
+        async with self._session() as session:
+            manuscript = await session.get(Manuscript, manuscript_id, options=[selectinload(Manuscript.sections)])
+            if manuscript:
+                await session.delete(manuscript)
+                await session.commit()
+
+    async def get_projects(self) -> List[Project]:
+        """Get all projects.
+
+        Returns:
+            List of Project objects
+        """
+        async with self._session() as session:
+            projects = (await session.exec(select(Project))).all()
+        return list(projects)
+
+    async def save_project(self, project: Project) -> Project:
+        """Save a project configuration to the database.
+
+        Args:
+            project: Project object to save
+
+        Returns:
+            Saved Project object
+        """
+        async with self._session(expire_on_commit=False) as session:
+            project.last_updated = datetime.datetime.now()
+            session.add(project)
+            await session.commit()
+        self.workflow.current_project = project
+        self.workflow.project_id = project.id
+        return project
+
+    async def setup_manuscript(self, concept: str) -> Manuscript:
+        """Initialize a new manuscript with title and abstract based on a concept.
+
+        Args:
+            concept: Initial concept/idea for the manuscript
+
+        Returns:
+            Newly created Manuscript object
+        """
+        manuscript = None
+        async for _, manuscript in self.setup_manuscript_progress(concept):
+            pass
+        return manuscript
+
+    async def setup_manuscript_stream(self, concept: str) -> AsyncIterator[str]:
+        """Streaming variant of ``setup_manuscript``, yielding the text generated so far."""
+        async for text, _ in self.setup_manuscript_progress(concept):
+            yield text
+
+    async def setup_manuscript_progress(self, concept: str) -> AsyncIterator[Tuple[str, Optional[Manuscript]]]:
+        """Streaming variant of ``setup_manuscript`` that also hands over the saved manuscript.
+
+        Yields:
+            ``(text, None)`` while generating, then ``(text, manuscript)`` once the manuscript is saved
+        """
+        title = ""
+        async for chunk in self._ask_stream(TITLE_PROMPT.format(concept=concept), self.workflow._prompt_prefix()):
+            title += chunk
+            yield f"# {title}", None
+        try:
+            knowledge = (await self.retrieve_docs(concept, num_docs=15)).strip('"')
+        except Exception as exc:
+            logger.error(f"Error retrieving documents from knowledge base: {exc}")
+            knowledge = ""
+        abstract = ""
+        async for chunk in self._ask_stream(ABSTRACT_PROMPT, self.workflow._concept_context(concept, knowledge)):
+            abstract += chunk
+            yield f"# {title}\n\n## Abstract\n{abstract}", None
+
+        manuscript = Manuscript.from_text(f"# {title}\n\n## Abstract\n{abstract}")
+        await self._save_manuscript(manuscript)
+        if self.workflow.current_project:
+            self.workflow.current_project.manuscript_id = manuscript.id
+            await self.save_project(self.workflow.current_project)
+        yield manuscript.source, manuscript
+
+    async def add_section(self, manuscript_id: int, section_name: str) -> Optional[Manuscript]:
+        """Add a new section to a manuscript.
+
+        Args:
+            manuscript_id: ID of the manuscript to modify
+            section_name: Name of the section to add
+
+        Returns:
+            Updated Manuscript object if successful, None otherwise
+        """
+        manuscript = None
+        async for _, manuscript in self._add_section(manuscript_id, section_name):
+            pass
+        return manuscript
+
+    async def add_section_stream(self, manuscript_id: int, section_name: str) -> AsyncIterator[str]:
+        """Streaming variant of ``add_section``, yielding the manuscript text generated so far."""
+        async for text, _ in self._add_section(manuscript_id, section_name):
+            yield text
+
+    async def _add_section(self, manuscript_id: int,
+                           section_name: str) -> AsyncIterator[Tuple[str, Optional[Manuscript]]]:
+        manuscript = await self.get_manuscript(manuscript_id)
+        if not manuscript:
+            return
+        source = manuscript.source
+        context = await self._run(self.workflow._manuscript_context, source, section_name)
+        section = ""
+        async for chunk in self._ask_stream(SECTION_PROMPT.format(section_name=section_name), context):
+            section += chunk
+            yield f"{source}\n\n## {section_name.capitalize()}\n{section}", None
+        manuscript.append_section(section_name.capitalize(), strip_section_heading(section, section_name))
+        await self._save_manuscript(manuscript)
+        yield manuscript.source, manuscript
+
+    async def add_sections(self, manuscript_id: int, section_names: List[str],
+                           max_concurrency: int = 4) -> Optional[Manuscript]:
+        """Generate several sections concurrently and add them to a manuscript in a single save.
+
+        Args:
+            manuscript_id: ID of the manuscript to modify
+            section_names: Names of the sections to add, in manuscript order
+            max_concurrency: Maximum number of sections generated at the same time
+
+        Returns:
+            Updated Manuscript object if successful, None otherwise
+        """
+        manuscript = await self.get_manuscript(manuscript_id)
+        if not manuscript:
+            return None
+        names = outline_section_names(manuscript, section_names)
+        if not names:
+            return manuscript
+
+        context = await self._run(self.workflow._outline_context, manuscript.source, names)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def generate(name: str) -> str:
+            async with semaphore:
+                return "".join([chunk async for chunk in
+                                self._ask_stream(SECTION_PROMPT.format(section_name=name), context)])
+
+        sections = await asyncio.gather(*(generate(name) for name in names))
+        for name, section in zip(names, sections):
+            manuscript.append_section(name.capitalize(), strip_section_heading(section, name))
+        await self._save_manuscript(manuscript)
+        return manuscript
+
+    async def enhance_section(self, manuscript_id: int, section_name: str) -> Optional[Manuscript]:
+        """Enhance/improve an existing section in a manuscript.
+
+        Args:
+            manuscript_id: ID of the manuscript to modify
+            section_name: Name of the section to enhance
+
+        Returns:
+            Updated Manuscript object if successful, None otherwise
+        """
+        manuscript = None
+        async for _, manuscript in self._enhance_section(manuscript_id, section_name):
+            pass
+        return manuscript
+
+    async def enhance_section_stream(self, manuscript_id: int, section_name: str) -> AsyncIterator[str]:
+        """Streaming variant of ``enhance_section``, yielding the manuscript text generated so far."""
+        async for text, _ in self._enhance_section(manuscript_id, section_name):
+            yield text
+
+    async def _enhance_section(self, manuscript_id: int,
+                               section_name: str) -> AsyncIterator[Tuple[str, Optional[Manuscript]]]:
+        manuscript = await self.get_manuscript(manuscript_id)
+        if not manuscript:
+            return
+        section = manuscript.get_section(section_slug(section_name))
+        if section is None:
+            async for item in self._add_section(manuscript_id, section_name):
+                yield item
+            return
+        context = await self._run(self.workflow._manuscript_context, manuscript.source, section_name)
+        position = manuscript.sections.index(section)
+        before = "".join(s.content for s in manuscript.sections[:position]) + section.heading
+        after = "".join(s.content for s in manuscript.sections[position + 1:])
+        enhanced_section = ""
+        async for chunk in self._ask_stream(ENHANCE_PROMPT.format(section_name=section_name), context):
+            enhanced_section += chunk
+            yield before + enhanced_section + after, None
+        section.set_body(enhanced_section)
+        await self._save_manuscript(manuscript)
+        yield manuscript.source, manuscript
+
+    async def criticize_section(self, manuscript_id: int, section_name: str) -> str:
+        """Get critical feedback on a manuscript section.
+
+        Args:
+            manuscript_id: ID of the manuscript containing the section
+            section_name: Name of the section to critique
+
+        Returns:
+            String containing critical feedback
+        """
+        criticized_section = ""
+        async for criticized_section in self.criticize_section_stream(manuscript_id, section_name):
+            pass
+        return criticized_section
+
+    async def criticize_section_stream(self, manuscript_id: int, section_name: str) -> AsyncIterator[str]:
+        """Streaming variant of ``criticize_section``, yielding the feedback generated so far."""
+        context = await self._run(self.workflow._manuscript_context, await self.get_manuscript_text(manuscript_id),
+                                  section_name)
+        criticized_section = ""
+        async for chunk in self._ask_stream(CRITIQUE_PROMPT.format(section_name=section_name), context):
+            criticized_section += chunk
+            yield criticized_section
+
+    async def criticize_sections(self, manuscript_id: int, section_names: Optional[List[str]] = None,
+                                 max_concurrency: int = 4) -> AsyncIterator[Tuple[str, str]]:
+        """Get critical feedback on several sections concurrently, from one manuscript snapshot.
+
+        Args:
+            manuscript_id: ID of the manuscript containing the sections
+            section_names: Sections to critique; all sections (without the title) if not given
+            max_concurrency: Maximum number of critiques generated at the same time
+
+        Yields:
+            ``(section_name, critique)`` pairs, in the order the critiques complete
+        """
+        source = await self.get_manuscript_text(manuscript_id)
+        if section_names is None:
+            section_names = [name for name in parse_manuscript_text(source) if name != "title"]
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def critique(name: str) -> Tuple[str, str]:
+            async with semaphore:
+                context = await self._run(self.workflow._manuscript_context, source, name)
+                return name, "".join([chunk async for chunk in
+                                      self._ask_stream(CRITIQUE_PROMPT.format(section_name=name), context)])
+
+        for result in asyncio.as_completed([critique(name) for name in section_names]):
+            yield await result
+
+    async def _save_manuscript(self, manuscript: Manuscript) -> Manuscript:
+        """Save a manuscript to the database, writing only changed section rows.
+
+        Args:
+            manuscript: Manuscript object to save
+
+        Returns:
+            Saved Manuscript object
+        """
+        async with self._session(expire_on_commit=False) as session:
+            manuscript.last_updated = datetime.datetime.now()
+            session.add(manuscript)
+            await session.commit()
+        await self._run(self.workflow._refresh_summaries, manuscript)
+        return manuscript
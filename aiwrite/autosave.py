@@ -0,0 +1,127 @@
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+import loguru
+
+logger = loguru.logger
+
+
+class AutosaveWriter:
+    """Coalesces manuscript edits and writes them from a background thread.
+
+    Every ``submit`` replaces the pending text of that manuscript, and the text is
+    written once no new edit has arrived for ``idle_seconds``. Only the latest
+    text of a burst of edits reaches the database.
+
+    Attributes:
+        idle_seconds: Time without edits after which pending text is written
+        submitted: Number of edits received
+        written: Number of writes performed
+    """
+
+    def __init__(self, save: Callable[[int, str], None], idle_seconds: float = 1.5):
+        """Start the writer thread.
+
+        Args:
+            save: Function writing the text of a manuscript, e.g. ``Workflow.update_from_text``
+            idle_seconds: Idle window over which edits are coalesced
+        """
+        self._save = save
+        self.idle_seconds = idle_seconds
+        self.submitted = 0
+        self.written = 0
+        self._pending: Dict[int, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="aiwrite-autosave", daemon=True)
+        self._thread.start()
+
+    @property
+    def saved_writes(self) -> int:
+        """Number of writes avoided by coalescing edits."""
+        with self._lock:
+            return self.submitted - self.written - len(self._pending)
+
+    def submit(self, manuscript_id: int, text: str) -> None:
+        """Queue the current text of a manuscript for writing.
+
+        Args:
+            manuscript_id: ID of the manuscript being edited
+            text: Complete Markdown text of the manuscript
+        """
+        with self._wakeup:
+            if self._closed:
+                raise RuntimeError("AutosaveWriter is closed")
+            self._pending[manuscript_id] = (text, time.monotonic() + self.idle_seconds)
+            self.submitted += 1
+            self._wakeup.notify()
+
+    def flush(self) -> int:
+        """Write all pending edits immediately.
+
+        Edits that fail to be written stay pending and are retried.
+
+        Returns:
+            Number of manuscripts written
+        """
+        with self._write_lock:
+            with self._lock:
+                due = self._pending
+                self._pending = {}
+            return self._write(due)
+
+    def close(self) -> None:
+        """Write pending edits and stop the writer thread."""
+        with self._wakeup:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        self.flush()
+        with self._lock:
+            lost = len(self._pending)
+        if lost:
+            logger.error(f"Autosave: edits of {lost} manuscripts could not be written")
+        logger.info(f"Autosave: {self.written} writes for {self.submitted} edits "
+                    f"({self.saved_writes} writes saved)")
+
+    def _write(self, due: Dict[int, Tuple[str, float]]) -> int:
+        written = 0
+        for manuscript_id, (text, _) in due.items():
+            try:
+                self._save(manuscript_id, text)
+            except Exception as exc:
+                logger.error(f"Autosave of manuscript {manuscript_id} failed, retrying: {exc}")
+                with self._wakeup:
+                    # Retried after the idle window, unless a newer edit replaced it meanwhile
+                    if manuscript_id not in self._pending:
+                        self._pending[manuscript_id] = (text, time.monotonic() + self.idle_seconds)
+                        self._wakeup.notify()
+                continue
+            written += 1
+        with self._lock:
+            self.written += written
+        return written
+
+    def _run(self) -> None:
+        while True:
+            with self._wakeup:
+                while not self._closed:
+                    now = time.monotonic()
+                    deadline = min((d for _, d in self._pending.values()), default=None)
+                    if deadline is not None and deadline <= now:
+                        break
+                    self._wakeup.wait(None if deadline is None else deadline - now)
+                if self._closed:
+                    return
+            with self._write_lock:
+                with self._lock:
+                    now = time.monotonic()
+                    due = {k: v for k, v in self._pending.items() if v[1] <= now}
+                    for manuscript_id in due:
+                        del self._pending[manuscript_id]
+                self._write(due)
@@ -0,0 +1,126 @@
+import re
+from dataclasses import dataclass
+from typing import List, NamedTuple, Sequence
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+
+class Page(NamedTuple):
+    """Text extracted from one page of a document.
+
+    Attributes:
+        number: Zero-based page number
+        text: Text of the page
+    """
+    number: int
+    text: str
+
+
+@dataclass(frozen=True)
+class ChunkingConfig:
+    """How documents are cut into chunks before embedding.
+
+    Attributes:
+        chunk_tokens: Target number of tokens per chunk, 0 embeds whole pages
+        overlap_tokens: Number of tokens repeated from the end of the previous chunk
+    """
+    chunk_tokens: int = 384
+    overlap_tokens: int = 64
+
+
+class Chunk(NamedTuple):
+    """A piece of document text with its provenance.
+
+    Attributes:
+        text: Text of the chunk, pages joined by a newline
+        page_start: Number of the page the chunk starts on
+        page_end: Number of the page the chunk ends on
+        start: Character offset of the chunk in the text of its first page
+        end: Character offset of the end of the chunk in the text of its last page
+    """
+    text: str
+    page_start: int
+    page_end: int
+    start: int
+    end: int
+
+
+class _Span(NamedTuple):
+    page: int
+    start: int
+    end: int
+    tokens: int
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text, counting words and punctuation marks
+    :param text: Text to measure
+    :return: Approximate number of tokens
+    """
+    return len(_TOKEN.findall(text))
+
+
+def _sentences(page: Page, max_tokens: int) -> List[_Span]:
+    """Split a page into sentences, cutting sentences longer than ``max_tokens`` at token boundaries."""
+    spans = []
+    start = 0
+    breaks = [(m.start(), m.end()) for m in _SENTENCE_BREAK.finditer(page.text)] + [(len(page.text), len(page.text))]
+    for end, next_start in breaks:
+        tokens = list(_TOKEN.finditer(page.text, start, end))
+        for first in range(0, len(tokens), max_tokens):
+            piece = tokens[first:first + max_tokens]
+            spans.append(_Span(page.number, piece[0].start(), piece[-1].end(), len(piece)))
+        start = next_start
+    return spans
+
+
+def _chunk(pages: Sequence[Page], spans: List[_Span]) -> Chunk:
+    texts = {page.number: page.text for page in pages}
+    first, last = spans[0], spans[-1]
+    parts = []
+    for number in range(first.page, last.page + 1):
+        if number not in texts:
+            continue
+        start = first.start if number == first.page else 0
+        end = last.end if number == last.page else len(texts[number].rstrip())
+        parts.append(texts[number][start:end])
+    return Chunk("\n".join(parts), first.page, last.page, first.start, last.end)
+
+
+def chunk_pages(pages: Sequence[Page], config: ChunkingConfig) -> List[Chunk]:
+    """
+    Cut a run of pages into overlapping chunks of about ``config.chunk_tokens`` tokens.
+
+    Chunks end on sentence boundaries and may span pages, so short pages are
+    merged with their neighbours. Only sentences longer than a chunk are cut
+    mid-sentence.
+    :param pages: Consecutive pages of a document
+    :param config: Chunk size and overlap
+    :return: Chunks in document order
+    """
+    if not config.chunk_tokens:
+        return [Chunk(page.text, page.number, page.number, 0, len(page.text)) for page in pages]
+    spans = [span for page in pages for span in _sentences(page, config.chunk_tokens)]
+    chunks = []
+    first = 0
+    while first < len(spans):
+        last, tokens = first, spans[first].tokens
+        while last + 1 < len(spans) and tokens + spans[last + 1].tokens <= config.chunk_tokens:
+            last += 1
+            tokens += spans[last].tokens
+        chunks.append(_chunk(pages, spans[first:last + 1]))
+        if last + 1 == len(spans):
+            break
+        # Start the next chunk with the trailing sentences that fit in the overlap
+        next_first, overlap = last + 1, 0
+        while next_first - 1 > first and overlap + spans[next_first - 1].tokens <= config.overlap_tokens:
+            next_first -= 1
+            overlap += spans[next_first].tokens
+        # but leave room for at least one new sentence
+        while next_first <= last and overlap + spans[last + 1].tokens > config.chunk_tokens:
+            overlap -= spans[next_first].tokens
+            next_first += 1
+        first = next_first
+    return chunks
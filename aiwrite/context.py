@@ -0,0 +1,285 @@
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import loguru
+
+from aiwrite.chunking import estimate_tokens
+
+logger = loguru.logger
+
+_WORD = re.compile(r"\w{3,}")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+#: Looks up the summary of a section from its slug and content, None when there is none yet
+SummaryLookup = Callable[[str, str], Optional[str]]
+
+
+@dataclass
+class ContextStats:
+    """What a manuscript context kept of the manuscript, for one model call.
+
+    Attributes:
+        section: Slug of the section the call works on
+        budget: Token budget of the manuscript part of the context, 0 for no limit
+        full_tokens: Tokens of the whole manuscript
+        tokens: Tokens of the manuscript part actually sent
+        full_sections: Slugs of the sections sent in full
+        summarized: Slugs of the sections replaced by a summary
+        dropped: Slugs of the sections left out
+    """
+    section: str
+    budget: int
+    full_tokens: int
+    tokens: int = 0
+    full_sections: List[str] = field(default_factory=list)
+    summarized: List[str] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.full_tokens - self.tokens
+
+    def __str__(self) -> str:
+        return (f"context for {self.section or 'title'}: {self.tokens}/{self.full_tokens} tokens "
+                f"({self.saved_tokens} saved), {len(self.full_sections)} full, "
+                f"{len(self.summarized)} summarized, {len(self.dropped)} dropped")
+
+
+def lead_summary(content: str, max_tokens: int = 60) -> str:
+    """
+    Shorten a section to its heading and leading sentences, when no summary is available
+    :param content: Markdown text of the section, including its heading
+    :param max_tokens: Maximum number of tokens of the summary body
+    :return: Heading followed by the first sentences fitting in ``max_tokens``
+    """
+    heading, _, body = content.strip().partition("\n") if content.lstrip().startswith("## ") else ("", "", content)
+    lead, tokens = [], 0
+    for sentence in _SENTENCE_END.split(" ".join(body.split())):
+        tokens += estimate_tokens(sentence)
+        if tokens > max_tokens and lead:
+            break
+        lead.append(sentence)
+    return "\n".join(part for part in (heading, " ".join(lead)) if part)
+
+
+def _relevance(content: str, target: Counter) -> float:
+    """Share of the words of the target found in a section."""
+    if not target:
+        return 0.0
+    words = set(_WORD.findall(content.lower()))
+    return sum(count for word, count in target.items() if word in words) / target.total()
+
+
+class ContextBuilder:
+    """Fits the manuscript part of model contexts in a token budget.
+
+    The title block, the abstract and the section being worked on are always
+    sent in full. Then, in priority order, the neighbouring sections and the
+    other sections sharing the most words with the target are added in full
+    while they fit; the rest are replaced by their summary, and left out when
+    even that does not fit. A manuscript within the budget is sent unchanged.
+
+    Attributes:
+        budget: Maximum tokens of the manuscript part of a context, 0 for no limit
+        summaries: Lookup of cached section summaries; sections without one are cut to their leading sentences
+        calls: Number of contexts built
+        tokens_sent: Manuscript tokens sent over all calls
+        tokens_saved: Manuscript tokens left out over all calls
+        last: Statistics of the most recent context
+    """
+    ALWAYS = ("", "abstract")
+
+    def __init__(self, budget: int = 6000, summaries: Optional[SummaryLookup] = None):
+        """Initialize the builder.
+
+        Args:
+            budget: Maximum tokens of the manuscript part of a context, 0 for no limit
+            summaries: Lookup of cached section summaries by slug and content
+        """
+        self.budget = budget
+        self.summaries = summaries
+        self.calls = 0
+        self.tokens_sent = 0
+        self.tokens_saved = 0
+        self.last: Optional[ContextStats] = None
+        self._lock = threading.Lock()
+
+    def _summary(self, slug: str, content: str) -> str:
+        summary = self.summaries(slug, content) if self.summaries is not None else None
+        if not summary:
+            return lead_summary(content)
+        heading = content.strip().partition("\n")[0] if slug else ""
+        return "\n".join(part for part in (heading, summary.strip()) if part)
+
+    def _priority(self, sections: Sequence[Tuple[str, str]], target: int, words: Counter) -> List[int]:
+        """Positions of the optional sections, most important first."""
+        optional = [i for i, (slug, _) in enumerate(sections) if i != target and slug not in self.ALWAYS]
+        anchor = target if target >= 0 else len(sections)
+        return sorted(optional, key=lambda i: (abs(i - anchor) > 1, -_relevance(sections[i][1], words), i))
+
+    def build(self, sections: Sequence[Tuple[str, str]], section_name: str) -> Tuple[str, ContextStats]:
+        """Assemble the manuscript text to send for working on one section.
+
+        Args:
+            sections: ``(slug, content)`` pairs of the manuscript, as from ``split_manuscript_sections``
+            section_name: Slug of the section worked on, which may not exist yet
+
+        Returns:
+            Manuscript text and statistics of what was kept
+        """
+        full = "".join(content for _, content in sections)
+        sizes = [estimate_tokens(content) for _, content in sections]
+        stats = ContextStats(section_name, self.budget, sum(sizes))
+        if not self.budget or stats.full_tokens <= self.budget:
+            stats.tokens = stats.full_tokens
+            stats.full_sections = [slug for slug, _ in sections]
+            return self._record(full, stats)
+
+        target = next((i for i, (slug, _) in enumerate(sections) if slug == section_name), -1)
+        words = Counter(_WORD.findall(section_name.lower()))
+        if target >= 0:
+            words.update(_WORD.findall(sections[target][1].lower()))
+        parts: List[Optional[str]] = [None] * len(sections)
+        used = 0
+        for i, (slug, content) in enumerate(sections):
+            if i == target or slug in self.ALWAYS:
+                parts[i] = content
+                used += sizes[i]
+        priority = self._priority(sections, target, words)
+        for i in priority:
+            if used + sizes[i] <= self.budget:
+                parts[i] = sections[i][1]
+                used += sizes[i]
+        summarized = set()
+        for i in priority:
+            if parts[i] is None:
+                summary = self._summary(*sections[i])
+                tokens = estimate_tokens(summary)
+                if used + tokens <= self.budget:
+                    parts[i] = f"\n\n{summary}\n"
+                    used += tokens
+                    summarized.add(i)
+        for i, (slug, _) in enumerate(sections):
+            kept = stats.dropped if parts[i] is None else stats.summarized if i in summarized else stats.full_sections
+            kept.append(slug)
+        stats.tokens = used
+        return self._record("".join(part for part in parts if part is not None), stats)
+
+    def _record(self, text: str, stats: ContextStats) -> Tuple[str, ContextStats]:
+        with self._lock:
+            self.calls += 1
+            self.tokens_sent += stats.tokens
+            self.tokens_saved += stats.saved_tokens
+            self.last = stats
+        if stats.saved_tokens:
+            logger.debug(str(stats))
+        return text, stats
+
+
+@dataclass
+class PrefixStats:
+    """How much of a model context repeats the start of a recent context of the same model.
+
+    Providers and local servers with prefix caching skip re-processing that part.
+
+    Attributes:
+        model: Name of the model
+        tokens: Tokens of the context
+        reused_tokens: Tokens of the longest prefix shared with a recent context
+        hit: Whether the shared prefix is long enough to be cached by providers
+    """
+    model: str
+    tokens: int
+    reused_tokens: int
+    hit: bool
+
+    def __str__(self) -> str:
+        return (f"prefix {'hit' if self.hit else 'miss'} for {self.model}: "
+                f"{self.reused_tokens}/{self.tokens} context tokens reused")
+
+
+def common_prefix_length(first: str, second: str) -> int:
+    """
+    Length of the longest common prefix of two strings
+    :param first: A string
+    :param second: Another string
+    :return: Number of leading characters the strings share
+    """
+    low, high = 0, min(len(first), len(second))
+    # Binary search, comparing slices instead of looping over characters
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class PrefixTracker:
+    """Records how well consecutive model contexts share a cacheable prefix.
+
+    The last ``history`` contexts of each model are kept, since concurrent calls
+    interleave. A call is a hit when it shares at least ``min_tokens`` leading
+    tokens with one of them, the minimum prefix providers cache.
+
+    Attributes:
+        min_tokens: Shared prefix tokens needed for a hit
+        calls: Number of contexts recorded
+        hits: Number of contexts sharing a cacheable prefix
+        tokens: Context tokens over all calls
+        reused_tokens: Shared prefix tokens over all calls
+        last: Statistics of the most recent context
+    """
+
+    def __init__(self, min_tokens: int = 1024, history: int = 4):
+        """Initialize the tracker.
+
+        Args:
+            min_tokens: Shared prefix tokens needed for a hit
+            history: Number of recent contexts kept per model
+        """
+        self.min_tokens = min_tokens
+        self.history = history
+        self.calls = 0
+        self.hits = 0
+        self.tokens = 0
+        self.reused_tokens = 0
+        self.last: Optional[PrefixStats] = None
+        self._recent: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.calls if self.calls else 0.0
+
+    def record(self, model: str, context: str) -> PrefixStats:
+        """Record the context of a model call.
+
+        Args:
+            model: Name of the model
+            context: Complete context sent with the call
+
+        Returns:
+            Prefix statistics of the call
+        """
+        with self._lock:
+            recent = self._recent.setdefault(model, [])
+            shared = max((common_prefix_length(context, previous) for previous in recent), default=0)
+            if context in recent:
+                recent.remove(context)
+            recent.append(context)
+            del recent[:-self.history]
+        reused = estimate_tokens(context[:shared])
+        stats = PrefixStats(model, estimate_tokens(context), reused, reused > 0 and reused >= self.min_tokens)
+        with self._lock:
+            self.calls += 1
+            self.hits += stats.hit
+            self.tokens += stats.tokens
+            self.reused_tokens += stats.reused_tokens
+            self.last = stats
+        logger.debug(str(stats))
+        return stats
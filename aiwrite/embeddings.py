@@ -0,0 +1,194 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from aiwrite.sqlitecache import SQLiteLRUCache
+
+
+class Embedder(ABC):
+    """Computes embedding vectors for texts.
+
+    Attributes:
+        model: Name of the embedding model
+    """
+    model: str = ""
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed texts.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            One float32 row per text
+        """
+
+
+class HTTPEmbedder(Embedder):
+    """Embeds texts through the provider API serving the embedding model.
+
+    Gemini models go to the Generative Language API, ``text-embedding-*``
+    models to an OpenAI-compatible endpoint (``OPENAI_BASE_URL``), and anything
+    else to Ollama (``OLLAMA_HOST``). All texts of a call are sent in one request.
+    """
+
+    def __init__(self, model: str, timeout: float = 120.0):
+        """Initialize the embedder.
+
+        Args:
+            model: Name of the embedding model
+            timeout: Request timeout in seconds
+        """
+        # httpx takes a while to import and is only needed once texts are embedded
+        import httpx
+        self.model = model
+        self._client = httpx.Client(timeout=timeout)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        # text-embedding-004/005 are Gemini models, other text-embedding-* ones are OpenAI's
+        if self.model.startswith("gemini") or self.model.startswith("text-embedding-00"):
+            vectors = self._gemini(texts)
+        elif self.model.startswith("text-embedding"):
+            vectors = self._openai(texts)
+        else:
+            vectors = self._ollama(texts)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _post(self, url: str, payload: dict, headers: Optional[dict] = None) -> dict:
+        response = self._client.post(url, json=payload, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    def _gemini(self, texts: Sequence[str]) -> List[List[float]]:
+        key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY", "")
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:batchEmbedContents"
+        payload = {"requests": [{"model": f"models/{self.model}", "content": {"parts": [{"text": text}]}}
+                                for text in texts]}
+        return [item["values"] for item in self._post(url, payload, {"x-goog-api-key": key})["embeddings"]]
+
+    def _openai(self, texts: Sequence[str]) -> List[List[float]]:
+        base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+        # Local OpenAI-compatible servers need no key
+        key = os.getenv("OPENAI_API_KEY")
+        headers = {"Authorization": f"Bearer {key}"} if key else {}
+        data = self._post(f"{base_url}/embeddings", {"model": self.model, "input": list(texts)}, headers)["data"]
+        return [item["embedding"] for item in sorted(data, key=lambda item: item["index"])]
+
+    def _ollama(self, texts: Sequence[str]) -> List[List[float]]:
+        host = os.getenv("OLLAMA_HOST", "http://localhost:11434").rstrip("/")
+        if "://" not in host:
+            host = f"http://{host}"
+        return self._post(f"{host}/api/embed", {"model": self.model, "input": list(texts)})["embeddings"]
+
+
+class EmbeddingCache(SQLiteLRUCache):
+    """On-disk cache of embedding vectors keyed by embedding model and text hash.
+
+    Vectors are stored as raw float32 bytes in a SQLite file. When the stored
+    vectors exceed ``max_bytes``, the least recently used ones are evicted.
+
+    Attributes:
+        path: Path of the cache file
+        max_bytes: Size cap of the stored vectors
+        hits: Number of vectors served from the cache
+        misses: Number of vectors not found in the cache
+        evictions: Number of vectors evicted
+    """
+    table = "embedding"
+    key_columns = ("model", "text_hash")
+    size_expression = "LENGTH(vector)"
+    label = "Embedding cache"
+
+    def __init__(self, path: str, max_bytes: int = 512 * 2 ** 20):
+        """Open or create the cache.
+
+        Args:
+            path: Path of the cache file
+            max_bytes: Size cap of the stored vectors
+        """
+        super().__init__(path, max_bytes, "model TEXT NOT NULL, text_hash BLOB NOT NULL, vector BLOB NOT NULL")
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def get(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Look up the vectors of texts.
+
+        Args:
+            model: Name of the embedding model
+            texts: Texts to look up
+
+        Returns:
+            The cached vector of each text, or None
+        """
+        keys = [self.text_hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT text_hash, vector FROM embedding WHERE model = ? AND text_hash IN "
+                    f"({','.join('?' * len(part))})", [model, *part]).fetchall()
+                found.update(rows)
+            if found:
+                clock = self._tick()
+                self._db.executemany("UPDATE embedding SET last_used = ? WHERE model = ? AND text_hash = ?",
+                                     [(clock, model, key) for key in found])
+                self._db.commit()
+            hits = sum(key in found for key in keys)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+
+    def put(self, model: str, texts: Sequence[str], vectors: np.ndarray) -> None:
+        """Store the vectors of texts, evicting old vectors beyond the size cap.
+
+        Args:
+            model: Name of the embedding model
+            texts: Embedded texts
+            vectors: One vector per text
+        """
+        rows = [(model, self.text_hash(text), np.asarray(vector, dtype=np.float32).tobytes())
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            clock = self._tick()
+            for model_name, key, blob in rows:
+                self._resize((model_name, key), len(blob))
+            self._db.executemany("INSERT OR REPLACE INTO embedding VALUES (?, ?, ?, ?)",
+                                 [(*row, clock) for row in rows])
+            self._evict()
+            self._db.commit()
+
+
+class CachedEmbedder(Embedder):
+    """Serves embeddings from an `EmbeddingCache`, computing only the missing ones."""
+
+    def __init__(self, embedder: Embedder, cache: EmbeddingCache):
+        """Wrap an embedder.
+
+        Args:
+            embedder: Embedder computing the vectors missing from the cache
+            cache: Cache of computed vectors
+        """
+        self.embedder = embedder
+        self.cache = cache
+        self.model = embedder.model
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        cached = self.cache.get(self.model, texts)
+        missing = sorted({text for text, vector in zip(texts, cached) if vector is None})
+        if missing:
+            computed = self.embedder.embed(missing)
+            self.cache.put(self.model, missing, computed)
+            fresh = dict(zip(missing, computed))
+            cached = [fresh[text] if vector is None else vector for text, vector in zip(texts, cached)]
+        if not cached:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(cached).astype(np.float32, copy=False)
@@ -0,0 +1,194 @@
+import datetime
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import loguru
+from sqlalchemy import Engine
+from sqlmodel import Field, Session, SQLModel, select
+
+from aiwrite.ingest import IngestStats, file_hash
+
+logger = loguru.logger
+
+#: File extensions picked up when scanning a documents folder
+DOCUMENT_EXTENSIONS = (".pdf",)
+
+
+class FolderManifest(SQLModel, table=True):
+    """A file of a project's documents folder as seen by the last scan.
+
+    Attributes:
+        id: Unique identifier of the record
+        project_id: ID of the project owning the folder, 0 outside of projects
+        path: Absolute path of the file
+        size: File size in bytes
+        mtime: Modification time of the file
+        content_hash: Hash of the file contents
+        last_scanned: Timestamp of the scan that recorded the file
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    project_id: int = Field(default=0, index=True)
+    path: str = Field(index=True)
+    size: int
+    mtime: float
+    content_hash: str
+    last_scanned: datetime.datetime = Field(default_factory=datetime.datetime.now, nullable=False)
+
+
+@dataclass
+class ScanReport:
+    """Outcome of a folder scan.
+
+    Attributes:
+        folder: Scanned folder
+        added: Files seen for the first time
+        modified: Files whose contents changed
+        removed: Files deleted since the previous scan
+        unchanged: Number of files left untouched
+        failed: Files that could not be ingested or dropped, tried again by the next scan
+        ingested: Ingestion statistics of the added and modified files
+        seconds: Duration of the scan
+    """
+    folder: str
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    failed: List[str] = field(default_factory=list)
+    ingested: List[IngestStats] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+    def __str__(self) -> str:
+        return (f"{len(self.added)} added, {len(self.modified)} modified, {len(self.removed)} removed, "
+                f"{self.unchanged} unchanged, {len(self.failed)} failed in {self.seconds:.1f}s")
+
+
+def list_documents(folder: str) -> Dict[str, os.stat_result]:
+    """
+    List the documents below a folder
+    :param folder: Folder to walk
+    :return: File status by absolute path
+    """
+    found = {}
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.lower().endswith(DOCUMENT_EXTENSIONS):
+                path = os.path.abspath(os.path.join(root, name))
+                found[path] = os.stat(path)
+    return found
+
+
+def scan_folder(engine: Engine, folder: str, project_id: int, ingest: Callable[[str], IngestStats],
+                forget: Callable[[str], None]) -> ScanReport:
+    """
+    Bring the knowledge base in line with the contents of a folder.
+
+    Files whose size and modification time match the manifest are not read at
+    all. Other files are hashed, and only new contents are handed to ``ingest``.
+    Files no longer present are handed to ``forget``. A file whose ingestion
+    or removal fails is reported in ``failed`` and keeps its manifest entry,
+    so the next scan tries it again, while the scan goes on with the others.
+    :param engine: Database engine holding the manifest
+    :param folder: Documents folder
+    :param project_id: ID of the project owning the folder, 0 outside of projects
+    :param ingest: Function embedding a file
+    :param forget: Function dropping the embeddings of a file
+    :return: Report of the changes found
+    """
+    started = time.perf_counter()
+    report = ScanReport(folder=folder)
+    root = os.path.join(os.path.abspath(folder), "")
+    on_disk = list_documents(folder)
+    with Session(engine) as session:
+        entries = {entry.path: entry for entry in session.exec(
+            select(FolderManifest).where(FolderManifest.project_id == project_id)).all()
+                   if entry.path.startswith(root)}
+        for path, stat in on_disk.items():
+            entry = entries.get(path)
+            if entry is not None and entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+                report.unchanged += 1
+                continue
+            try:
+                content_hash = file_hash(path)
+                if entry is None or entry.content_hash != content_hash:
+                    stats = ingest(path)
+            except Exception as exc:
+                logger.error(f"Could not ingest {path}: {exc}")
+                report.failed.append(path)
+                continue
+            if entry is None:
+                entry = FolderManifest(project_id=project_id, path=path, size=0, mtime=0, content_hash="")
+                report.added.append(path)
+            elif entry.content_hash != content_hash:
+                report.modified.append(path)
+            else:
+                report.unchanged += 1
+            if entry.content_hash != content_hash:
+                report.ingested.append(stats)
+            entry.size, entry.mtime, entry.content_hash = stat.st_size, stat.st_mtime, content_hash
+            entry.last_scanned = datetime.datetime.now()
+            session.add(entry)
+            # Commit per file, so an interrupted scan keeps the files already ingested
+            session.commit()
+        for path in sorted(set(entries) - set(on_disk)):
+            try:
+                forget(path)
+            except Exception as exc:
+                logger.error(f"Could not drop {path}: {exc}")
+                report.failed.append(path)
+                continue
+            session.delete(entries[path])
+            session.commit()
+            report.removed.append(path)
+    report.seconds = time.perf_counter() - started
+    logger.info(f"Scanned {folder}: {report}")
+    return report
+
+
+class FolderWatcher:
+    """Re-scans a folder periodically from a background thread.
+
+    Attributes:
+        interval: Seconds between scans
+        last_report: Report of the most recent scan
+    """
+
+    def __init__(self, scan: Callable[[], ScanReport], interval: float = 30.0,
+                 on_change: Optional[Callable[[ScanReport], None]] = None):
+        """Start watching.
+
+        Args:
+            scan: Function scanning the folder, e.g. ``Workflow.rescan_folder``
+            interval: Seconds between scans
+            on_change: Called with the report of scans that found changes
+        """
+        self._scan = scan
+        self.interval = interval
+        self._on_change = on_change
+        self.last_report: Optional[ScanReport] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="aiwrite-folder-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching, waiting for a running scan to finish."""
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.last_report = self._scan()
+                if self.last_report.changed and self._on_change is not None:
+                    self._on_change(self.last_report)
+            except Exception as exc:
+                logger.error(f"Folder scan failed: {exc}")
+            self._stop.wait(self.interval)
@@ -3,36 +3,58 @@ import os
 import base64
 import io
 import traceback
-from typing import List, Optional, Tuple
+from functools import partial
+from typing import AsyncIterator, List, Optional, Tuple
 
 import gradio as gr
 from PIL import Image
 
-from aiwrite.workflow import Workflow, Project
+from aiwrite.async_workflow import AsyncWorkflow
+from aiwrite.workflow import Workflow, Project, parse_manuscript_text
 
 
 class GradioAIWrite:
     def __init__(self, db_path, dburl):
-        self.workflow = Workflow(model='gemini-2.5-flash', dburl=dburl,#f'sqlite:///{db_path}/aiwrite.db',
+        self.model = 'gemini-2.5-flash'
+        # Base de conhecimento com uma coleção padrão, conectada no primeiro uso
+        self.workflow = Workflow(model=self.model, dburl=dburl,#f'sqlite:///{db_path}/aiwrite.db',
                                  db_path=db_path,
+                                 collection_name="Literatura",
                                  embedding_model="gemini-embedding-001"
                                  )
+        self.aworkflow = AsyncWorkflow(self.workflow)
         self.db_path = db_path
         self.current_manuscript_id = None
         self.current_section = None
-        self.available_models = self.workflow.libby.llm.available_models
-
-        # Inicializar a base de conhecimento com uma coleção padrão
-        try:
-            self.workflow.set_knowledge_base("Literatura")  # ou qualquer nome padrão
-        except Exception as e:
-            print(f"Aviso: Não foi possível inicializar a base de conhecimento: {str(e)}")
+        self._available_models: Optional[List[str]] = None
+
+    @property
+    def available_models(self) -> List[str]:
+        """Models of the AI client, listed on first use as that builds the client"""
+        if self._available_models is None:
+            self._available_models = self.workflow.libby.llm.available_models
+        return self._available_models
+
+    def on_load(self) -> Tuple[dict, dict, dict, dict, dict]:
+        """Work left for after the page is drawn: resume interrupted ingestion and fill the lists"""
+        # Retomar incorporações interrompidas na última execução
+        self.workflow.resume_ingestion()
+        return (gr.update(choices=self.available_models),
+                gr.update(choices=self.get_manuscripts_list()),
+                gr.update(choices=self.get_projects_list()),
+                gr.update(choices=self.get_collections_list()),
+                gr.update(value=[[doc[0].split('/')[-1], doc[1]] for doc in self.get_embedded_documents()]))
 
     def get_manuscripts_list(self) -> List[Tuple[str, int]]:
         """Get list of manuscripts for dropdown"""
         manuscripts = self.workflow.get_man_list()
         return [(f"{m.id} - {m.source.split('\n')[0]}", m.id) for m in manuscripts]
 
+    async def aget_manuscripts_list(self) -> List[Tuple[str, int]]:
+        """Get list of manuscripts for dropdown, without blocking the event loop"""
+        manuscripts = await self.aworkflow.get_man_list()
+        return [(f"{m.id} - {m.source.split('\n')[0]}", m.id) for m in manuscripts]
+
     def get_projects_list(self) -> List[Tuple[str, int]]:
         """Get list of projects for dropdown"""
         projects = self.workflow.get_projects()
@@ -77,33 +99,35 @@ class GradioAIWrite:
         except Exception as e:
             return f"Erro ao atualizar prompt base: {str(e)}"
 
-    def create_manuscript(self, concept: str, i18n: gr.I18n) -> Tuple[str, gr.Dropdown]:
-        """Create new manuscript"""
+    async def create_manuscript(self, concept: str, i18n: gr.I18n) -> AsyncIterator[Tuple[str, gr.Dropdown, str]]:
+        """Create new manuscript, streaming its text into the editor"""
         if not concept.strip():
-            return i18n("enter_valid_concept"), gr.Dropdown()
+            yield i18n("enter_valid_concept"), gr.Dropdown(), gr.update()
+            return
 
         try:
-            manuscript = self.workflow.setup_manuscript(concept)
+            manuscript = None
+            async for text, manuscript in self.aworkflow.setup_manuscript_progress(concept):
+                yield gr.update(), gr.update(), text
             self.current_manuscript_id = manuscript.id
-            manuscripts_list = self.get_manuscripts_list()
-            return i18n("manuscript_created")+f" {manuscript.id}", gr.Dropdown(choices=manuscripts_list)
+            manuscripts_list = await self.aget_manuscripts_list()
+            yield (i18n("manuscript_created")+f" {manuscript.id}", gr.Dropdown(choices=manuscripts_list),
+                   manuscript.source)
         except Exception as exc:
             tb = repr(traceback.format_exception(exc))
-            manuscripts_list = self.get_manuscripts_list()
-            return i18n("error_creating_manuscript")+ f": {tb}", gr.Dropdown(choices=manuscripts_list)
+            manuscripts_list = await self.aget_manuscripts_list()
+            yield i18n("error_creating_manuscript")+ f": {tb}", gr.Dropdown(choices=manuscripts_list), gr.update()
 
-    def load_manuscript(self, manuscript_id: int, i18n: gr.I18n) -> Tuple[str, str, gr.Dropdown, gr.Dropdown]:
+    async def load_manuscript(self, manuscript_id: int, i18n: gr.I18n) -> Tuple[str, str, gr.Dropdown, gr.Dropdown]:
         """Load manuscript and return its content"""
         if not manuscript_id:
             return i18n("select_manuscript_msg"), "", gr.Dropdown(), gr.Dropdown()
 
         try:
             self.current_manuscript_id = manuscript_id
-            manuscript = self.workflow.get_manuscript(manuscript_id)
-            sections = self.workflow.get_manuscript_sections(manuscript_id)
-            section_names = list(sections.keys())
-
-            content = self.workflow.get_manuscript_text(manuscript_id)
+            manuscript = await self.aworkflow.get_manuscript(manuscript_id)
+            content = manuscript.source
+            section_names = list(parse_manuscript_text(content).keys())
             return (f"Manuscrito carregado: {manuscript.source.split('\n')[0]}", content,
                     gr.Dropdown(choices=section_names, value=section_names[0] if section_names else None),
                     gr.Dropdown(choices=section_names, value=section_names[0] if section_names else None)
@@ -111,58 +135,93 @@ class GradioAIWrite:
         except Exception as e:
             return i18n("error_loading_manuscript") + str(e), "", gr.Dropdown(), gr.Dropdown()
 
-    def add_section(self, section_name: str, i18n: gr.I18n) -> Tuple[str, str]:
-        """Add new section to current manuscript"""
+    async def add_section(self, section_name: str, i18n: gr.I18n) -> AsyncIterator[Tuple[str, str]]:
+        """Add new section to current manuscript, streaming it into the editor"""
         if not self.current_manuscript_id:
-            return "Nenhum manuscrito selecionado."
+            yield "Nenhum manuscrito selecionado.", gr.update()
+            return
 
         if not section_name.strip():
-            return "Por favor, insira um nome para a seção."
+            yield "Por favor, insira um nome para a seção.", gr.update()
+            return
 
+        text = gr.update()
         try:
-            manuscript = self.workflow.add_section(self.current_manuscript_id, section_name.lower())
+            async for text in self.aworkflow.add_section_stream(self.current_manuscript_id, section_name.lower()):
+                yield gr.update(), text
+            yield f"Seção '{section_name}' adicionada com sucesso!", text
+        except Exception as e:
+            yield f"Erro ao adicionar seção: {str(e)}", text
+
+    async def add_sections(self, outline: str, i18n: gr.I18n) -> Tuple[str, str]:
+        """Generate all sections of a comma-separated outline concurrently"""
+        if not self.current_manuscript_id:
+            return "Nenhum manuscrito selecionado.", gr.update()
+
+        section_names = [name.strip() for name in outline.split(",") if name.strip()]
+        if not section_names:
+            return "Por favor, insira um nome para a seção.", gr.update()
 
-            self.load_manuscript(manuscript_id=manuscript.id, i18n=i18n)
-            return f"Seção '{section_name}' adicionada com sucesso!", manuscript.source
+        try:
+            manuscript = await self.aworkflow.add_sections(self.current_manuscript_id, section_names)
+            return i18n("sections_generated") + f" {', '.join(section_names)}", manuscript.source
         except Exception as e:
-            return f"Erro ao adicionar seção: {str(e)}", manuscript.source
+            return f"Erro ao adicionar seção: {str(e)}", gr.update()
 
-    def enhance_section(self, section_name: str) -> str:
-        """Enhance existing section"""
+    async def enhance_section(self, section_name: str) -> AsyncIterator[str]:
+        """Enhance existing section, streaming the result into the editor"""
         if not self.current_manuscript_id:
-            return "Nenhum manuscrito selecionado."
+            yield "Nenhum manuscrito selecionado."
+            return
 
         if not section_name:
-            return "Selecione uma seção."
+            yield "Selecione uma seção."
+            return
 
         try:
-            self.workflow.enhance_section(self.current_manuscript_id, section_name)
-            content = self.workflow.get_manuscript_text(self.current_manuscript_id)
-            return content
+            async for text in self.aworkflow.enhance_section_stream(self.current_manuscript_id, section_name):
+                yield text
         except Exception as e:
-            return f"Erro ao melhorar seção: {str(e)}"
+            yield f"Erro ao melhorar seção: {str(e)}"
 
-    def criticize_section(self, section_name: str) -> str:
-        """Get critique for a section"""
+    async def criticize_section(self, section_name: str) -> AsyncIterator[str]:
+        """Get critique for a section, streamed as it is generated"""
         if not self.current_manuscript_id:
-            return "Nenhum manuscrito selecionado."
+            yield "Nenhum manuscrito selecionado."
+            return
 
         if not section_name:
-            return "Selecione uma seção."
+            yield "Selecione uma seção."
+            return
 
         try:
-            critique = self.workflow.criticize_section(self.current_manuscript_id, section_name)
-            return critique
+            async for critique in self.aworkflow.criticize_section_stream(self.current_manuscript_id, section_name):
+                yield critique
         except Exception as e:
-            return f"Erro ao criticar seção: {str(e)}"
+            yield f"Erro ao criticar seção: {str(e)}"
 
-    def update_manuscript_text(self, text: str) -> str:
+    async def criticize_all_sections(self, max_concurrency: float) -> AsyncIterator[str]:
+        """Critique every section concurrently, showing each critique as it arrives"""
+        if not self.current_manuscript_id:
+            yield "Nenhum manuscrito selecionado."
+            return
+
+        critiques = {}
+        try:
+            async for section_name, critique in self.aworkflow.criticize_sections(
+                    self.current_manuscript_id, max_concurrency=int(max_concurrency)):
+                critiques[section_name] = critique
+                yield "\n\n".join(f"### {name}\n{text}" for name, text in critiques.items())
+        except Exception as e:
+            yield f"Erro ao criticar seção: {str(e)}"
+
+    async def update_manuscript_text(self, text: str) -> str:
         """Update manuscript with new text"""
         if not self.current_manuscript_id:
             return "Nenhum manuscrito selecionado."
 
         try:
-            self.workflow.update_from_text(self.current_manuscript_id, text)
+            await self.aworkflow.update_from_text(self.current_manuscript_id, text)
             return "Manuscrito atualizado com sucesso!"
         except Exception as e:
             return f"Erro ao atualizar manuscrito: {str(e)}"
@@ -194,14 +253,14 @@ class GradioAIWrite:
         except Exception as e:
             return f"Erro ao preparar download: {str(e)}", None
 
-    def delete_manuscript(self, manuscript_id: int) -> Tuple[str, gr.Dropdown]:
+    async def delete_manuscript(self, manuscript_id: int) -> Tuple[str, gr.Dropdown]:
         """Delete manuscript"""
         if not manuscript_id:
             return "Selecione um manuscrito para deletar.", gr.Dropdown()
 
         try:
-            self.workflow.delete_manuscript(manuscript_id)
-            manuscripts_list = self.get_manuscripts_list()
+            await self.aworkflow.delete_manuscript(manuscript_id)
+            manuscripts_list = await self.aget_manuscripts_list()
             if manuscript_id == self.current_manuscript_id:
                 self.current_manuscript_id = None
             return "Manuscrito deletado com sucesso!", gr.Dropdown(choices=manuscripts_list)
@@ -248,8 +307,8 @@ class GradioAIWrite:
     def get_embedded_documents(self) -> List[Tuple[str, str]]:
         """Get list of embedded documents from knowledge base"""
         try:
-            # Garantir que a KB está inicializada
-            if not hasattr(self.workflow, 'KB') or self.workflow.KB is None:
+            # Garantir que há uma coleção selecionada, sem conectar a KB
+            if not self.workflow.collection_name:
                 self.workflow.set_knowledge_base("Literatura")
 
             doc_list = self.workflow.KB.get_embedded_documents()
@@ -261,8 +320,8 @@ class GradioAIWrite:
     def get_collections_list(self) -> List[str]:
         """Get list of existing collections from knowledge base"""
         try:
-            # Garantir que a KB está inicializada
-            if not hasattr(self.workflow, 'KB') or self.workflow.KB is None:
+            # Garantir que há uma coleção selecionada, sem conectar a KB
+            if not self.workflow.collection_name:
                 self.workflow.set_knowledge_base("Literatura")
 
             # Obter todas as coleções únicas dos documentos
@@ -284,30 +343,50 @@ class GradioAIWrite:
         df_data = [[doc] for doc in documents] if documents else []
         return gr.Dataframe(value=df_data, headers=["Nome", "Coleção"])
 
-    def embed_document(self, file, collection_name: str) -> Tuple[str, gr.Dataframe]:
-        """Embed document into knowledge base"""
+    async def get_ingestion_jobs(self) -> gr.Dataframe:
+        """Get the table of background ingestion jobs"""
+        rows = []
+        for job in await self.aworkflow.get_ingestion_jobs():
+            eta = job.eta_seconds
+            rows.append([job.id, os.path.basename(job.file_name), job.collection_name, job.status,
+                         f"{job.pages_done}/{job.pages_total}" if job.pages_total else "",
+                         f"{eta:.0f}s" if eta is not None else "", job.message])
+        return gr.Dataframe(value=rows, headers=["ID", "Nome", "Coleção", "Status", "Páginas", "ETA", "Mensagem"],
+                            interactive=False)
+
+    async def queue_document(self, file, collection_name: str) -> Tuple[str, gr.Dataframe]:
+        """Queue document for background embedding into knowledge base"""
         if not file:
-            return "Selecione um arquivo.", gr.Dataframe()
+            return "Selecione um arquivo.", gr.update()
 
         if not collection_name.strip():
-            return "Por favor, especifique um nome para a coleção.", gr.Dataframe()
+            return "Por favor, especifique um nome para a coleção.", gr.update()
 
         try:
-            # Set the knowledge base collection before embedding
-            self.workflow.set_knowledge_base(collection_name.strip())
-            self.workflow.embed_document(file.name)
-            documents = self.get_embedded_documents()
-            df_data = [[doc[0].split("/")[-1], doc[1]] for doc in documents] if documents else []
-            return (
-                f"Documento '{os.path.basename(file.name)}' incorporado com sucesso na coleção '{collection_name}'!",
-                gr.Dataframe(value=df_data, headers=["Nome", "Coleção"], interactive=False, max_height=500))
+            job = await self.aworkflow.queue_document(file.name, collection_name.strip())
+            return (f"Documento '{os.path.basename(file.name)}' adicionado à fila de incorporação "
+                    f"(tarefa {job.id})."), await self.get_ingestion_jobs()
         except Exception as e:
-            df_data= locals().get('df_data', [])
-            return f"Erro ao incorporar documento: {str(e)}", gr.Dataframe(value=df_data,
-                                                                           headers=["Nome", "Coleção"],
-                                                                           interactive=False,
-                                                                           max_height=500
-                                                                           )
+            return f"Erro ao incorporar documento: {str(e)}", gr.update()
+
+    async def poll_ingestion_jobs(self, completed: int) -> Tuple[gr.Dataframe, gr.Dataframe, int]:
+        """Refresh the job table, and the documents list when jobs have completed"""
+        jobs = await self.get_ingestion_jobs()
+        now_completed = self.workflow.ingestion_queue.completed
+        if now_completed == completed:
+            return jobs, gr.update(), completed
+        documents = self.get_embedded_documents()
+        df_data = [[doc[0].split("/")[-1], doc[1]] for doc in documents] if documents else []
+        return (jobs, gr.Dataframe(value=df_data, headers=["Nome", "Coleção"], interactive=False, max_height=500),
+                now_completed)
+
+    async def cancel_ingestion_job(self, job_id) -> Tuple[str, gr.Dataframe]:
+        """Cancel a background ingestion job"""
+        if not job_id:
+            return "Informe o ID da tarefa.", gr.update()
+        if await self.aworkflow.cancel_ingestion_job(int(job_id)):
+            return f"Tarefa {int(job_id)} cancelada.", await self.get_ingestion_jobs()
+        return f"Tarefa {int(job_id)} não está ativa.", await self.get_ingestion_jobs()
 
 
 def create_interface(db_path, dburl, logo):
@@ -368,8 +447,9 @@ def create_interface(db_path, dburl, logo):
 
                         # Load manuscript
                         with gr.Row():
+                            # As listas são preenchidas depois que a página é exibida, ver on_load
                             manuscripts_dropdown = gr.Dropdown(
-                                choices=app.get_manuscripts_list(),
+                                choices=[],
                                 label=i18n("select_manuscript"),
                                 interactive=True,
                                 scale=4
@@ -389,6 +469,11 @@ def create_interface(db_path, dburl, logo):
                                                             placeholder=i18n("section_placeholder"))
                             add_section_btn = gr.Button(i18n("add_section"))
 
+                        with gr.Row():
+                            outline_input = gr.Textbox(label=i18n("outline_sections"),
+                                                       placeholder=i18n("outline_placeholder"))
+                            outline_btn = gr.Button(i18n("generate_outline"))
+
                         enhance_btn = gr.Button(i18n("enhance_selected_section"))
 
                         with gr.Row():
@@ -421,6 +506,11 @@ def create_interface(db_path, dburl, logo):
                     review_sections_dropdown = gr.Dropdown(label=i18n("section_to_review"), interactive=True)
                     criticize_btn = gr.Button(i18n("criticize_section"))
 
+                with gr.Row():
+                    review_concurrency = gr.Slider(minimum=1, maximum=16, value=4, step=1,
+                                                   label=i18n("review_concurrency"))
+                    criticize_all_btn = gr.Button(i18n("review_all_sections"))
+
                 critique_output = gr.Textbox(
                     label=i18n("section_critique"),
                     lines=15,
@@ -440,9 +530,10 @@ def create_interface(db_path, dburl, logo):
                             value="pt",
                             label="Idioma"
                         )
+                        # Os modelos são listados depois que a página é exibida, ver on_load
                         project_model = gr.Dropdown(
-                            choices=app.available_models,
-                            value=app.available_models[0],
+                            choices=[app.model],
+                            value=app.model,
                             label="Modelo de IA",
                             allow_custom_value="True",
                             interactive=True
@@ -462,7 +553,7 @@ def create_interface(db_path, dburl, logo):
                     with gr.Column():
                         gr.Markdown("### Carregar Projeto Existente")
                         projects_dropdown = gr.Dropdown(
-                            choices=app.get_projects_list(),
+                            choices=[],
                             label="Projetos Existentes"
                         )
                         load_project_btn = gr.Button("Carregar Projeto")
@@ -475,7 +566,7 @@ def create_interface(db_path, dburl, logo):
                     with gr.Column(scale=1):
                         file_upload = gr.File(label="Carregar Documento")
                         collection_name_dropdown = gr.Dropdown(
-                            choices=app.get_collections_list(),
+                            choices=["Literatura"],
                             value="Literatura",
                             label="Nome da Coleção",
                             info="Selecione uma coleção existente ou digite um novo nome",
@@ -486,21 +577,25 @@ def create_interface(db_path, dburl, logo):
 
                     with gr.Column(scale=2):
                         gr.Markdown("### Documentos Incorporados")
-                        # Inicializar com dados atuais em vez de chamar a função diretamente
-                        try:
-                            initial_documents = [[doc[0].split('/')[-1], doc[1]] for doc in
-                                                 app.get_embedded_documents()]
-                        except:
-                            initial_documents = []
-
                         documents_display = gr.Dataframe(
                             headers=["Nome", "Coleção"],
-                            value=initial_documents,
+                            value=[],
                             interactive=False,
                             max_height=500
                         )
                         refresh_docs_btn = gr.Button("Atualizar Lista")
 
+                gr.Markdown("### Fila de Incorporação")
+                ingestion_jobs_display = gr.Dataframe(
+                    headers=["ID", "Nome", "Coleção", "Status", "Páginas", "ETA", "Mensagem"],
+                    interactive=False
+                )
+                with gr.Row():
+                    cancel_job_id = gr.Number(label="ID da Tarefa", precision=0)
+                    cancel_job_btn = gr.Button("Cancelar Tarefa")
+                completed_jobs = gr.State(0)
+                jobs_timer = gr.Timer(2.0)
+
         # Download file component (hidden)
         download_file = gr.File(visible=False)
         
@@ -516,14 +611,14 @@ def create_interface(db_path, dburl, logo):
 
         # Event handlers
         create_btn.click(
-            lambda concept: app.create_manuscript(concept, i18n),
+            partial(app.create_manuscript, i18n=i18n),
             inputs=[concept_input],
-            outputs=[status_text, manuscripts_dropdown]
+            outputs=[status_text, manuscripts_dropdown, manuscript_editor]
         )
 
         # Carregar manuscrito automaticamente ao selecionar no dropdown
         manuscripts_dropdown.change(
-            lambda manuscript_id: app.load_manuscript(manuscript_id, i18n),
+            partial(app.load_manuscript, i18n=i18n),
             inputs=[manuscripts_dropdown],
             outputs=[status_text, manuscript_editor, sections_dropdown, review_sections_dropdown]
         ).then(
@@ -533,11 +628,17 @@ def create_interface(db_path, dburl, logo):
         )
 
         add_section_btn.click(
-            lambda section_name: app.add_section(section_name, i18n),
+            partial(app.add_section, i18n=i18n),
             inputs=[section_name_input],
             outputs=[status_text, manuscript_editor]
         )
 
+        outline_btn.click(
+            partial(app.add_sections, i18n=i18n),
+            inputs=[outline_input],
+            outputs=[status_text, manuscript_editor]
+        )
+
         enhance_btn.click(
             app.enhance_section,
             inputs=[sections_dropdown],
@@ -587,6 +688,12 @@ def create_interface(db_path, dburl, logo):
             outputs=[critique_output]
         )
 
+        criticize_all_btn.click(
+            app.criticize_all_sections,
+            inputs=[review_concurrency],
+            outputs=[critique_output]
+        )
+
         create_project_btn.click(
             app.create_project,
             inputs=[project_name_input, project_language, project_model],
@@ -619,11 +726,23 @@ def create_interface(db_path, dburl, logo):
             outputs=[status_text]
         )
 
-        # Incorporar documento automaticamente após upload
+        # Incorporar documento em segundo plano após upload
         file_upload.change(
-            app.embed_document,
+            app.queue_document,
             inputs=[file_upload, collection_name_dropdown],
-            outputs=[status_text, documents_display]
+            outputs=[status_text, ingestion_jobs_display]
+        )
+
+        jobs_timer.tick(
+            app.poll_ingestion_jobs,
+            inputs=[completed_jobs],
+            outputs=[ingestion_jobs_display, documents_display, completed_jobs]
+        )
+
+        cancel_job_btn.click(
+            app.cancel_ingestion_job,
+            inputs=[cancel_job_id],
+            outputs=[status_text, ingestion_jobs_display]
         )
 
         refresh_docs_btn.click(
@@ -654,15 +773,9 @@ def create_interface(db_path, dburl, logo):
             outputs=[]
         )
 
-        # Carregar documentos na inicialização
-        interface.load(
-            lambda: gr.Dataframe(
-                value=[[doc[0].split('/')[-1], doc[1]] for doc in app.get_embedded_documents()],
-                headers=["nome", "Coleção"],
-                interactive=False
-            ),
-            outputs=[documents_display]
-        )
+        # Carregar modelos, manuscritos, projetos e documentos na inicialização
+        interface.load(app.on_load, outputs=[project_model, manuscripts_dropdown, projects_dropdown,
+                                             collection_name_dropdown, documents_display])
 
     return interface, i18n
 
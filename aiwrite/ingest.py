@@ -0,0 +1,659 @@
+import datetime
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import loguru
+from sqlalchemy import Engine, delete
+from sqlmodel import Field, Session, SQLModel, select
+
+from aiwrite.chunking import Chunk, ChunkingConfig, Page, chunk_pages
+
+logger = loguru.logger
+
+
+@dataclass
+class IngestStats:
+    """Throughput report of a document ingestion.
+
+    Attributes:
+        document: Name of the ingested document
+        pages: Number of pages in the document
+        chunks: Number of chunks sent to the embedding backend
+        batches: Number of embedding batches
+        skipped: Number of pages skipped because they were already embedded
+        removed: Number of pages whose previous embeddings were dropped
+        duplicate_of: Name of an already embedded document with the same content
+        extract_seconds: Time spent extracting text
+        seconds: Total ingestion time
+    """
+    document: str
+    pages: int = 0
+    chunks: int = 0
+    batches: int = 0
+    skipped: int = 0
+    removed: int = 0
+    duplicate_of: Optional[str] = None
+    extract_seconds: float = 0.0
+    seconds: float = 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.seconds if self.seconds else 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        if self.duplicate_of:
+            return f"{os.path.basename(self.document)}: already embedded as {os.path.basename(self.duplicate_of)}"
+        return (f"{os.path.basename(self.document)}: {self.pages} pages, {self.chunks} chunks, "
+                f"{self.skipped} skipped in {self.seconds:.1f}s "
+                f"({self.pages_per_second:.1f} pages/s, {self.chunks_per_second:.1f} chunks/s)")
+
+
+class IngestedDocument(SQLModel, table=True):
+    """A document embedded into a knowledge base collection.
+
+    Attributes:
+        id: Unique identifier of the record
+        collection_name: Knowledge base collection the document was embedded into
+        embedding_model: Embedding model that produced the vectors
+        name: Document name as passed to the embedding backend
+        content_hash: Hash of the file contents, empty until ingestion completed
+        chunking: Chunking settings the document was cut with
+        pages: Number of pages of the document
+        last_updated: Timestamp of the last ingestion
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    collection_name: str = Field(index=True)
+    embedding_model: str
+    name: str = Field(index=True)
+    content_hash: str = Field(default="", index=True)
+    chunking: str = ""
+    pages: int = 0
+    last_updated: datetime.datetime = Field(default_factory=datetime.datetime.now, nullable=False)
+
+
+class IngestedPage(SQLModel, table=True):
+    """Content hash of an embedded page.
+
+    Attributes:
+        id: Unique identifier of the record
+        document_id: ID of the document the page belongs to
+        page_number: Zero-based page number
+        content_hash: Hash of the page text
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    document_id: int = Field(foreign_key="ingesteddocument.id", index=True)
+    page_number: int
+    content_hash: str
+
+
+class IngestedChunk(SQLModel, table=True):
+    """Provenance of an embedded chunk.
+
+    Attributes:
+        id: Unique identifier of the record
+        document_id: ID of the document the chunk was cut from
+        page_start: Number of the page the chunk starts on
+        page_end: Number of the page the chunk ends on
+        start: Character offset of the chunk in the text of its first page
+        end: Character offset of the end of the chunk in the text of its last page
+        content_hash: Hash of the chunk text
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    document_id: int = Field(foreign_key="ingesteddocument.id", index=True)
+    page_start: int
+    page_end: int
+    start: int
+    end: int
+    content_hash: str
+
+
+#: Storage formats of the vectors of a collection in the local index
+QUANTIZATIONS = ("none", "float16", "int8")
+
+
+class CollectionSettings(SQLModel, table=True):
+    """Ingestion and storage settings of a knowledge base collection.
+
+    Attributes:
+        collection_name: Name of the collection
+        chunk_tokens: Target number of tokens per chunk, 0 embeds whole pages
+        overlap_tokens: Number of tokens shared by consecutive chunks
+        quantization: Storage format of the vectors in the local index, one of `QUANTIZATIONS`
+        rescore: Whether quantized vectors are re-scored with float32 copies
+    """
+    collection_name: str = Field(primary_key=True)
+    chunk_tokens: int = ChunkingConfig.chunk_tokens
+    overlap_tokens: int = ChunkingConfig.overlap_tokens
+    quantization: str = "none"
+    rescore: bool = True
+
+    @property
+    def chunking(self) -> ChunkingConfig:
+        return ChunkingConfig(self.chunk_tokens, self.overlap_tokens)
+
+
+def file_hash(file_name: str) -> str:
+    """
+    Hash the contents of a file
+    :param file_name: Path to the file
+    :return: Hex digest of the contents
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    """
+    Hash a piece of text
+    :param text: Text to hash
+    :return: Hex digest of the text
+    """
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class IngestLedger:
+    """Records what was embedded into a collection with a given embedding model.
+
+    Used by `IngestionPipeline` to skip documents and pages whose content was
+    already embedded. Pages are recorded as their blocks finish, so an
+    interrupted ingestion resumes where it stopped. Page hashes cover the
+    chunking settings, so changing them re-embeds the affected pages.
+    """
+
+    def __init__(self, engine: Engine, collection_name: str, embedding_model: str,
+                 chunking: ChunkingConfig = ChunkingConfig()):
+        """Initialize the ledger.
+
+        Args:
+            engine: Database engine holding the ledger tables
+            collection_name: Knowledge base collection
+            embedding_model: Embedding model used for the collection
+            chunking: Chunking settings of the collection
+        """
+        self.engine = engine
+        self.collection_name = collection_name
+        self.embedding_model = embedding_model
+        self.chunking = f"{chunking.chunk_tokens}/{chunking.overlap_tokens}"
+        self._lock = threading.Lock()
+
+    def page_hash(self, text: str) -> str:
+        """Hash the text of a page together with the chunking settings.
+
+        Args:
+            text: Text of the page
+
+        Returns:
+            Hex digest
+        """
+        return text_hash(f"{self.chunking}\0{text}")
+
+    def _documents(self):
+        return select(IngestedDocument).where(IngestedDocument.collection_name == self.collection_name,
+                                              IngestedDocument.embedding_model == self.embedding_model)
+
+    def find_duplicate(self, name: str, content_hash: str) -> Optional[str]:
+        """Find a completely embedded document with the given contents.
+
+        Args:
+            name: Name of the document being ingested
+            content_hash: Hash of its contents
+
+        Returns:
+            Name of the embedded document, or None
+        """
+        with Session(self.engine) as session:
+            document = session.exec(self._documents().where(IngestedDocument.content_hash == content_hash,
+                                                             IngestedDocument.chunking == self.chunking)).first()
+            return document.name if document else None
+
+    def page_hashes(self, name: str) -> Dict[int, str]:
+        """Get the content hashes of the embedded pages of a document.
+
+        Args:
+            name: Name of the document
+
+        Returns:
+            Content hash by page number
+        """
+        with Session(self.engine) as session:
+            document = session.exec(self._documents().where(IngestedDocument.name == name)).first()
+            if document is None:
+                return {}
+            pages = session.exec(select(IngestedPage).where(IngestedPage.document_id == document.id)).all()
+            return {page.page_number: page.content_hash for page in pages}
+
+    def _document(self, session: Session, name: str) -> IngestedDocument:
+        document = session.exec(self._documents().where(IngestedDocument.name == name)).first()
+        if document is None:
+            document = IngestedDocument(collection_name=self.collection_name,
+                                        embedding_model=self.embedding_model, name=name)
+            session.add(document)
+            session.flush()
+        return document
+
+    def record_pages(self, name: str, hashes: Dict[int, str]) -> None:
+        """Record pages of a document as embedded.
+
+        Args:
+            name: Name of the document
+            hashes: Content hash by page number
+        """
+        with self._lock, Session(self.engine) as session:
+            document = self._document(session, name)
+            session.exec(delete(IngestedPage).where(IngestedPage.document_id == document.id,
+                                                    IngestedPage.page_number.in_(list(hashes))))
+            session.add_all([IngestedPage(document_id=document.id, page_number=number, content_hash=content_hash)
+                             for number, content_hash in hashes.items()])
+            session.commit()
+
+    def record_chunks(self, name: str, chunks: List[Chunk]) -> None:
+        """Record the provenance of embedded chunks.
+
+        Args:
+            name: Name of the document
+            chunks: Embedded chunks
+        """
+        with self._lock, Session(self.engine) as session:
+            document = self._document(session, name)
+            session.add_all([IngestedChunk(document_id=document.id, page_start=chunk.page_start,
+                                           page_end=chunk.page_end, start=chunk.start, end=chunk.end,
+                                           content_hash=text_hash(chunk.text)) for chunk in chunks])
+            session.commit()
+
+    def get_chunks(self, name: str) -> List[IngestedChunk]:
+        """Get the provenance of the embedded chunks of a document.
+
+        Args:
+            name: Name of the document
+
+        Returns:
+            Chunks in document order
+        """
+        with Session(self.engine) as session:
+            document = session.exec(self._documents().where(IngestedDocument.name == name)).first()
+            if document is None:
+                return []
+            return list(session.exec(select(IngestedChunk).where(IngestedChunk.document_id == document.id)
+                                     .order_by(IngestedChunk.page_start, IngestedChunk.start)).all())
+
+    def embedded_documents(self) -> List[str]:
+        """Get the names of the documents with embedded chunks.
+
+        Returns:
+            Document names
+        """
+        with Session(self.engine) as session:
+            return list(session.exec(self._documents().with_only_columns(IngestedDocument.name).where(
+                IngestedDocument.id.in_(select(IngestedChunk.document_id)))).all())
+
+    def forget_pages(self, name: str, page_numbers: Iterable[int]) -> None:
+        """Remove pages of a document, and the chunks starting on them, from the ledger.
+
+        Args:
+            name: Name of the document
+            page_numbers: Numbers of the pages to remove
+        """
+        page_numbers = list(page_numbers)
+        with self._lock, Session(self.engine) as session:
+            document = self._document(session, name)
+            session.exec(delete(IngestedPage).where(IngestedPage.document_id == document.id,
+                                                    IngestedPage.page_number.in_(page_numbers)))
+            session.exec(delete(IngestedChunk).where(IngestedChunk.document_id == document.id,
+                                                     IngestedChunk.page_start.in_(page_numbers)))
+            session.commit()
+
+    def forget_document(self, name: str) -> List[int]:
+        """Remove a document from the ledger.
+
+        Args:
+            name: Name of the document
+
+        Returns:
+            Numbers of the pages that were recorded for the document
+        """
+        with self._lock, Session(self.engine) as session:
+            document = session.exec(self._documents().where(IngestedDocument.name == name)).first()
+            if document is None:
+                return []
+            pages = set(session.exec(select(IngestedPage.page_number)
+                                     .where(IngestedPage.document_id == document.id)).all())
+            pages.update(session.exec(select(IngestedChunk.page_start)
+                                      .where(IngestedChunk.document_id == document.id)).all())
+            session.exec(delete(IngestedPage).where(IngestedPage.document_id == document.id))
+            session.exec(delete(IngestedChunk).where(IngestedChunk.document_id == document.id))
+            session.delete(document)
+            session.commit()
+            return sorted(pages)
+
+    def reopen(self, name: str) -> None:
+        """Mark a document as incompletely embedded, before its embeddings are changed.
+
+        Until `complete` is called again, its previous contents are not found by `find_duplicate`.
+
+        Args:
+            name: Name of the document
+        """
+        with self._lock, Session(self.engine) as session:
+            document = session.exec(self._documents().where(IngestedDocument.name == name)).first()
+            if document is not None and document.content_hash:
+                document.content_hash = ""
+                session.add(document)
+                session.commit()
+
+    def complete(self, name: str, content_hash: str, pages: int) -> None:
+        """Mark a document as completely embedded.
+
+        Args:
+            name: Name of the document
+            content_hash: Hash of its contents
+            pages: Number of pages of the document
+        """
+        with self._lock, Session(self.engine) as session:
+            document = self._document(session, name)
+            document.content_hash = content_hash
+            document.chunking = self.chunking
+            document.pages = pages
+            document.last_updated = datetime.datetime.now()
+            session.add(document)
+            session.commit()
+
+
+def count_pages(file_name: str) -> int:
+    """
+    Count the pages of a document
+    :param file_name: Path to the document
+    :return: Number of pages, 0 for empty files
+    """
+    import fitz
+    try:
+        with fitz.open(file_name) as doc:
+            return doc.page_count
+    except fitz.EmptyFileError:
+        return 0
+
+
+def extract_pages(file_name: str, first: int, last: int) -> List[Page]:
+    """
+    Extract the text of a range of pages. Runs in a worker process.
+    :param file_name: Path to the document
+    :param first: First page number (inclusive)
+    :param last: Last page number (exclusive)
+    :return: Pages with their text, skipping pages without text
+    """
+    import fitz
+    pages = []
+    with fitz.open(file_name) as doc:
+        for number in range(first, last):
+            text = doc[number].get_text()
+            if text:
+                pages.append(Page(number, text))
+    return pages
+
+
+class IngestionCancelled(Exception):
+    """Raised when an ingestion is cancelled before completing."""
+
+
+EmbedBatch = Callable[[str, List[Chunk]], None]
+RemovePages = Callable[[str, List[int]], None]
+
+
+class _Block:
+    """Consecutive pages chunked together, and the count of their batches still being embedded."""
+
+    def __init__(self, pages: List[Page], page_count: int, batches: int):
+        self.pages = pages
+        self.page_count = page_count
+        self.pending = batches
+        self.lock = threading.Lock()
+
+
+class _IngestRun:
+    """State of one document ingestion, shared by the embedding threads."""
+
+    def __init__(self, file_name: str, embed_batch: EmbedBatch, remove_pages: Optional[RemovePages],
+                 ledger: Optional[IngestLedger], progress: Optional[Callable[[int, int], None]],
+                 cancel: Optional[threading.Event]):
+        self.file_name = file_name
+        self.embed_batch = embed_batch
+        self.remove_pages = remove_pages
+        self.ledger = ledger
+        self.progress = progress
+        self.cancel = cancel
+        self.stats = IngestStats(document=file_name)
+        self.done = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+    def advance(self, pages: int) -> None:
+        with self._lock:
+            self.done += pages
+            done = self.done
+        if self.progress is not None:
+            self.progress(done, self.stats.pages)
+
+    def embed(self, block: _Block, chunks: List[Chunk]) -> None:
+        if self.cancelled:
+            return
+        self.embed_batch(self.file_name, chunks)
+        if self.ledger is not None:
+            self.ledger.record_chunks(self.file_name, chunks)
+        with block.lock:
+            block.pending -= 1
+            finished = not block.pending
+        if finished:
+            self.finish(block)
+
+    def finish(self, block: _Block) -> None:
+        if self.ledger is not None:
+            self.ledger.record_pages(self.file_name, {page.number: self.ledger.page_hash(page.text)
+                                                      for page in block.pages})
+        self.advance(block.page_count)
+
+    def remove(self, page_numbers: List[int]) -> None:
+        if self.remove_pages is None:
+            logger.warning(f"{self.file_name}: the embedding backend cannot drop the previous embeddings "
+                           f"of {len(page_numbers)} changed or deleted pages")
+            return
+        self.remove_pages(self.file_name, page_numbers)
+
+    def forget(self, page_numbers: List[int]) -> None:
+        """Drop the embeddings and ledger records of pages."""
+        self.remove(page_numbers)
+        self.ledger.forget_pages(self.file_name, page_numbers)
+
+
+class IngestionPipeline:
+    """Extracts, chunks, batches and embeds documents.
+
+    Page text is extracted in a process pool, one page range per worker. As
+    ranges finish, their pages are cut into chunks, grouped into batches of
+    ``batch_size`` and handed to ``embed_batch`` on a thread pool of
+    ``max_concurrency`` workers, so extraction and embedding overlap.
+
+    Chunks may span pages, but never the boundary of a block of
+    ``BLOCK_PAGES`` pages. A block is the unit of change detection: when a
+    page changes, its whole block is embedded again.
+
+    Attributes:
+        batch_size: Number of chunks per embedding batch
+        max_concurrency: Maximum number of batches being embedded at the same time
+        extract_workers: Number of extraction processes
+        chunking: Default chunking settings
+    """
+
+    #: Documents with fewer pages are extracted in-process, a pool would cost more than it saves
+    MIN_PAGES_FOR_POOL = 32
+    #: Number of pages per block
+    BLOCK_PAGES = 8
+
+    def __init__(self, embed_batch: Optional[EmbedBatch] = None, batch_size: int = 16,
+                 max_concurrency: int = 4, extract_workers: Optional[int] = None,
+                 remove_pages: Optional[RemovePages] = None, chunking: ChunkingConfig = ChunkingConfig()):
+        """Initialize the pipeline.
+
+        Args:
+            embed_batch: Function embedding a batch of chunks of the named document
+            batch_size: Number of chunks per embedding batch
+            max_concurrency: Maximum number of batches being embedded at the same time
+            extract_workers: Number of extraction processes, defaults to the number of CPUs
+            remove_pages: Function dropping the embeddings of the chunks starting on pages of the named document
+            chunking: Default chunking settings
+        """
+        self.embed_batch = embed_batch
+        self.remove_pages = remove_pages
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.chunking = chunking
+        self._extract_pool: Optional[Executor] = None
+        self._extract_lock = threading.Lock()
+
+    def close(self) -> None:
+        """Shut down the extraction processes."""
+        with self._extract_lock:
+            if self._extract_pool is not None:
+                self._extract_pool.shutdown()
+                self._extract_pool = None
+
+    def _page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+        step = max(1, -(-page_count // (self.extract_workers * 4)))
+        step = -(-step // self.BLOCK_PAGES) * self.BLOCK_PAGES
+        return [(first, min(first + step, page_count)) for first in range(0, page_count, step)]
+
+    def _extractor(self) -> Executor:
+        with self._extract_lock:
+            if self._extract_pool is None:
+                self._extract_pool = ProcessPoolExecutor(max_workers=self.extract_workers,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+            return self._extract_pool
+
+    def _blocks(self, pages: List[Page]) -> Iterator[Tuple[range, List[Page]]]:
+        by_block: Dict[int, List[Page]] = {}
+        for page in pages:
+            by_block.setdefault(page.number // self.BLOCK_PAGES, []).append(page)
+        for index, block_pages in sorted(by_block.items()):
+            yield range(index * self.BLOCK_PAGES, (index + 1) * self.BLOCK_PAGES), block_pages
+
+    def ingest(self, file_name: str, batch_size: Optional[int] = None, max_concurrency: Optional[int] = None,
+               ledger: Optional[IngestLedger] = None, embed_batch: Optional[EmbedBatch] = None,
+               remove_pages: Optional[RemovePages] = None, progress: Optional[Callable[[int, int], None]] = None,
+               cancel: Optional[threading.Event] = None, chunking: Optional[ChunkingConfig] = None) -> IngestStats:
+        """Embed all pages of a document.
+
+        With a ledger, a document whose contents were already embedded is skipped
+        entirely, and otherwise only blocks with new or changed pages are
+        embedded. Since blocks are recorded as they finish, a cancelled
+        ingestion resumes where it stopped.
+
+        Args:
+            file_name: Path to the document
+            batch_size: Overrides the number of chunks per embedding batch
+            max_concurrency: Overrides the number of batches embedded at the same time
+            ledger: Record of the content already embedded, built with the same chunking settings
+            embed_batch: Overrides the function embedding a batch of chunks
+            remove_pages: Overrides the function dropping the embeddings of pages
+            progress: Called with the number of pages done and the total number of pages
+            cancel: Event stopping the ingestion when set
+            chunking: Overrides the chunking settings
+
+        Returns:
+            Throughput statistics of the ingestion
+
+        Raises:
+            IngestionCancelled: If ``cancel`` was set before all pages were embedded
+        """
+        batch_size = batch_size or self.batch_size
+        max_concurrency = max_concurrency or self.max_concurrency
+        chunking = chunking or self.chunking
+        run = _IngestRun(file_name, embed_batch or self.embed_batch, remove_pages or self.remove_pages,
+                         ledger, progress, cancel)
+        stats = run.stats
+        started = time.perf_counter()
+        stats.pages = count_pages(file_name)
+        if not stats.pages:
+            return stats
+        known: Dict[int, str] = {}
+        if ledger is not None:
+            content_hash = file_hash(file_name)
+            stats.duplicate_of = ledger.find_duplicate(file_name, content_hash)
+            if stats.duplicate_of:
+                stats.skipped = stats.pages
+                stats.seconds = time.perf_counter() - started
+                run.advance(stats.pages)
+                logger.info(f"Skipped {stats}")
+                return stats
+            known = ledger.page_hashes(file_name)
+            # A cancelled run would leave a mix of old and new embeddings under the old contents
+            ledger.reopen(file_name)
+        # Pages with embeddings, including chunks of blocks an interrupted run did not finish
+        recorded = set(known) | {chunk.page_start for chunk in ledger.get_chunks(file_name)} if ledger else set()
+        seen_blocks = set()
+
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="aiwrite-embed") as embedders:
+            pending = []
+            if stats.pages < self.MIN_PAGES_FOR_POOL:
+                extracted = [extract_pages(file_name, 0, stats.pages)]
+            else:
+                extractor = self._extractor()
+                extracted = (future.result() for future in as_completed(
+                    [extractor.submit(extract_pages, file_name, first, last)
+                     for first, last in self._page_ranges(stats.pages)]))
+            for pages in extracted:
+                if run.cancelled:
+                    break
+                for page_numbers, block_pages in self._blocks(pages):
+                    seen_blocks.add(page_numbers.start)
+                    page_count = min(page_numbers.stop, stats.pages) - page_numbers.start
+                    if ledger is not None:
+                        present = {page.number for page in block_pages}
+                        stale = [n for n in page_numbers if n in recorded]
+                        if all(known.get(page.number) == ledger.page_hash(page.text) for page in block_pages) \
+                                and all(n in present for n in stale):
+                            stats.skipped += len(block_pages)
+                            run.advance(page_count)
+                            continue
+                        if stale:
+                            run.forget(list(page_numbers))
+                            stats.removed += len(stale)
+                    chunks = chunk_pages(block_pages, chunking)
+                    batches = [chunks[start:start + batch_size] for start in range(0, len(chunks), batch_size)]
+                    block = _Block(block_pages, page_count, len(batches))
+                    if not batches:
+                        run.finish(block)
+                    for batch in batches:
+                        pending.append(embedders.submit(run.embed, block, batch))
+                        stats.chunks += len(batch)
+                        stats.batches += 1
+            stats.extract_seconds = time.perf_counter() - started
+            for future in as_completed(pending):
+                future.result()
+
+        if run.cancelled:
+            raise IngestionCancelled(f"Ingestion of {file_name} cancelled after {run.done} of {stats.pages} pages")
+        if ledger is not None:
+            gone = sorted(n for n in recorded if n - n % self.BLOCK_PAGES not in seen_blocks)
+            if gone:
+                run.forget(gone)
+                stats.removed += len(gone)
+            ledger.complete(file_name, content_hash, stats.pages)
+        stats.seconds = time.perf_counter() - started
+        run.advance(stats.pages - run.done)
+        logger.info(f"Ingested {stats}")
+        return stats
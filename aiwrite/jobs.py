@@ -0,0 +1,266 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import loguru
+from sqlalchemy import Engine, and_, or_, update
+from sqlmodel import Field, Session, SQLModel, select
+
+from aiwrite.ingest import IngestionCancelled, IngestStats
+
+logger = loguru.logger
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+#: Minimum seconds between two progress writes of a job
+PROGRESS_INTERVAL = 0.5
+#: Seconds without progress after which a running job is taken to be abandoned by its process
+STALE_AFTER = 600.0
+
+
+class IngestionJob(SQLModel, table=True):
+    """A document waiting for or undergoing ingestion into the knowledge base.
+
+    Attributes:
+        id: Unique identifier of the job
+        file_name: Path to the document
+        collection_name: Knowledge base collection to embed into
+        status: One of queued, running, done, failed or cancelled
+        pages_total: Number of pages of the document, 0 until known
+        pages_done: Number of pages embedded or skipped so far
+        message: Outcome of the job, or the error that ended it
+        created: Timestamp when the job was submitted
+        started: Timestamp when the job last started running
+        finished: Timestamp when the job ended
+        heartbeat: Timestamp of the last progress of a running job
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    file_name: str
+    collection_name: str
+    status: str = Field(default=QUEUED, index=True)
+    pages_total: int = 0
+    pages_done: int = 0
+    message: str = ""
+    created: datetime.datetime = Field(default_factory=datetime.datetime.now, nullable=False, index=True)
+    started: Optional[datetime.datetime] = None
+    finished: Optional[datetime.datetime] = None
+    heartbeat: Optional[datetime.datetime] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """Estimated seconds until the job finishes, based on its progress so far."""
+        if self.status != RUNNING or not self.pages_done or not self.started:
+            return None
+        elapsed = (datetime.datetime.now() - self.started).total_seconds()
+        return elapsed * (self.pages_total - self.pages_done) / self.pages_done
+
+
+IngestJob = Callable[[IngestionJob, Callable[[int, int], None], threading.Event], IngestStats]
+
+
+class IngestionQueue:
+    """Runs ingestion jobs on a pool of background threads.
+
+    Jobs are persisted in the ``IngestionJob`` table, so jobs that were queued
+    or running when the application stopped are picked up again by `resume`.
+    Several queues may share the table: each job is claimed by the queue that
+    starts it, and a running job is only taken over once it has made no
+    progress for ``stale_after`` seconds.
+
+    Attributes:
+        completed: Number of jobs that ended since the queue was created
+    """
+
+    def __init__(self, engine: Engine, ingest: IngestJob, max_workers: int = 2, stale_after: float = STALE_AFTER):
+        """Initialize the queue.
+
+        Args:
+            engine: Database engine holding the job table
+            ingest: Function running a job, given the job, a progress callback and a cancellation event
+            max_workers: Number of jobs processed at the same time
+            stale_after: Seconds without progress after which a running job is taken over
+        """
+        self.engine = engine
+        self.stale_after = stale_after
+        self._ingest = ingest
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aiwrite-ingest")
+        self._cancel: Dict[int, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.completed = 0
+
+    def submit(self, file_name: str, collection_name: str) -> IngestionJob:
+        """Queue a document for ingestion.
+
+        Args:
+            file_name: Path to the document
+            collection_name: Knowledge base collection to embed into
+
+        Returns:
+            The queued job
+        """
+        with Session(self.engine, expire_on_commit=False) as session:
+            job = IngestionJob(file_name=file_name, collection_name=collection_name)
+            session.add(job)
+            session.commit()
+        self._schedule(job.id)
+        return job
+
+    def resume(self) -> int:
+        """Queue again the jobs left unfinished by a previous run.
+
+        Returns:
+            Number of jobs resumed
+        """
+        with Session(self.engine) as session:
+            ids = session.exec(select(IngestionJob.id).where(IngestionJob.status.in_([QUEUED, RUNNING]))
+                               .order_by(IngestionJob.id)).all()
+        ids = [job_id for job_id in ids if job_id not in self._cancel]
+        for job_id in ids:
+            self._schedule(job_id)
+        if ids:
+            logger.info(f"Resumed {len(ids)} ingestion jobs")
+        return len(ids)
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancel a queued or running job. Pages already embedded are kept.
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            Whether the job was still active
+        """
+        with Session(self.engine) as session:
+            job = session.get(IngestionJob, job_id)
+            if job is None or not job.active:
+                return False
+            with self._lock:
+                event = self._cancel.get(job_id)
+                if event is not None:
+                    event.set()
+            if job.status == QUEUED:
+                self._finish(session, job, CANCELLED, "Cancelled")
+            return True
+
+    def get_jobs(self, n: int = 50) -> List[IngestionJob]:
+        """Get the most recent jobs.
+
+        Args:
+            n: Maximum number of jobs to return
+
+        Returns:
+            Jobs, most recent first
+        """
+        with Session(self.engine) as session:
+            return list(session.exec(select(IngestionJob).order_by(IngestionJob.id.desc()).limit(n)).all())
+
+    def shutdown(self, cancel: bool = True) -> None:
+        """Stop the worker threads.
+
+        Args:
+            cancel: Whether to cancel running jobs instead of waiting for them. They are resumed on the next start.
+        """
+        self._stopping = True
+        if cancel:
+            with self._lock:
+                for event in self._cancel.values():
+                    event.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _schedule(self, job_id: int) -> None:
+        with self._lock:
+            self._cancel[job_id] = threading.Event()
+        self._executor.submit(self._run, job_id)
+
+    def _finish(self, session: Session, job: IngestionJob, status: str, message: str) -> None:
+        job.status = status
+        job.message = message
+        job.finished = datetime.datetime.now()
+        session.add(job)
+        session.commit()
+        with self._lock:
+            self.completed += 1
+
+    def _claim(self, session: Session, job_id: int) -> bool:
+        """Mark a job as running, unless another queue is running it already.
+
+        Returns:
+            Whether the job was claimed
+        """
+        now = datetime.datetime.now()
+        stale = now - datetime.timedelta(seconds=self.stale_after)
+        # A single conditional update, so that of several queues only one claims the job
+        result = session.exec(update(IngestionJob).where(
+            IngestionJob.id == job_id,
+            or_(IngestionJob.status == QUEUED,
+                and_(IngestionJob.status == RUNNING,
+                     or_(IngestionJob.heartbeat.is_(None), IngestionJob.heartbeat < stale)))
+        ).values(status=RUNNING, started=now, heartbeat=now))
+        session.commit()
+        return result.rowcount == 1
+
+    def _run(self, job_id: int) -> None:
+        with self._lock:
+            cancel = self._cancel[job_id]
+        try:
+            with Session(self.engine, expire_on_commit=False) as session:
+                job = session.get(IngestionJob, job_id)
+                if job is None or not job.active:
+                    return
+                if cancel.is_set():
+                    if not self._stopping:
+                        self._finish(session, job, CANCELLED, "Cancelled")
+                    return
+                if not self._claim(session, job_id):
+                    logger.info(f"Ingestion of {job.file_name} is already running")
+                    return
+                session.refresh(job)
+                last_write = 0.0
+
+                def progress(done: int, total: int) -> None:
+                    nonlocal last_write
+                    now = time.monotonic()
+                    if now - last_write < PROGRESS_INTERVAL and done < total:
+                        return
+                    last_write = now
+                    with Session(self.engine) as progress_session:
+                        row = progress_session.get(IngestionJob, job_id)
+                        row.pages_done, row.pages_total = done, total
+                        row.heartbeat = datetime.datetime.now()
+                        progress_session.add(row)
+                        progress_session.commit()
+
+                try:
+                    stats = self._ingest(job, progress, cancel)
+                except IngestionCancelled as exc:
+                    session.refresh(job)
+                    # Jobs interrupted by a shutdown are resumed on the next start
+                    if self._stopping:
+                        job.status = QUEUED
+                        session.add(job)
+                        session.commit()
+                    else:
+                        self._finish(session, job, CANCELLED, str(exc))
+                    return
+                except Exception as exc:
+                    logger.error(f"Ingestion of {job.file_name} failed: {exc}")
+                    session.refresh(job)
+                    self._finish(session, job, FAILED, str(exc))
+                    return
+                session.refresh(job)
+                job.pages_done = job.pages_total = stats.pages
+                self._finish(session, job, DONE, str(stats))
+        finally:
+            with self._lock:
+                self._cancel.pop(job_id, None)
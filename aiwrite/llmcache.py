@@ -0,0 +1,103 @@
+import hashlib
+from typing import Optional
+
+from aiwrite.sqlitecache import SQLiteLRUCache
+
+#: Modes of the model response cache: disabled, read and write, or answering only from the cache
+RESPONSE_CACHE_MODES = ("off", "on", "replay")
+
+
+class CacheMissError(LookupError):
+    """Raised in replay mode when a prompt has no cached response."""
+
+
+class ResponseCache(SQLiteLRUCache):
+    """On-disk cache of model responses keyed by model, context and prompt.
+
+    Responses are stored in a SQLite file. When the stored responses exceed
+    ``max_bytes``, the least recently used ones are evicted. In replay mode
+    nothing is sent to the model: prompts without a cached response fail with
+    `CacheMissError`, which makes test runs fast, offline and deterministic.
+
+    Attributes:
+        path: Path of the cache file
+        max_bytes: Size cap of the stored responses
+        replay: Whether only cached responses may be used
+        hits: Number of responses served from the cache
+        misses: Number of prompts not found in the cache
+        evictions: Number of responses evicted
+    """
+    table = "response"
+    key_columns = ("key",)
+    size_expression = "size"
+    label = "Response cache"
+
+    def __init__(self, path: str, max_bytes: int = 64 * 2 ** 20, replay: bool = False):
+        """Open or create the cache.
+
+        Args:
+            path: Path of the cache file
+            max_bytes: Size cap of the stored responses
+            replay: Whether only cached responses may be used
+        """
+        super().__init__(path, max_bytes,
+                         "key BLOB NOT NULL, model TEXT NOT NULL, response TEXT NOT NULL, size INTEGER NOT NULL")
+        self.replay = replay
+
+    @staticmethod
+    def key(model: str, context: str, prompt: str) -> bytes:
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (model, context, prompt):
+            encoded = part.encode()
+            digest.update(len(encoded).to_bytes(8, "little"))
+            digest.update(encoded)
+        return digest.digest()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM response").fetchone()[0]
+
+    def get(self, model: str, context: str, prompt: str) -> Optional[str]:
+        """Look up the response to a prompt.
+
+        Args:
+            model: Name of the model
+            context: Context the prompt is answered in
+            prompt: Prompt sent to the model
+
+        Returns:
+            The cached response, or None
+
+        Raises:
+            CacheMissError: In replay mode, when there is no cached response
+        """
+        key = self.key(model, context, prompt)
+        with self._lock:
+            row = self._db.execute("SELECT response FROM response WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._db.execute("UPDATE response SET last_used = ? WHERE key = ?", (self._tick(), key))
+                self._db.commit()
+        if row is None and self.replay:
+            raise CacheMissError(f"No cached response of {model} to: {prompt[:80]}")
+        return row[0] if row else None
+
+    def put(self, model: str, context: str, prompt: str, response: str) -> None:
+        """Store the response to a prompt, evicting old responses beyond the size cap.
+
+        Args:
+            model: Name of the model
+            context: Context the prompt was answered in
+            prompt: Prompt sent to the model
+            response: Complete response of the model
+        """
+        key = self.key(model, context, prompt)
+        size = len(response.encode())
+        with self._lock:
+            self._resize((key,), size)
+            self._db.execute("INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?)",
+                             (key, model, response, size, self._tick()))
+            self._evict()
+            self._db.commit()
@@ -0,0 +1,171 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Generic, Hashable, Iterator, List, Optional, Tuple, TypeVar
+
+import loguru
+
+logger = loguru.logger
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class InstancePool(Generic[K, V]):
+    """Keyed pool of reusable client instances, such as model clients or knowledge base connections.
+
+    Instances are expensive to build (HTTP clients, database engines), so
+    instead of being dropped they are returned to the pool and handed out
+    again for the same key. Instances left idle for ``idle_timeout`` seconds
+    are evicted, and at most ``max_idle`` are kept per key. Evicted instances
+    are passed to the ``close`` hook, if any, so their connections are
+    released instead of waiting for garbage collection.
+
+    Attributes:
+        idle_timeout: Seconds an idle instance is kept, 0 to keep idle instances until evicted by ``max_idle``
+        max_idle: Maximum number of idle instances kept per key
+        created: Number of instances built by the factory
+        reused: Number of instances handed out from the pool
+        evicted: Number of idle instances dropped
+    """
+
+    def __init__(self, factory: Callable[[K], V], idle_timeout: float = 600.0, max_idle: int = 4,
+                 clock: Callable[[], float] = time.monotonic, close: Optional[Callable[[V], None]] = None):
+        """Initialize an empty pool.
+
+        Args:
+            factory: Builds a new instance for a key
+            idle_timeout: Seconds an idle instance is kept, 0 for no expiry
+            max_idle: Maximum number of idle instances kept per key
+            clock: Source of the current time in seconds
+            close: Releases the resources of an evicted instance
+        """
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self._factory = factory
+        self._clock = clock
+        self._close = close
+        self._idle: Dict[K, List[Tuple[float, V]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Number of idle instances."""
+        with self._lock:
+            return sum(len(instances) for instances in self._idle.values())
+
+    def acquire(self, key: K) -> V:
+        """Take an instance for exclusive use, building one if none is idle.
+
+        Args:
+            key: Key of the instance, passed to the factory
+
+        Returns:
+            The most recently released instance for the key, or a new one
+        """
+        with self._lock:
+            expired = self._evict_expired()
+            idle = self._idle.get(key)
+            reused = bool(idle)
+            if reused:
+                self.reused += 1
+                instance = idle.pop()[1]
+        self._close_all(expired)
+        if reused:
+            return instance
+        instance = self._factory(key)
+        with self._lock:
+            self.created += 1
+        return instance
+
+    def release(self, key: K, instance: V) -> None:
+        """Return an instance to the pool.
+
+        Args:
+            key: Key the instance was acquired with
+            instance: The instance
+        """
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            idle.append((self._clock(), instance))
+            evicted = []
+            if len(idle) > self.max_idle:
+                evicted.append(idle.pop(0)[1])
+                self.evicted += 1
+            evicted += self._evict_expired()
+        self._close_all(evicted)
+
+    def get(self, key: K) -> V:
+        """Get an instance for calls that do not change its state, leaving it available in the pool.
+
+        Args:
+            key: Key of the instance, passed to the factory
+
+        Returns:
+            An idle instance for the key, or a new one added to the pool
+        """
+        instance = self.acquire(key)
+        self.release(key, instance)
+        return instance
+
+    @contextmanager
+    def checkout(self, key: K) -> Iterator[V]:
+        """Borrow an instance for the duration of a ``with`` block."""
+        instance = self.acquire(key)
+        try:
+            yield instance
+        finally:
+            self.release(key, instance)
+
+    def evict_idle(self) -> int:
+        """Drop the instances idle for longer than ``idle_timeout``.
+
+        Returns:
+            Number of instances dropped
+        """
+        with self._lock:
+            evicted = self._evict_expired()
+        self._close_all(evicted)
+        return len(evicted)
+
+    def clear(self) -> None:
+        """Drop all idle instances."""
+        with self._lock:
+            evicted = [instance for instances in self._idle.values() for _, instance in instances]
+            self.evicted += len(evicted)
+            self._idle.clear()
+        self._close_all(evicted)
+
+    def _evict_expired(self) -> List[V]:
+        """Take the instances idle for longer than ``idle_timeout`` out of the pool, returning them to be closed."""
+        if not self.idle_timeout:
+            return []
+        deadline = self._clock() - self.idle_timeout
+        evicted = []
+        for key in list(self._idle):
+            kept = []
+            for released, instance in self._idle[key]:
+                if released >= deadline:
+                    kept.append((released, instance))
+                else:
+                    evicted.append(instance)
+            if kept:
+                self._idle[key] = kept
+            else:
+                del self._idle[key]
+        if evicted:
+            self.evicted += len(evicted)
+            logger.debug(f"Evicted {len(evicted)} idle client instances")
+        return evicted
+
+    def _close_all(self, instances: List[V]) -> None:
+        """Pass evicted instances to the ``close`` hook, outside the lock as closing may block on I/O."""
+        if self._close is None:
+            return
+        for instance in instances:
+            try:
+                self._close(instance)
+            except Exception as exc:
+                logger.warning(f"Could not close an evicted client instance: {exc}")
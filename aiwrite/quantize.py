@@ -0,0 +1,159 @@
+"""Convert the local vector indexes of knowledge base collections to another storage format.
+
+    aiwrite-quantize --db sqlite:///data/aiwrite.db --db-path data --quantization int8
+"""
+import argparse
+import os
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Set, Tuple
+
+import loguru
+import numpy as np
+from sqlalchemy import Engine
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from aiwrite.ingest import QUANTIZATIONS, CollectionSettings
+from aiwrite.vectorindex import IndexedChunk, LocalIndex
+
+logger = loguru.logger
+
+
+@dataclass
+class QuantizationReport:
+    """Storage and search latency of a collection before and after a conversion.
+
+    Attributes:
+        collection_name: Knowledge base collection
+        vectors: Number of stored vectors
+        dtype_before: Storage data type before the conversion
+        dtype_after: Storage data type after the conversion
+        bytes_before: Size of the stored vectors before the conversion
+        bytes_after: Size of the stored vectors after the conversion
+        scanned_bytes_before: Bytes read by an exact search before the conversion
+        scanned_bytes_after: Bytes read by an exact search after the conversion
+        search_ms_before: Mean search latency before the conversion
+        search_ms_after: Mean search latency after the conversion
+        recall: Share of the exact top results before the conversion still found after it
+    """
+    collection_name: str
+    vectors: int
+    dtype_before: str
+    dtype_after: str
+    bytes_before: int
+    bytes_after: int
+    scanned_bytes_before: int
+    scanned_bytes_after: int
+    search_ms_before: float = 0.0
+    search_ms_after: float = 0.0
+    recall: float = 1.0
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    @property
+    def saved_ms(self) -> float:
+        return self.search_ms_before - self.search_ms_after
+
+    def __str__(self) -> str:
+        return (f"{self.collection_name}: {self.vectors} vectors {self.dtype_before} -> {self.dtype_after}, "
+                f"stored {self.bytes_before / 2 ** 20:.1f} -> {self.bytes_after / 2 ** 20:.1f} MiB, "
+                f"scanned {self.scanned_bytes_before / 2 ** 20:.1f} -> {self.scanned_bytes_after / 2 ** 20:.1f} MiB, "
+                f"search {self.search_ms_before:.2f} -> {self.search_ms_after:.2f} ms, recall {self.recall:.3f}")
+
+
+def _search(index: LocalIndex, queries: np.ndarray, k: int, exact: bool = False) -> Tuple[float, List[Set[int]]]:
+    """Mean latency in milliseconds and result chunk IDs of searches."""
+    results = []
+    started = time.perf_counter()
+    for query in queries:
+        results.append({chunk.id for chunk, _ in index.search(query, k, exact=exact)})
+    return (time.perf_counter() - started) * 1000 / max(len(queries), 1), results
+
+
+def migrate_index(index: LocalIndex, dtype: str, rescore: bool = True, queries: int = 50,
+                  k: int = 15) -> QuantizationReport:
+    """
+    Convert the vectors of an index, measuring search latency and recall on sample queries
+    :param index: Index to convert
+    :param dtype: New storage data type, float32, float16 or int8
+    :param rescore: Whether to keep float32 copies of quantized vectors for re-scoring
+    :param queries: Number of stored vectors used as sample queries
+    :param k: Number of results per sample query
+    :return: Report of the conversion
+    """
+    sample = index.sample_vectors(queries)
+    report = QuantizationReport(index.collection_name, len(index), index.dtype, dtype,
+                                index.size_bytes, 0, index.scanned_bytes, 0)
+    _, truth = _search(index, sample, k, exact=True)
+    report.search_ms_before, _ = _search(index, sample, k)
+    index.convert(dtype, rescore)
+    report.bytes_after, report.scanned_bytes_after = index.size_bytes, index.scanned_bytes
+    report.search_ms_after, found = _search(index, sample, k)
+    if truth:
+        report.recall = float(np.mean([len(expected & got) / max(len(expected), 1)
+                                       for expected, got in zip(truth, found)]))
+    logger.info(f"Converted {report}")
+    return report
+
+
+def storage_dtype(quantization: str, default: str = "float32") -> str:
+    """
+    Storage data type of vectors for a collection quantization setting
+    :param quantization: One of `QUANTIZATIONS`
+    :param default: Data type of collections without quantization
+    :return: Data type of the local index
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization}, expected one of {', '.join(QUANTIZATIONS)}")
+    return default if quantization == "none" else quantization
+
+
+def quantize_collections(engine: Engine, directory: str, embedding_model: str, quantization: str,
+                         rescore: bool = True, collections: Optional[Sequence[str]] = None) -> List[QuantizationReport]:
+    """
+    Change the quantization setting of collections and convert their local indexes
+    :param engine: Database engine holding the settings and chunk tables
+    :param directory: Directory holding the local indexes
+    :param embedding_model: Embedding model of the indexes
+    :param quantization: One of `QUANTIZATIONS`
+    :param rescore: Whether to keep float32 copies of quantized vectors for re-scoring
+    :param collections: Names of the collections, all indexed collections by default
+    :return: One report per converted index
+    """
+    dtype = storage_dtype(quantization)
+    with Session(engine) as session:
+        if collections is None:
+            collections = session.exec(select(IndexedChunk.collection_name).where(
+                IndexedChunk.embedding_model == embedding_model).distinct()).all()
+        for name in collections:
+            settings = session.get(CollectionSettings, name) or CollectionSettings(collection_name=name)
+            settings.quantization, settings.rescore = quantization, rescore
+            session.add(settings)
+        session.commit()
+    return [migrate_index(LocalIndex(engine, directory, name, embedding_model), dtype, rescore)
+            for name in collections]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="sqlite:///data/aiwrite.db", help="Database URL")
+    parser.add_argument("--db-path", default="data", help="Data directory holding the index directory")
+    parser.add_argument("--embedding-model", default="gemini-embedding-001")
+    parser.add_argument("--collection", action="append", help="Collection to convert, all by default")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, required=True)
+    parser.add_argument("--no-rescore", action="store_true", help="Drop the float32 copies of quantized vectors")
+    args = parser.parse_args(argv)
+    engine = create_engine(args.db)
+    SQLModel.metadata.create_all(engine)
+    reports = quantize_collections(engine, os.path.join(args.db_path, "index"), args.embedding_model,
+                                   args.quantization, not args.no_rescore, args.collection)
+    for report in reports:
+        print(report)
+    if not reports:
+        print("No local index to convert")
+
+
+if __name__ == "__main__":
+    main()
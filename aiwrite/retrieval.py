@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import loguru
+
+logger = loguru.logger
+
+_Key = Tuple[str, str, str, int]
+
+
+class RetrievalCache:
+    """In-memory cache of knowledge base retrieval results.
+
+    Results are keyed by collection, embedding model, query text and number of
+    passages. Queries differing only in whitespace share an entry. Entries
+    expire after ``ttl`` seconds, and the least recently used ones are evicted
+    beyond ``max_entries``. `invalidate` drops the entries of a collection
+    when its contents change.
+
+    Attributes:
+        max_entries: Maximum number of cached results
+        ttl: Seconds a result stays valid, 0 for no expiry
+        hits: Number of lookups served from the cache
+        misses: Number of lookups not found or expired
+        evictions: Number of entries dropped to respect ``max_entries``
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 600.0, clock: Callable[[], float] = time.monotonic):
+        """Initialize an empty cache.
+
+        Args:
+            max_entries: Maximum number of cached results
+            ttl: Seconds a result stays valid, 0 for no expiry
+            clock: Source of the current time in seconds
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[_Key, Tuple[float, str]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(collection_name: str, embedding_model: str, query: str, k: int) -> _Key:
+        return collection_name, embedding_model, " ".join(query.split()), k
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, collection_name: str, embedding_model: str, query: str, k: int) -> Optional[str]:
+        """Look up a retrieval result.
+
+        Args:
+            collection_name: Name of the knowledge base collection
+            embedding_model: Name of the embedding model of the collection
+            query: Query text
+            k: Number of passages retrieved
+
+        Returns:
+            The cached result, or None if absent or expired
+        """
+        key = self.key(collection_name, embedding_model, query, k)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and self._clock() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, collection_name: str, embedding_model: str, query: str, k: int, result: str,
+            generation: Optional[int] = None) -> None:
+        """Store a retrieval result.
+
+        Args:
+            collection_name: Name of the knowledge base collection
+            embedding_model: Name of the embedding model of the collection
+            query: Query text
+            k: Number of passages retrieved
+            result: Retrieved passages
+            generation: Value of `generation` when the retrieval started. The result is
+                discarded if the collection was invalidated since.
+        """
+        key = self.key(collection_name, embedding_model, query, k)
+        with self._lock:
+            if generation is not None and generation != self._generation(collection_name):
+                return
+            self._entries[key] = (self._clock(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self, collection_name: str) -> int:
+        """Number of times a collection was invalidated."""
+        with self._lock:
+            return self._generation(collection_name)
+
+    def _generation(self, collection_name: str) -> int:
+        return self._epoch + self._generations.get(collection_name, 0)
+
+    def invalidate(self, collection_name: Optional[str] = None) -> int:
+        """Drop the cached results of a collection.
+
+        Args:
+            collection_name: Name of the collection, None for all collections
+
+        Returns:
+            Number of entries dropped
+        """
+        with self._lock:
+            stale = [key for key in self._entries if collection_name is None or key[0] == collection_name]
+            for key in stale:
+                del self._entries[key]
+            if collection_name is None:
+                self._epoch += 1
+            else:
+                self._generations[collection_name] = self._generations.get(collection_name, 0) + 1
+        if stale:
+            logger.debug(f"Dropped {len(stale)} cached retrievals of {collection_name or 'all collections'}")
+        return len(stale)
+
+    def retrieve(self, collection_name: str, embedding_model: str, query: str, k: int,
+                 fetch: Callable[[], str]) -> str:
+        """Get a retrieval result from the cache, calling ``fetch`` on a miss.
+
+        Args:
+            collection_name: Name of the knowledge base collection
+            embedding_model: Name of the embedding model of the collection
+            query: Query text
+            k: Number of passages retrieved
+            fetch: Function performing the retrieval
+
+        Returns:
+            Retrieved passages
+        """
+        result = self.get(collection_name, embedding_model, query, k)
+        if result is not None:
+            return result
+        generation = self.generation(collection_name)
+        result = fetch()
+        self.put(collection_name, embedding_model, query, k, result, generation)
+        return result
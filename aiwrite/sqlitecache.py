@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+from typing import Sequence, Tuple
+
+import loguru
+
+logger = loguru.logger
+
+
+class SQLiteLRUCache:
+    """Base of the on-disk caches: a SQLite table whose entries are evicted least recently used first.
+
+    Subclasses set the table layout in the class attributes below. Every
+    entry has a ``last_used`` column holding the value of a logical clock,
+    which is advanced by `_tick` whenever entries are read or written. When
+    the stored entries exceed ``max_bytes``, `_evict` deletes the entries with
+    the oldest ``last_used`` until they fit again. The caller holds ``_lock``
+    around everything but `__init__` and `close`.
+
+    Attributes:
+        path: Path of the cache file
+        max_bytes: Size cap of the stored entries
+        hits: Number of entries served from the cache
+        misses: Number of entries not found in the cache
+        evictions: Number of entries evicted
+    """
+    #: Name of the table of entries
+    table: str
+    #: Columns identifying an entry
+    key_columns: Tuple[str, ...]
+    #: SQL expression of the size of an entry
+    size_expression: str
+    #: Name of the cache in the log
+    label: str
+
+    def __init__(self, path: str, max_bytes: int, columns: str):
+        """Open or create the cache file.
+
+        Args:
+            path: Path of the cache file
+            max_bytes: Size cap of the stored entries
+            columns: Column definitions of the table, besides ``last_used``
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({columns}, last_used INTEGER NOT NULL, "
+                         f"PRIMARY KEY ({', '.join(self.key_columns)}))")
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS ix_{self.table}_last_used ON {self.table} (last_used)")
+        self._clock, self._bytes = self._db.execute(
+            f"SELECT COALESCE(MAX(last_used), 0), COALESCE(SUM({self.size_expression}), 0) "
+            f"FROM {self.table}").fetchone()
+
+    @property
+    def size_bytes(self) -> int:
+        """Total size of the stored entries."""
+        return self._bytes
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def _key_condition(self) -> str:
+        return " AND ".join(f"{column} = ?" for column in self.key_columns)
+
+    def _tick(self) -> int:
+        """Advance the clock, returning the ``last_used`` value of the entries read or written now."""
+        self._clock += 1
+        return self._clock
+
+    def _resize(self, key: Sequence, size: int) -> None:
+        """Account for an entry of ``size`` bytes about to be stored, replacing any stored under ``key``."""
+        old = self._db.execute(f"SELECT {self.size_expression} FROM {self.table} WHERE {self._key_condition}",
+                               tuple(key)).fetchone()
+        self._bytes += size - (old[0] if old else 0)
+
+    def _evict(self) -> None:
+        """Delete the least recently used entries until the stored entries fit into ``max_bytes``."""
+        while self._bytes > self.max_bytes:
+            victims = self._db.execute(f"SELECT {', '.join(self.key_columns)}, {self.size_expression} "
+                                       f"FROM {self.table} ORDER BY last_used LIMIT 256").fetchall()
+            if not victims:
+                break
+            evicted = []
+            for *key, size in victims:
+                if self._bytes <= self.max_bytes:
+                    break
+                evicted.append(key)
+                self._bytes -= size
+            self._db.executemany(f"DELETE FROM {self.table} WHERE {self._key_condition}", evicted)
+            self.evictions += len(evicted)
+
+    def close(self) -> None:
+        """Close the cache file."""
+        with self._lock:
+            self._db.close()
+        logger.info(f"{self.label}: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, "
+                    f"{self._bytes / 2 ** 20:.1f} MiB")
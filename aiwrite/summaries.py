@@ -0,0 +1,170 @@
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import loguru
+from sqlalchemy import Engine
+from sqlmodel import Field, Session, SQLModel
+
+from aiwrite.chunking import ChunkingConfig, Page, chunk_pages, estimate_tokens
+from aiwrite.ingest import text_hash
+
+logger = loguru.logger
+
+#: Summarizes a text with a language model
+Summarize = Callable[[str], str]
+
+
+class SectionSummary(SQLModel, table=True):
+    """Summary of a manuscript section, shared by every section with the same content.
+
+    Attributes:
+        content_hash: Hash of the Markdown text of the section, heading included
+        summary: Summary of the section body
+        tokens: Approximate number of tokens of the summarized section
+        created: Timestamp when the summary was generated
+    """
+    content_hash: str = Field(primary_key=True)
+    summary: str
+    tokens: int = 0
+    created: datetime.datetime = Field(default_factory=datetime.datetime.now, nullable=False)
+
+
+class SummaryStore:
+    """Summaries of manuscript sections, generated in the background and kept in the database.
+
+    Summaries are keyed by the hash of the section content, so an edited section
+    gets a new summary while unchanged ones keep theirs. `refresh` only queues
+    sections without a summary; sections shorter than ``min_tokens`` are never
+    summarized. Sections longer than ``part_tokens`` are summarized
+    hierarchically: their parts first, then the summaries of the parts.
+
+    Attributes:
+        min_tokens: Sections below this size are not worth summarizing
+        part_tokens: Maximum tokens sent to the model in one summarization
+        generated: Number of summaries generated since the store was created
+    """
+
+    def __init__(self, engine: Engine, summarize: Summarize, min_tokens: int = 200, part_tokens: int = 3000,
+                 max_workers: int = 1, max_cached: int = 1024):
+        """Initialize the store.
+
+        Args:
+            engine: Database engine holding the summary table
+            summarize: Function summarizing a text with a language model
+            min_tokens: Sections below this size are not worth summarizing
+            part_tokens: Maximum tokens sent to the model in one summarization
+            max_workers: Number of summaries generated at the same time
+            max_cached: Number of summaries also kept in memory
+        """
+        self.engine = engine
+        self.min_tokens = min_tokens
+        self.part_tokens = part_tokens
+        self.generated = 0
+        self._summarize = summarize
+        self._max_cached = max_cached
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aiwrite-summaries")
+
+    def _remember(self, key: str, summary: str) -> None:
+        with self._lock:
+            self._cache[key] = summary
+            self._cache.move_to_end(key)
+            if len(self._cache) > self._max_cached:
+                self._cache.popitem(last=False)
+
+    def get(self, content: str) -> Optional[str]:
+        """Get the summary of a section, if it was generated already.
+
+        Args:
+            content: Markdown text of the section
+
+        Returns:
+            Summary of the section, None if there is none yet
+        """
+        key = text_hash(content)
+        with self._lock:
+            summary = self._cache.get(key)
+            if summary is not None:
+                self._cache.move_to_end(key)
+                return summary
+        with Session(self.engine) as session:
+            row = session.get(SectionSummary, key)
+        if row is None:
+            return None
+        self._remember(key, row.summary)
+        return row.summary
+
+    def lookup(self, slug: str, content: str) -> Optional[str]:
+        """Summary lookup for `ContextBuilder`."""
+        return self.get(content)
+
+    def refresh(self, sections: Iterable[Tuple[str, str]]) -> List[Future]:
+        """Queue the summarization of the sections that have no summary yet.
+
+        Args:
+            sections: ``(slug, content)`` pairs; the title block (empty slug) is skipped
+
+        Returns:
+            Futures of the queued summarizations
+        """
+        queued = []
+        for slug, content in sections:
+            if not slug or estimate_tokens(content) < self.min_tokens or self.get(content) is not None:
+                continue
+            key = text_hash(content)
+            with self._lock:
+                if key in self._pending:
+                    continue
+                future = self._executor.submit(self._generate, key, content)
+                self._pending[key] = future
+            queued.append(future)
+        return queued
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Wait until the queued summaries are generated."""
+        with self._lock:
+            futures = list(self._pending.values())
+        wait(futures, timeout)
+
+    def shutdown(self) -> None:
+        """Stop generating summaries, dropping the queued ones."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def summarize(self, text: str) -> str:
+        """Summarize a text, by parts when it is longer than ``part_tokens``.
+
+        Args:
+            text: Text to summarize
+
+        Returns:
+            Summary of the text
+        """
+        if estimate_tokens(text) <= self.part_tokens:
+            return self._summarize(text).strip()
+        parts = chunk_pages([Page(0, text)], ChunkingConfig(self.part_tokens, 0))
+        summaries = "\n\n".join(self._summarize(part.text).strip() for part in parts)
+        # Stop when the model does not shorten the text any more
+        if estimate_tokens(summaries) >= estimate_tokens(text):
+            return summaries
+        return self.summarize(summaries)
+
+    def _generate(self, key: str, content: str) -> None:
+        try:
+            summary = self.summarize(content)
+            if summary:
+                with Session(self.engine) as session:
+                    session.merge(SectionSummary(content_hash=key, summary=summary, tokens=estimate_tokens(content)))
+                    session.commit()
+                self._remember(key, summary)
+                with self._lock:
+                    self.generated += 1
+        except Exception as exc:
+            logger.error(f"Error summarizing a manuscript section: {exc}")
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
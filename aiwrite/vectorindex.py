@@ -0,0 +1,771 @@
+import json
+import os
+import re
+import threading
+from collections import Counter
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+
+import loguru
+import numpy as np
+from sqlalchemy import Engine, Index, update
+from sqlmodel import Field, Session, SQLModel, select
+
+from aiwrite.chunking import Chunk
+from aiwrite.embeddings import Embedder
+
+logger = loguru.logger
+
+#: Rows scored per matrix product, bounding the memory of temporary score arrays
+SEARCH_BLOCK_ROWS = 65536
+
+#: Data types vectors can be stored as; int8 vectors carry one scale per vector
+VECTOR_DTYPES = ("float32", "float16", "int8")
+
+
+class IndexedChunk(SQLModel, table=True):
+    """A chunk whose vector is stored in a `LocalIndex`.
+
+    Attributes:
+        id: Unique identifier of the record
+        collection_name: Knowledge base collection of the chunk
+        embedding_model: Embedding model that produced the vector
+        row: Row of the vector in the index file
+        document: Name of the document the chunk was cut from
+        page_start: Number of the page the chunk starts on
+        page_end: Number of the page the chunk ends on
+        text: Text of the chunk
+        deleted: Whether the chunk was removed from the index
+    """
+    __table_args__ = (Index("ix_indexedchunk_collection_row", "collection_name", "embedding_model", "row"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    collection_name: str
+    embedding_model: str
+    row: int
+    document: str = Field(index=True)
+    page_start: int
+    page_end: int
+    text: str
+    deleted: bool = False
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale vectors to unit length, so that dot products are cosine similarities
+    :param vectors: One vector per row
+    :return: Normalized float32 vectors
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Convert float vectors to a storage data type
+    :param vectors: One vector per row
+    :param dtype: One of `VECTOR_DTYPES`
+    :return: Stored vectors, and for int8 the scale of each vector
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype != "int8":
+        return vectors.astype(dtype), None
+    scales = np.abs(vectors).max(axis=-1) / 127
+    scales[scales == 0] = 1
+    return np.round(vectors / scales[..., None]).astype(np.int8), scales.astype(np.float32)
+
+
+def dequantize(vectors: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Convert stored vectors back to float32
+    :param vectors: Stored vectors
+    :param scales: Scale of each vector, for int8 vectors
+    :return: Float32 vectors
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors if scales is None else vectors * np.asarray(scales, dtype=np.float32)[..., None]
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the ``k`` highest scores, best first
+    :param scores: Scores to rank
+    :param k: Number of positions to return
+    :return: Positions into ``scores``
+    """
+    if k < len(scores):
+        best = np.argpartition(-scores, k)[:k]
+    else:
+        best = np.arange(len(scores))
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+def exact_search(vectors: np.ndarray, query: np.ndarray, k: int, alive: Optional[np.ndarray] = None,
+                 scales: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the rows most similar to a query by scoring every row
+    :param vectors: Unit-length vectors, one per row, possibly quantized
+    :param query: Unit-length query vector
+    :param k: Number of rows to return
+    :param alive: Mask of the rows that may be returned, all rows if None
+    :param scales: Scale of each row, for int8 vectors
+    :return: Rows and scores, best first
+    """
+    rows, scores = [], []
+    for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32) @ query
+        if scales is not None:
+            block *= scales[start:start + len(block)]
+        if alive is not None:
+            block = np.where(alive[start:start + len(block)], block, -np.inf)
+        best = top_k(block, k)
+        rows.append(best + start)
+        scores.append(block[best])
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    rows, scores = np.concatenate(rows), np.concatenate(scores)
+    best = top_k(scores, k)
+    best = best[np.isfinite(scores[best])]
+    return rows[best], scores[best]
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid of each vector."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """Inverted file index over unit-length vectors.
+
+    Vectors are clustered around ``nlist`` centroids with spherical k-means.
+    A search scores only the vectors of the ``nprobe`` clusters closest to the
+    query. The index stores cluster assignments only, the vectors themselves
+    are passed to `search`.
+
+    Attributes:
+        nprobe: Number of clusters scored per search
+        centroids: Unit-length cluster centroids, None until trained
+        assignments: Cluster of each indexed row
+        trained_rows: Number of rows the centroids were trained on
+    """
+
+    def __init__(self, nprobe: int = 8):
+        """Initialize an untrained index.
+
+        Args:
+            nprobe: Number of clusters scored per search
+        """
+        self.nprobe = nprobe
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_rows = 0
+        self._lists: List[np.ndarray] = []
+        self._added: List[List[int]] = []
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, vectors: np.ndarray, nlist: Optional[int] = None, iterations: int = 10,
+              sample_rows: int = 32768, seed: int = 0) -> None:
+        """Cluster vectors and assign every row to its cluster.
+
+        Args:
+            vectors: Unit-length vectors, one per row, possibly quantized
+            nlist: Number of clusters, about the square root of the number of rows by default
+            iterations: Number of k-means iterations
+            sample_rows: Maximum number of rows the centroids are fitted on
+            seed: Seed of the random sampling
+        """
+        rng = np.random.default_rng(seed)
+        nlist = min(nlist or int(np.clip(np.sqrt(len(vectors)), 16, 4096)), len(vectors))
+        sample = np.sort(rng.choice(len(vectors), min(len(vectors), max(sample_rows, nlist)), replace=False))
+        data = normalize(vectors[sample])
+        centroids = data[rng.choice(len(data), nlist, replace=False)]
+        for _ in range(iterations):
+            labels = _nearest(data, centroids)
+            order = np.argsort(labels, kind="stable")
+            counts = np.bincount(labels, minlength=nlist)
+            filled = np.flatnonzero(counts)
+            sums = np.add.reduceat(data[order], np.concatenate(([0], np.cumsum(counts)[:-1]))[filled])
+            centroids = centroids.copy()
+            centroids[filled] = sums
+            # Restart empty clusters from random rows
+            empty = np.flatnonzero(counts == 0)
+            centroids[empty] = data[rng.choice(len(data), len(empty))]
+            centroids = normalize(centroids)
+        self.centroids = centroids
+        self.assignments = _nearest(vectors, centroids)
+        self.trained_rows = len(vectors)
+        self._build_lists()
+
+    def _build_lists(self) -> None:
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.cumsum(np.bincount(self.assignments, minlength=len(self.centroids)))
+        self._lists = np.split(order, bounds[:-1])
+        self._added = [[] for _ in self._lists]
+
+    def add(self, vectors: np.ndarray) -> None:
+        """Assign new rows, appended after the indexed ones, to their clusters.
+
+        Args:
+            vectors: Unit-length vectors of the new rows
+        """
+        if not self.trained or not len(vectors):
+            return
+        first = len(self.assignments)
+        labels = _nearest(vectors, self.centroids)
+        self.assignments = np.concatenate((self.assignments, labels))
+        for row, label in enumerate(labels, first):
+            self._added[label].append(row)
+
+    def candidates(self, query: np.ndarray) -> np.ndarray:
+        """Rows of the clusters closest to a query, in ascending order.
+
+        Args:
+            query: Unit-length query vector
+
+        Returns:
+            Candidate rows
+        """
+        probes = top_k(self.centroids @ query, min(self.nprobe, len(self.centroids)))
+        rows = [self._lists[probe] for probe in probes] + [np.asarray(self._added[probe], dtype=np.int64)
+                                                           for probe in probes]
+        return np.sort(np.concatenate(rows))
+
+    def search(self, vectors: np.ndarray, query: np.ndarray, k: int, alive: Optional[np.ndarray] = None,
+               scales: Optional[np.ndarray] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Find the rows most similar to a query among the closest clusters.
+
+        Args:
+            vectors: Unit-length vectors of the indexed rows, possibly quantized
+            query: Unit-length query vector
+            k: Number of rows to return
+            alive: Mask of the rows that may be returned, all rows if None
+            scales: Scale of each row, for int8 vectors
+
+        Returns:
+            Rows and scores, best first, or None if the clusters hold fewer than ``k`` rows
+        """
+        rows = self.candidates(query)
+        if alive is not None:
+            rows = rows[alive[rows]]
+        if len(rows) < k:
+            return None
+        scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+        if scales is not None:
+            scores *= scales[rows]
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def save(self, path: str) -> None:
+        """Write the index to a ``.npz`` file.
+
+        Args:
+            path: Path of the file
+        """
+        if self.trained:
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, centroids=self.centroids, assignments=self.assignments,
+                         trained_rows=np.int64(self.trained_rows))
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str, nprobe: int = 8) -> "IVFIndex":
+        """Read an index written by `save`.
+
+        Args:
+            path: Path of the file
+            nprobe: Number of clusters scored per search
+
+        Returns:
+            The index, untrained if the file does not exist
+        """
+        index = cls(nprobe)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                index.centroids = data["centroids"]
+                index.assignments = data["assignments"]
+                index.trained_rows = int(data["trained_rows"])
+            index._build_lists()
+        return index
+
+
+class _MappedArray:
+    """A ``.npy`` file mapped into memory, grown by doubling its capacity."""
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, path: str, dtype: str, shape: Tuple[int, ...] = ()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.shape = shape
+        self.array: Optional[np.ndarray] = np.load(path, mmap_mode="r+") if os.path.exists(path) else None
+
+    @property
+    def capacity(self) -> int:
+        return len(self.array) if self.array is not None else 0
+
+    def reserve(self, rows: int, used: int) -> None:
+        """Make room for ``rows`` rows, keeping the first ``used`` ones."""
+        if rows <= self.capacity:
+            return
+        capacity = max(rows, 2 * self.capacity, self.INITIAL_CAPACITY)
+        grown = np.lib.format.open_memmap(self.path + ".tmp", mode="w+", dtype=self.dtype,
+                                          shape=(capacity, *self.shape))
+        used = min(used, self.capacity)
+        for start in range(0, used, SEARCH_BLOCK_ROWS):
+            grown[start:min(start + SEARCH_BLOCK_ROWS, used)] = self.array[start:min(start + SEARCH_BLOCK_ROWS, used)]
+        grown.flush()
+        del grown
+        os.replace(self.path + ".tmp", self.path)
+        self.array = np.load(self.path, mmap_mode="r+")
+
+    def flush(self) -> None:
+        if self.array is not None:
+            self.array.flush()
+
+
+class LocalIndex:
+    """Vectors of a knowledge base collection, searched in process.
+
+    Vectors are stored in a memory-mapped ``.npy`` file, as float32, float16
+    or int8 with a scale per vector, and the chunk texts in the
+    ``IndexedChunk`` table. Searches are matrix products over the mapped
+    file, so processes opening the same index share the operating system page
+    cache instead of each loading a copy. Only one process should add to an
+    index; the others pick up its changes before searching.
+
+    With ``rescore``, quantized indexes also keep float32 copies of the
+    vectors in a second file. Searches scan the quantized vectors and re-score
+    the best `RESCORE_CANDIDATES` times ``k`` rows with the float32 copies.
+
+    Small collections are searched exactly; from `MIN_TRAIN_ROWS` vectors on,
+    an `IVFIndex` is trained and retrained whenever the collection grew
+    `RETRAIN_GROWTH` times. Removed chunks stay in the files and are masked out
+    of searches.
+
+    Attributes:
+        collection_name: Knowledge base collection
+        embedding_model: Embedding model that produced the vectors
+        directory: Directory holding the index files
+        dtype: Data type of the stored vectors
+        rescore: Whether float32 copies of quantized vectors are kept for re-scoring
+    """
+    MIN_TRAIN_ROWS = 4096
+    RETRAIN_GROWTH = 4
+    RESCORE_CANDIDATES = 4
+
+    def __init__(self, engine: Engine, directory: str, collection_name: str, embedding_model: str,
+                 nprobe: int = 8, dtype: str = "float32", rescore: bool = False):
+        """Open or create the index of a collection.
+
+        Args:
+            engine: Database engine holding the chunk table
+            directory: Directory holding the indexes of all collections
+            collection_name: Knowledge base collection
+            embedding_model: Embedding model that produced the vectors
+            nprobe: Number of clusters scored per search
+            dtype: Data type of the stored vectors of a new index, one of `VECTOR_DTYPES`
+            rescore: Whether a new quantized index keeps float32 copies for re-scoring
+        """
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector data type {dtype}, expected one of {', '.join(VECTOR_DTYPES)}")
+        self.engine = engine
+        self.collection_name = collection_name
+        self.embedding_model = embedding_model
+        self.directory = os.path.join(directory, re.sub(r"[^\w.-]+", "_", f"{collection_name}-{embedding_model}"))
+        os.makedirs(self.directory, exist_ok=True)
+        self._nprobe = nprobe
+        self._lock = threading.Lock()
+        self._info_path = os.path.join(self.directory, "index.json")
+        self._ivf_path = os.path.join(self.directory, "ivf.npz")
+        info = self._read_info()
+        self.dtype = info.get("dtype", dtype)
+        self.rescore = info.get("rescore", rescore)
+        self._convert_f32_file()
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read_info(self) -> dict:
+        if not os.path.exists(self._info_path):
+            return {}
+        with open(self._info_path) as f:
+            return json.load(f)
+
+    def _write_info(self) -> None:
+        """Record the state of the index, signalling other processes to reload it."""
+        info = {"collection_name": self.collection_name, "embedding_model": self.embedding_model,
+                "dim": self._dim, "dtype": self.dtype, "rescore": self.rescore, "rows": self._count}
+        with open(self._info_path + ".tmp", "w") as f:
+            json.dump(info, f)
+        os.replace(self._info_path + ".tmp", self._info_path)
+        self._stamp = self._info_stamp()
+
+    def _info_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._info_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _convert_f32_file(self) -> None:
+        """Move vectors from the raw float32 file of earlier versions into a ``.npy`` file."""
+        legacy = self._path("vectors.f32")
+        dim = self._read_info().get("dim", 0)
+        if not os.path.exists(legacy) or os.path.exists(self._path("vectors.npy")) or not dim:
+            return
+        vectors = np.fromfile(legacy, dtype=np.float32)
+        np.save(self._path("vectors.npy"), vectors[:len(vectors) // dim * dim].reshape(-1, dim).astype(self.dtype))
+        os.remove(legacy)
+
+    def _open_files(self) -> None:
+        self._vectors = _MappedArray(self._path("vectors.npy"), self.dtype, (self._dim,))
+        self._scales = _MappedArray(self._path("scales.npy"), "float32") if self.dtype == "int8" else None
+        self._originals = None
+        if self.rescore and self.dtype != "float32":
+            self._originals = _MappedArray(self._path("originals.npy"), "float32", (self._dim,))
+
+    @property
+    def _files(self) -> List[_MappedArray]:
+        return [files for files in (self._vectors, self._scales, self._originals) if files is not None]
+
+    def _load(self) -> None:
+        """Read the index state, as last written by any process."""
+        self._stamp = self._info_stamp()
+        info = self._read_info()
+        self._dim = info.get("dim", 0)
+        self.dtype = info.get("dtype", self.dtype)
+        self.rescore = info.get("rescore", self.rescore)
+        self._open_files()
+        capacity = min(files.capacity for files in self._files)
+        with Session(self.engine) as session:
+            records = session.exec(select(IndexedChunk.row, IndexedChunk.document, IndexedChunk.deleted)
+                                   .where(*self._where())).all()
+        self._count = max((row for row, _, _ in records), default=-1) + 1
+        self._alive = np.zeros(max(capacity, self._count), dtype=bool)
+        self._documents: Counter = Counter()
+        for row, document, deleted in records:
+            # Records beyond the stored vectors were left by an interrupted update
+            if row < capacity and not deleted:
+                self._alive[row] = True
+                self._documents[document] += 1
+        if self._dim and self._count > capacity:
+            self._reserve(self._count)
+        self._ivf = IVFIndex.load(self._ivf_path, self._nprobe)
+        if len(self._ivf.assignments) > self._count:
+            self._ivf = IVFIndex(self._nprobe)
+        if self._vectors.array is not None:
+            self._ivf.add(self._vectors.array[len(self._ivf.assignments):self._count])
+
+    def _refresh(self) -> None:
+        if self._info_stamp() != self._stamp:
+            self._load()
+
+    def _where(self):
+        return IndexedChunk.collection_name == self.collection_name, IndexedChunk.embedding_model == self.embedding_model
+
+    def __len__(self) -> int:
+        return self._documents.total()
+
+    @property
+    def documents(self) -> Set[str]:
+        """Names of the documents with chunks in the index."""
+        with self._lock:
+            self._refresh()
+            return set(self._documents)
+
+    @property
+    def trained(self) -> bool:
+        return self._ivf.trained
+
+    @property
+    def scanned_bytes(self) -> int:
+        """Size of the stored vectors read by an exact search, including rows of removed chunks."""
+        return self._count * (self._dim * np.dtype(self.dtype).itemsize + (4 if self._scales is not None else 0))
+
+    @property
+    def size_bytes(self) -> int:
+        """Size of the stored vectors, including rows of removed chunks."""
+        return self.scanned_bytes + (self._count * self._dim * 4 if self._originals is not None else 0)
+
+    def _reserve(self, rows: int) -> None:
+        for files in self._files:
+            files.reserve(rows, self._count)
+        if rows > len(self._alive):
+            alive = np.zeros(self._vectors.capacity, dtype=bool)
+            alive[:len(self._alive)] = self._alive
+            self._alive = alive
+
+    def add(self, document: str, chunks: Sequence[Chunk], vectors: np.ndarray) -> None:
+        """Add embedded chunks of a document.
+
+        Args:
+            document: Name of the document
+            chunks: Embedded chunks
+            vectors: One vector per chunk
+        """
+        if not len(chunks):
+            return
+        vectors = normalize(vectors)
+        with self._lock:
+            self._refresh()
+            if not self._dim:
+                self._dim = vectors.shape[1]
+                self._open_files()
+            if vectors.shape[1] != self._dim:
+                raise ValueError(f"Vectors of {self.embedding_model} should have {self._dim} dimensions, "
+                                 f"not {vectors.shape[1]}")
+            first, last = self._count, self._count + len(vectors)
+            self._reserve(last)
+            stored, scales = quantize(vectors, self.dtype)
+            self._vectors.array[first:last] = stored
+            if self._scales is not None:
+                self._scales.array[first:last] = scales
+            if self._originals is not None:
+                self._originals.array[first:last] = vectors
+            with Session(self.engine) as session:
+                session.add_all([IndexedChunk(collection_name=self.collection_name,
+                                              embedding_model=self.embedding_model, row=row, document=document,
+                                              page_start=chunk.page_start, page_end=chunk.page_end, text=chunk.text)
+                                 for row, chunk in enumerate(chunks, first)])
+                session.commit()
+            self._count = last
+            self._alive[first:last] = True
+            self._documents[document] += len(chunks)
+            if len(self) >= self.MIN_TRAIN_ROWS and (
+                    not self._ivf.trained or self._count >= self.RETRAIN_GROWTH * self._ivf.trained_rows):
+                logger.info(f"Training the vector index of {self.collection_name} on {self._count} vectors")
+                self._ivf.train(self._vectors.array[:self._count])
+                self._ivf.save(self._ivf_path)
+            else:
+                self._ivf.add(self._vectors.array[first:last])
+            self._write_info()
+
+    def remove_pages(self, document: str, page_numbers: Iterable[int]) -> int:
+        """Remove the chunks of a document starting on some pages.
+
+        Args:
+            document: Name of the document
+            page_numbers: Numbers of the pages
+
+        Returns:
+            Number of chunks removed
+        """
+        with self._lock, Session(self.engine) as session:
+            self._refresh()
+            where = (*self._where(), IndexedChunk.document == document,
+                     IndexedChunk.page_start.in_(list(page_numbers)), IndexedChunk.deleted == False)  # noqa: E712
+            rows = [row for row in session.exec(select(IndexedChunk.row).where(*where)).all() if self._alive[row]]
+            if not rows:
+                return 0
+            session.exec(update(IndexedChunk).where(*where).values(deleted=True))
+            session.commit()
+            self._alive[rows] = False
+            self._documents[document] -= len(rows)
+            if self._documents[document] <= 0:
+                del self._documents[document]
+            self._write_info()
+            return len(rows)
+
+    def search(self, query: np.ndarray, k: int, exact: bool = False) -> List[Tuple[IndexedChunk, float]]:
+        """Find the chunks most similar to a query.
+
+        Args:
+            query: Query vector
+            k: Number of chunks to return
+            exact: Whether to score every vector instead of using the IVF index
+
+        Returns:
+            Chunks and cosine similarities, best first
+        """
+        query = normalize(query).reshape(-1)
+        with self._lock:
+            self._refresh()
+            if self._vectors.array is None:
+                return []
+            vectors, alive = self._vectors.array[:self._count], self._alive[:self._count]
+            scales = self._scales.array[:self._count] if self._scales is not None else None
+            candidates = k * self.RESCORE_CANDIDATES if self._originals is not None else k
+            found = None
+            if self._ivf.trained and not exact:
+                found = self._ivf.search(vectors, query, candidates, alive, scales)
+            if found is None:
+                found = exact_search(vectors, query, candidates, alive, scales)
+            rows, scores = found
+            if self._originals is not None and len(rows):
+                order = np.argsort(rows)
+                rows = rows[order]
+                scores = self._originals.array[rows] @ query
+                best = top_k(scores, k)
+                rows, scores = rows[best], scores[best]
+        with Session(self.engine) as session:
+            records = {record.row: record for record in session.exec(
+                select(IndexedChunk).where(*self._where(), IndexedChunk.row.in_(rows.tolist()))).all()}
+        return [(records[row], float(score)) for row, score in zip(rows.tolist(), scores) if row in records]
+
+    def sample_vectors(self, n: int, seed: int = 0) -> np.ndarray:
+        """Get the vectors of random chunks, e.g. as benchmark queries.
+
+        Args:
+            n: Maximum number of vectors
+            seed: Seed of the random sampling
+
+        Returns:
+            Float32 vectors, at best precision available
+        """
+        with self._lock:
+            self._refresh()
+            if self._vectors.array is None:
+                return np.zeros((0, self._dim), dtype=np.float32)
+            rows = np.flatnonzero(self._alive[:self._count])
+            rows = np.sort(np.random.default_rng(seed).choice(rows, min(n, len(rows)), replace=False))
+            if self._originals is not None:
+                return np.asarray(self._originals.array[rows], dtype=np.float32)
+            return dequantize(self._vectors.array[rows], self._scales.array[rows] if self._scales is not None else None)
+
+    def convert(self, dtype: str, rescore: bool = True) -> None:
+        """Rewrite the stored vectors with another data type.
+
+        Vectors are converted from their float32 copies when there are some,
+        so converting a quantized index without them loses precision.
+
+        Args:
+            dtype: New data type, one of `VECTOR_DTYPES`
+            rescore: Whether to keep float32 copies of quantized vectors for re-scoring
+        """
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector data type {dtype}, expected one of {', '.join(VECTOR_DTYPES)}")
+        with self._lock:
+            self._refresh()
+            source = self._originals if self._originals is not None else self._vectors
+            if source is self._vectors and self.dtype != "float32" and (dtype == "float32" or rescore):
+                logger.warning(f"{self.collection_name}: converting {self.dtype} vectors without float32 copies, "
+                               f"precision lost by the previous quantization is not recovered")
+            scales = self._scales.array if source is self._vectors and self._scales is not None else None
+            previous = {files.path for files in self._files}
+            target = {"vectors.npy": (dtype, (self._dim,))}
+            if dtype == "int8":
+                target["scales.npy"] = ("float32", ())
+            if rescore and dtype != "float32":
+                target["originals.npy"] = ("float32", (self._dim,))
+            written = {name: np.lib.format.open_memmap(self._path(name + ".tmp"), mode="w+", dtype=file_dtype,
+                                                       shape=(max(self._count, 1), *shape))
+                       for name, (file_dtype, shape) in target.items()}
+            for start in range(0, self._count, SEARCH_BLOCK_ROWS):
+                end = min(start + SEARCH_BLOCK_ROWS, self._count)
+                full = dequantize(source.array[start:end], scales[start:end] if scales is not None else None)
+                stored, block_scales = quantize(full, dtype)
+                written["vectors.npy"][start:end] = stored
+                if "scales.npy" in written:
+                    written["scales.npy"][start:end] = block_scales
+                if "originals.npy" in written:
+                    written["originals.npy"][start:end] = full
+            for name, array in written.items():
+                array.flush()
+                del array
+                os.replace(self._path(name + ".tmp"), self._path(name))
+            written.clear()
+            for path in previous - {self._path(name) for name in target}:
+                os.remove(path)
+            self.dtype, self.rescore = dtype, rescore
+            self._write_info()
+            self._load()
+
+    def flush(self) -> None:
+        """Write the mapped vectors and the cluster assignments of recently added rows to disk."""
+        with self._lock:
+            for files in self._files:
+                files.flush()
+            self._ivf.save(self._ivf_path)
+
+
+class LocalKnowledgeBase:
+    """Knowledge base collection kept in a `LocalIndex`, usable in place of ``DocEmbedder``.
+
+    Attributes:
+        index: Vector index of the collection
+        embedder: Embedder for documents and queries
+        collection_name: Name of the collection
+        embedding_model: Name of the embedding model
+    """
+
+    def __init__(self, index: LocalIndex, embedder: Embedder):
+        """Initialize the knowledge base.
+
+        Args:
+            index: Vector index of the collection
+            embedder: Embedder for documents and queries, using the embedding model of the index
+        """
+        self.index = index
+        self.embedder = embedder
+        self.collection_name = index.collection_name
+        self.embedding_model = index.embedding_model
+
+    def embed_text(self, text: str, doc_name: str, page_number: int = 0) -> None:
+        """Embed a piece of text.
+
+        Args:
+            text: Text to embed
+            doc_name: Name of the document the text comes from
+            page_number: Number of the page the text starts on
+        """
+        self.embed_chunks(doc_name, [Chunk(text, page_number, page_number, 0, len(text))])
+
+    def embed_chunks(self, doc_name: str, chunks: Sequence[Chunk]) -> None:
+        """Embed chunks of a document with a single embedding request.
+
+        Args:
+            doc_name: Name of the document
+            chunks: Chunks to embed
+        """
+        if chunks:
+            self.index.add(doc_name, chunks, self.embedder.embed([chunk.text for chunk in chunks]))
+
+    def retrieve_docs(self, query: str, collection: str = "", num_docs: int = 5) -> str:
+        """Retrieve the passages most relevant to a query.
+
+        Args:
+            query: Query text
+            collection: Ignored, the collection is that of the index
+            num_docs: Number of passages to retrieve
+
+        Returns:
+            Passages, headed by their source
+        """
+        return format_passages(self.index.search(self.embedder.embed([query])[0], num_docs))
+
+    def delete_pages(self, doc_name: str, page_numbers: Iterable[int]) -> None:
+        """Drop the chunks of a document starting on some pages.
+
+        Args:
+            doc_name: Name of the document
+            page_numbers: Numbers of the pages
+        """
+        self.index.remove_pages(doc_name, page_numbers)
+
+    def get_embedded_documents(self) -> List[Tuple[str, str]]:
+        """List the embedded documents of every collection using the same embedding model.
+
+        Returns:
+            Document name and collection name pairs
+        """
+        with Session(self.index.engine) as session:
+            return list(session.exec(select(IndexedChunk.document, IndexedChunk.collection_name).where(
+                IndexedChunk.embedding_model == self.embedding_model,
+                IndexedChunk.deleted == False).distinct()).all())  # noqa: E712
+
+
+def format_passages(results: List[Tuple[IndexedChunk, float]]) -> str:
+    """
+    Render retrieved chunks as context text
+    :param results: Chunks and scores, best first
+    :return: One paragraph per chunk, headed by its source
+    """
+    return "\n\n".join(f"[{os.path.basename(chunk.document)}, p. {chunk.page_start + 1}]\n{chunk.text}"
+                       for chunk, _ in results)
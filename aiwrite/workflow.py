@@ -1,16 +1,132 @@
 import datetime
+import hashlib
+import inspect
 import os
-from typing import List, Dict, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Generator, Iterator, List, Dict, NamedTuple, Optional, Tuple, TypeVar
 
-import fitz
-from fitz import EmptyFileError
-from libbydbot.brain import LibbyDBot
 import loguru
-from libbydbot.brain.embed import DocEmbedder
-from sqlmodel import Field, Session, SQLModel, create_engine, select
+from sqlalchemy import Column, Engine, Index, MetaData, String, Table, delete
+from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy.orm import selectinload
+from sqlmodel import Field, Relationship, Session, SQLModel, create_engine, select
+
+from aiwrite.folders import FolderWatcher, ScanReport, scan_folder
+from aiwrite.chunking import Chunk, chunk_pages, estimate_tokens
+from aiwrite.context import ContextBuilder, PrefixTracker
+from aiwrite.embeddings import CachedEmbedder, EmbeddingCache, HTTPEmbedder
+from aiwrite.ingest import (CollectionSettings, IngestionPipeline, IngestLedger, IngestStats, count_pages,
+                            extract_pages)
+from aiwrite.jobs import IngestionJob, IngestionQueue
+from aiwrite.llmcache import RESPONSE_CACHE_MODES, ResponseCache
+from aiwrite.pool import InstancePool
+from aiwrite.quantize import QuantizationReport, migrate_index, storage_dtype
+from aiwrite.retrieval import RetrievalCache
+from aiwrite.summaries import SummaryStore
+from aiwrite.vectorindex import LocalIndex, LocalKnowledgeBase, format_passages
+
+if TYPE_CHECKING:
+    from libbydbot.brain import LibbyDBot
+    from libbydbot.brain.embed import DocEmbedder
 
 logger = loguru.logger
 
+T = TypeVar("T")
+
+#: Knowledge base storage backends selectable through ``Workflow(vector_store=...)``
+VECTOR_STORES = ("docembedder", "mmap")
+#: Table in which DocEmbedder keeps one row per embedded chunk, by document, page and collection
+DOC_EMBEDDER_TABLE = "embedding"
+
+
+def _new_bot(model: str) -> "LibbyDBot":
+    # libbydbot is slow to import, so it is imported when the first client is built
+    from libbydbot.brain import LibbyDBot
+    return LibbyDBot(model=model)
+
+
+def _new_doc_embedder(key: Tuple[str, str, str]) -> "DocEmbedder":
+    from libbydbot.brain.embed import DocEmbedder
+    collection_name, dburl, embedding_model = key
+    return DocEmbedder(col_name=collection_name, dburl=dburl, embedding_model=embedding_model)
+
+
+def close_client(client: Any) -> None:
+    """
+    Release the connections of a client evicted from a pool.
+
+    Clients with a ``close`` method are closed; otherwise the session and the
+    database engine they hold, if any, are closed and disposed of.
+    :param client: Model or knowledge base client
+    """
+    close = getattr(client, "close", None)
+    if callable(close):
+        close()
+        return
+    session = getattr(client, "session", None)
+    if session is not None and hasattr(session, "close"):
+        session.close()
+    engine = getattr(client, "engine", None)
+    if engine is not None and hasattr(engine, "dispose"):
+        engine.dispose()
+
+
+def delete_embedded_pages(kb: "DocEmbedder", doc_name: str, page_numbers: List[int]) -> int:
+    """
+    Delete the chunks of a document starting on some pages from the table of a DocEmbedder.
+
+    DocEmbedder has no method to drop embeddings, so its rows are deleted by
+    document name, page number and collection through its database engine.
+    :param kb: Knowledge base client
+    :param doc_name: Name of the document, as it was embedded
+    :param page_numbers: Numbers of the pages
+    :return: Number of chunks deleted
+    :raises RuntimeError: If the knowledge base has no such table, as its stale chunks cannot be dropped then
+    """
+    session = getattr(kb, "session", None)
+    engine = getattr(kb, "engine", None) or (session.get_bind() if session is not None else None)
+    try:
+        if engine is None:
+            raise NoSuchTableError(DOC_EMBEDDER_TABLE)
+        table = Table(DOC_EMBEDDER_TABLE, MetaData(), autoload_with=engine)
+        columns = table.c.doc_name, table.c.page_number, table.c.collection_name
+    except (NoSuchTableError, AttributeError) as exc:
+        raise RuntimeError(f"Cannot drop the previous embeddings of {doc_name}: the knowledge base keeps no "
+                           f"'{DOC_EMBEDDER_TABLE}' table of chunks by document, page and collection. "
+                           f"Re-embedding it would leave stale chunks next to the new ones.") from exc
+    doc_column, page_column, collection_column = columns
+    with engine.begin() as connection:
+        return connection.execute(delete(table).where(doc_column == doc_name, page_column.in_(page_numbers),
+                                                      collection_column == kb.collection_name)).rowcount
+
+
+#: Model clients by model name, shared by all workflows. Calls check one out, so each has its own context
+LLM_POOL: "InstancePool[str, LibbyDBot]" = InstancePool(
+    _new_bot, idle_timeout=float(os.getenv("CLIENT_POOL_IDLE_TIMEOUT", "600")), close=close_client)
+#: Knowledge base clients by collection name, database URL and embedding model
+KB_POOL: "InstancePool[Tuple[str, str, str], DocEmbedder]" = InstancePool(
+    _new_doc_embedder, idle_timeout=float(os.getenv("CLIENT_POOL_IDLE_TIMEOUT", "600")), close=close_client)
+#: Databases whose unfinished ingestion jobs were resumed by this process
+_RESUMED_DATABASES = set()
+_RESUMED_LOCK = threading.Lock()
+
+TITLE_PROMPT = ("Please provide a title for the document, based on this concept: {concept}.\n\n"
+                " Only return the title, without additional text.")
+ABSTRACT_PROMPT = ("Please write an abstract for a document, based on the context provided. "
+                   "Only return the abstract text, without additional text.")
+SECTION_PROMPT = ("Please write the {section_name} section of the manuscript, based on the context provided. "
+                  "Only return the section text, without additional text.")
+ENHANCE_PROMPT = ("Please enhance the {section_name} section of the manuscript, based on the context provided. "
+                  "Only return the enhanced section text, without additional text.")
+CRITIQUE_PROMPT = ("Please criticize the {section_name} section of the manuscript, based on the context provided. "
+                   "Only return your critical opinion of the section, indicating changes that could be applied to improve it.")
+SUMMARY_PROMPT = ("Please summarize the manuscript text provided in the context in a few sentences, keeping its "
+                  "main claims, methods and results. Only return the summary, without additional text.")
+
 class Project(SQLModel, table=True):
     """Represents a project configuration.
     
@@ -44,12 +160,17 @@ class Project(SQLModel, table=True):
 
 class Manuscript(SQLModel, table=True):
     """Represents a manuscript in the database.
-    
+
+    The Markdown text is stored as one ``ManuscriptSection`` row per section, so
+    section-level edits only touch the affected rows. ``source`` assembles the
+    complete text from those rows on access.
+
     Attributes:
         id: Unique identifier for the manuscript
         created: Timestamp when manuscript was first created
         last_updated: Timestamp when manuscript was last modified
-        source: Complete Markdown text content of the manuscript
+        legacy_source: Text of manuscripts stored before sections were split into rows
+        sections: Ordered sections of the manuscript
     """
     id: Optional[int] = Field(default=None, primary_key=True)
     created: datetime.datetime = Field(
@@ -62,22 +183,169 @@ class Manuscript(SQLModel, table=True):
         nullable=False,
         index=True
     )
-    source: str  # Stores the complete Markdown text of the manuscript
+    legacy_source: str = Field(default="", sa_column=Column("source", String, nullable=False, default=""))
+    sections: List["ManuscriptSection"] = Relationship(
+        back_populates="manuscript",
+        sa_relationship_kwargs={"order_by": "ManuscriptSection.position", "cascade": "all, delete-orphan"}
+    )
+
+    @classmethod
+    def from_text(cls, text: str) -> "Manuscript":
+        """Create a manuscript from Markdown text.
+
+        Args:
+            text: Markdown text of the manuscript
+
+        Returns:
+            New, unsaved Manuscript object
+        """
+        manuscript = cls()
+        manuscript.set_source(text)
+        return manuscript
+
+    @property
+    def source(self) -> str:
+        """Complete Markdown text of the manuscript."""
+        if not self.sections:
+            return self.legacy_source
+        return "".join(section.content for section in self.sections)
+
+    def get_section(self, slug: str) -> Optional["ManuscriptSection"]:
+        """Get the first section with the given slug, if any."""
+        for section in self.sections:
+            if section.slug == slug:
+                return section
+        return None
+
+    def set_source(self, text: str) -> None:
+        """Replace the text of the manuscript, keeping unchanged section rows untouched.
+
+        Rows whose content is unchanged are reused as they are (at most their
+        position changes); remaining rows are rewritten, new ones appended and
+        leftovers dropped.
+
+        Args:
+            text: New Markdown text of the manuscript
+        """
+        chunks = split_manuscript_sections(text)
+        unchanged: Dict[str, List[ManuscriptSection]] = {}
+        for section in self.sections:
+            unchanged.setdefault(section.content, []).append(section)
+        reused = set()
+        new_sections: List[Optional[ManuscriptSection]] = []
+        for slug, content in chunks:
+            candidates = unchanged.get(content)
+            section = candidates.pop(0) if candidates else None
+            if section is not None:
+                reused.add(id(section))
+            new_sections.append(section)
+        spare = [section for section in self.sections if id(section) not in reused]
+        for position, (slug, content) in enumerate(chunks):
+            section = new_sections[position]
+            if section is None:
+                section = spare.pop(0) if spare else ManuscriptSection()
+                section.slug = slug
+                section.content = content
+                section.last_updated = datetime.datetime.now()
+                new_sections[position] = section
+            if section.position != position:
+                section.position = position
+        self.sections = new_sections
+        self.legacy_source = ""
+
+    def append_section(self, name: str, body: str) -> "ManuscriptSection":
+        """Append a new section at the end of the manuscript.
+
+        Args:
+            name: Section name, used as the heading
+            body: Markdown text of the section, without heading
+
+        Returns:
+            The new ManuscriptSection
+        """
+        if not self.sections and self.legacy_source:
+            self.set_source(self.legacy_source)
+        position = self.sections[-1].position + 1 if self.sections else 0
+        section = ManuscriptSection(
+            position=position,
+            slug=section_slug(name),
+            content=f"\n\n## {name}\n{body}"
+        )
+        self.sections.append(section)
+        return section
+
+
+class ManuscriptSection(SQLModel, table=True):
+    """Represents one section of a manuscript.
+
+    Each row holds the raw Markdown of a section, from the whitespace that
+    precedes its ``## `` heading to the end of its body, so concatenating the
+    rows in ``position`` order reproduces the manuscript text exactly. The title
+    block before the first section has an empty slug.
+
+    Attributes:
+        id: Unique identifier for the section
+        manuscript_id: ID of the manuscript the section belongs to
+        position: Order of the section within the manuscript
+        slug: Lower-case section name
+        content: Markdown text of the section, including its heading
+        last_updated: Timestamp when the section was last modified
+    """
+    __table_args__ = (Index("ix_manuscriptsection_manuscript_slug", "manuscript_id", "slug"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    manuscript_id: Optional[int] = Field(default=None, foreign_key="manuscript.id", index=True)
+    position: int = Field(default=0)
+    slug: str = Field(default="")
+    content: str = Field(default="")
+    last_updated: datetime.datetime = Field(
+        default_factory=datetime.datetime.now,
+        nullable=False
+    )
+    manuscript: Optional[Manuscript] = Relationship(back_populates="sections")
+
+    @property
+    def body(self) -> str:
+        """Text of the section below its heading."""
+        if not self.slug:
+            return self.content
+        span = index_manuscript_text(self.content).sections[0]
+        return self.content[span.body_start:span.body_end]
+
+    @property
+    def heading(self) -> str:
+        """Leading whitespace and heading line of the section, ending with a newline."""
+        span = index_manuscript_text(self.content).sections[0]
+        heading = self.content[:span.body_start]
+        return heading if heading.endswith("\n") else heading + "\n"
+
+    def set_body(self, body: str) -> None:
+        """Replace the text below the heading, keeping the heading and leading whitespace."""
+        self.content = self.heading + body
+        self.last_updated = datetime.datetime.now()
 
 
 class Workflow:
     """Manages the manuscript writing workflow including database, AI model and knowledge base.
     
     Attributes:
-        engine: Database engine connection
+        engine: Database engine connection, created on first use
         base_prompt: Default prompt for AI writing
-        libby: AI model instance
-        KB: Knowledge base embedding instance
+        libby: AI model instance, built on first use
+        KB: Knowledge base embedding instance, connected on first use
+        collection_name: Name of the knowledge base collection
+        retrieval_cache: Recent knowledge base retrieval results
+        response_cache: Cache of model responses, None when disabled
+        context_builder: Fits the manuscript sent with each model call in a token budget
+        section_summaries: Summaries of manuscript sections, sent in place of sections that do not fit
+        prefix_tracker: How much of each model context repeats the start of the previous ones
         manuscript: Currently loaded manuscript
     """
 
     def __init__(self, dburl: str = "sqlite:///data/aiwrite.db", model: str = "gpt", db_path: str = "/data",
-                 collection_name: str = "literature", project_id: Optional[int] = None, embedding_model: str = "gemini-embedding-001"):
+                 collection_name: str = "literature", project_id: Optional[int] = None, embedding_model: str = "gemini-embedding-001",
+                 local_index: bool = False, vector_store: str = "docembedder", vector_dtype: str = "float32",
+                 response_cache: Optional[str] = None):
         """Initialize the workflow with database, AI model and knowledge base.
         
         Args:
@@ -85,29 +353,114 @@ class Workflow:
             model: Name of AI model to use
             collection_name: Name of knowledge base collection
             project_id: ID of the project to load (if any)
+            local_index: Whether to keep an in-process vector index of the collections, see `LocalIndex`.
+                Newly ingested chunks are then embedded once, through `embedder`, and stored in the index
+                only; documents embedded into the knowledge base before are added by `build_local_index`
+            vector_store: Knowledge base storage, ``docembedder`` for the libbydbot database or ``mmap``
+                for memory-mapped files next to ``db_path``, see `LocalKnowledgeBase`
+            vector_dtype: Data type of the vectors of new local indexes, float32 or float16
+            response_cache: Cache of model responses next to ``db_path``: ``off``, ``on``, or ``replay`` to
+                answer only from the cache, see `ResponseCache`. Defaults to the ``LLM_CACHE`` variable, else off
         """
-        self.engine = create_engine(dburl)
+        if vector_store not in VECTOR_STORES:
+            raise ValueError(f"Unknown vector store {vector_store}, expected one of {', '.join(VECTOR_STORES)}")
+        response_cache = response_cache or os.getenv("LLM_CACHE", "off")
+        if response_cache not in RESPONSE_CACHE_MODES:
+            raise ValueError(f"Unknown response cache mode {response_cache}, "
+                             f"expected one of {', '.join(RESPONSE_CACHE_MODES)}")
         self.db_path = db_path
         if not os.path.exists(db_path.strip('/')):
             os.makedirs(db_path.strip('/'))
-        SQLModel.metadata.create_all(self.engine)
+        # The database, model client and knowledge base are set up on first use, see the properties below
+        self._engine: Optional[Engine] = None
+        self._engine_lock = threading.Lock()
+        self._model = model
+        self._libby: Optional["LibbyDBot"] = None
+        self._kb: Optional["DocEmbedder"] = None
+        self._kb_lock = threading.Lock()
+        self._section_summaries: Optional[SummaryStore] = None
         self.base_prompt = ("You are a Technical writer. You should write technical documents in markdown format"
                             "on request.")
-        self.libby = LibbyDBot(model=model)
+        self.response_cache: Optional[ResponseCache] = None
+        if response_cache != "off":
+            self.response_cache = ResponseCache(os.path.join(db_path.strip('/'), "llm_cache.sqlite"),
+                                                max_bytes=int(os.getenv("LLM_CACHE_MB", "64")) * 2 ** 20,
+                                                replay=response_cache == "replay")
         self.dburl = dburl
         self.embedding_model = embedding_model
-        self.KB = DocEmbedder(col_name=collection_name, dburl=dburl, embedding_model=embedding_model)
+        self.collection_name = collection_name
+        self.vector_store = vector_store
+        self.vector_dtype = vector_dtype
+        # With memory-mapped storage the knowledge base is the local index already
+        self.use_local_index = local_index and vector_store != "mmap"
+        self._local_indexes: Dict[Tuple[str, str], LocalIndex] = {}
+        self._embedder: Optional[CachedEmbedder] = None
+        self._lazy_lock = threading.Lock()
+        self._ingestion: Optional[IngestionPipeline] = None
+        self._ingestion_queue: Optional[IngestionQueue] = None
+        self.retrieval_cache = RetrievalCache(max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "256")),
+                                              ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", "600")))
+        self.context_builder = ContextBuilder(budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000")),
+                                              summaries=self._section_summary)
+        self.prefix_tracker = PrefixTracker(min_tokens=int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024")))
+        self._scan_lock = threading.Lock()
+        self._folder_watcher: Optional[FolderWatcher] = None
         self.manuscript = None
         self.project_id = project_id
         self.current_project = self.get_project(project_id) if project_id else None
 
+    @property
+    def engine(self) -> Engine:
+        """Database engine, created with the tables on first use."""
+        with self._engine_lock:
+            if self._engine is None:
+                engine = create_engine(self.dburl)
+                SQLModel.metadata.create_all(engine)
+                self._engine = engine
+            return self._engine
+
+    @property
+    def libby(self) -> "LibbyDBot":
+        """AI model client of the current model, built on first use.
+
+        The instance is taken out of `LLM_POOL` for this workflow alone, so
+        changing its state does not affect calls, which check out their own.
+        """
+        if self._libby is None:
+            self._libby = LLM_POOL.acquire(self._model)
+        return self._libby
+
+    @property
+    def KB(self) -> "DocEmbedder":
+        """Knowledge base of the current collection, connected on first use."""
+        with self._kb_lock:
+            if self._kb is None:
+                if self.vector_store == "mmap":
+                    self._kb = self._new_knowledge_base(self.collection_name)
+                else:
+                    self._kb = KB_POOL.acquire(self._kb_key(self.collection_name))
+            return self._kb
+
+    @property
+    def section_summaries(self) -> SummaryStore:
+        """Summaries of manuscript sections, generated in the background."""
+        with self._lazy_lock:
+            if self._section_summaries is None:
+                self._section_summaries = SummaryStore(self.engine, self._summarize_text)
+            return self._section_summaries
+
     def set_knowledge_base(self, collection_name: str) -> None:
         """Set the knowledge base collection to use.
         
         Args:
             collection_name: Name of the knowledge base collection
         """
-        self.KB = DocEmbedder(col_name=collection_name, dburl=self.dburl)
+        with self._kb_lock:
+            if self._kb is not None and collection_name != self.collection_name:
+                if self.vector_store != "mmap":
+                    KB_POOL.release(self._kb_key(self.collection_name), self._kb)
+                self._kb = None
+            self.collection_name = collection_name
 
     def set_model(self, model: str) -> None:
         """Set the AI model to use for writing.
@@ -115,27 +468,365 @@ class Workflow:
         Args:
             model: Name of the AI model
         """
+        if model == self._model and self._libby is not None:
+            return
         try:
-            self.libby = LibbyDBot(model=model)
+            libby = LLM_POOL.acquire(model)
         except ValueError as exc:
             print(f"Error: {exc}\nUsing the default model instead.")
+            return
+        if self._libby is not None:
+            LLM_POOL.release(self._model, self._libby)
+        self._libby = libby
+        self._model = model
 
-    def embed_document(self, file_name: str) -> None:
+    def embed_document(self, file_name: str, batch_size: Optional[int] = None,
+                       max_concurrency: Optional[int] = None, collection_name: Optional[str] = None,
+                       progress: Optional[Callable[[int, int], None]] = None,
+                       cancel: Optional[threading.Event] = None) -> IngestStats:
         """Embed the contents of a document into the knowledge base.
+
+        Pages are extracted in parallel, cut into chunks according to the collection
+        settings and embedded in batches, see `IngestionPipeline`.
+        Content already embedded into the collection with the same embedding model
+        is skipped, and the embeddings of changed pages are replaced.
         
         Args:
             file_name: Path to the document file to embed
+            batch_size: Number of pages per embedding batch
+            max_concurrency: Maximum number of batches embedded at the same time
+            collection_name: Collection to embed into, defaults to the current knowledge base collection
+            progress: Called with the number of pages done and the total number of pages
+            cancel: Event stopping the ingestion when set
+
+        Returns:
+            Throughput statistics of the ingestion
         """
+        collection_name = collection_name or self.collection_name
+        if self._ingestion is None:
+            self._ingestion = IngestionPipeline()
+        chunking = self.get_collection_settings(collection_name).chunking
+        ledger = IngestLedger(self.engine, collection_name, self.KB.embedding_model, chunking)
         try:
-            doc = fitz.open(file_name)
-        except EmptyFileError:
-            pass
-        n = doc.name
-        for page_number, page in enumerate(doc):
-            text = page.get_text()
-            if not text:
+            return self._ingestion.ingest(file_name, batch_size=batch_size, max_concurrency=max_concurrency,
+                                          ledger=ledger, embed_batch=partial(self._embed_batch, collection_name),
+                                          remove_pages=partial(self._remove_pages, collection_name),
+                                          progress=progress, cancel=cancel, chunking=chunking)
+        finally:
+            index = self._local_indexes.get((collection_name, self.embedding_model))
+            if index is not None:
+                index.flush()
+
+    def get_collection_settings(self, collection_name: Optional[str] = None) -> CollectionSettings:
+        """Get the ingestion settings of a knowledge base collection.
+
+        Args:
+            collection_name: Name of the collection, defaults to the current one
+
+        Returns:
+            Settings of the collection, defaults if never set
+        """
+        collection_name = collection_name or self.collection_name
+        with Session(self.engine) as session:
+            return session.get(CollectionSettings, collection_name) or CollectionSettings(
+                collection_name=collection_name)
+
+    def set_collection_settings(self, collection_name: Optional[str] = None, **settings) -> CollectionSettings:
+        """Change the ingestion settings of a knowledge base collection.
+
+        Documents ingested afterwards are cut with the new settings, and documents
+        embedded with other settings are embedded again on their next ingestion.
+
+        Args:
+            collection_name: Name of the collection, defaults to the current one
+            **settings: Fields of `CollectionSettings` to change, e.g. ``chunk_tokens=256``
+
+        Returns:
+            The updated settings
+        """
+        collection_name = collection_name or self.collection_name
+        with Session(self.engine, expire_on_commit=False) as session:
+            row = session.get(CollectionSettings, collection_name) or CollectionSettings(
+                collection_name=collection_name)
+            for field, value in settings.items():
+                if field not in CollectionSettings.model_fields or field == "collection_name":
+                    raise ValueError(f"Unknown collection setting: {field}")
+                if field == "quantization":
+                    storage_dtype(value)
+                setattr(row, field, value)
+            session.add(row)
+            session.commit()
+            return row
+
+    @property
+    def embedder(self) -> CachedEmbedder:
+        """Embedder for the knowledge base embedding model, backed by an on-disk cache next to ``db_path``.
+
+        Used by the local index and the memory-mapped store. DocEmbedder computes its
+        vectors internally, so embeddings of the default store do not go through the cache.
+        """
+        with self._lazy_lock:
+            if self._embedder is None:
+                cache = EmbeddingCache(os.path.join(self.db_path.strip('/'), "embedding_cache.sqlite"),
+                                       max_bytes=int(os.getenv("EMBEDDING_CACHE_MB", "512")) * 2 ** 20)
+                self._embedder = CachedEmbedder(HTTPEmbedder(self.embedding_model), cache)
+            return self._embedder
+
+    @property
+    def ingestion_queue(self) -> IngestionQueue:
+        """Background ingestion jobs, created on first access."""
+        with self._lazy_lock:
+            if self._ingestion_queue is None:
+                self._ingestion_queue = IngestionQueue(self.engine, self._run_ingestion_job,
+                                                       max_workers=int(os.getenv("INGESTION_WORKERS", "2")))
+            return self._ingestion_queue
+
+    def resume_ingestion(self) -> int:
+        """Resume the ingestion jobs left unfinished by the last run, once per process and database.
+
+        Returns:
+            Number of jobs resumed, 0 if they were resumed already
+        """
+        with _RESUMED_LOCK:
+            if self.dburl in _RESUMED_DATABASES:
+                return 0
+            _RESUMED_DATABASES.add(self.dburl)
+        return self.ingestion_queue.resume()
+
+    def local_index(self, collection_name: Optional[str] = None) -> LocalIndex:
+        """In-process vector index of a collection, stored next to ``db_path``.
+
+        Args:
+            collection_name: Name of the collection, defaults to the current one
+
+        Returns:
+            The index, opened on first access
+        """
+        key = (collection_name or self.collection_name, self.embedding_model)
+        with self._lazy_lock:
+            if key not in self._local_indexes:
+                settings = self.get_collection_settings(key[0])
+                self._local_indexes[key] = LocalIndex(self.engine, os.path.join(self.db_path.strip('/'), "index"),
+                                                      *key, nprobe=int(os.getenv("LOCAL_INDEX_NPROBE", "8")),
+                                                      dtype=storage_dtype(settings.quantization, self.vector_dtype),
+                                                      rescore=settings.rescore and settings.quantization != "none")
+            return self._local_indexes[key]
+
+    def quantize_collection(self, collection_name: Optional[str] = None, quantization: str = "int8",
+                            rescore: bool = True) -> Optional[QuantizationReport]:
+        """Change how the vectors of a collection are stored in its local index, converting stored vectors.
+
+        Args:
+            collection_name: Name of the collection, defaults to the current one
+            quantization: ``none``, ``float16`` or ``int8``
+            rescore: Whether to keep float32 copies of quantized vectors to re-score the best matches
+
+        Returns:
+            Storage and latency before and after the conversion, None if the collection has no local index
+        """
+        collection_name = collection_name or self.collection_name
+        self.set_collection_settings(collection_name, quantization=quantization, rescore=rescore)
+        if not (self.use_local_index or self.vector_store == "mmap"):
+            return None
+        report = migrate_index(self.local_index(collection_name), storage_dtype(quantization, self.vector_dtype),
+                               rescore and quantization != "none")
+        self.retrieval_cache.invalidate(collection_name)
+        return report
+
+    def build_local_index(self, collection_name: Optional[str] = None) -> int:
+        """Add the documents embedded before the local index was enabled to it.
+
+        The documents are extracted and chunked again; their vectors mostly come
+        from the embedding cache.
+
+        Args:
+            collection_name: Name of the collection, defaults to the current one
+
+        Returns:
+            Number of chunks added
+        """
+        collection_name = collection_name or self.collection_name
+        index = self.local_index(collection_name)
+        settings = self.get_collection_settings(collection_name)
+        ledger = IngestLedger(self.engine, collection_name, self.KB.embedding_model, settings.chunking)
+        added = 0
+        for name in sorted(set(ledger.embedded_documents()) - index.documents):
+            if not os.path.exists(name):
+                logger.warning(f"Cannot index {name}: file not found")
                 continue
-            self.KB.embed_text(text, n, page_number)
+            chunks = chunk_pages(extract_pages(name, 0, count_pages(name)), settings.chunking)
+            for start in range(0, len(chunks), 64):
+                batch = chunks[start:start + 64]
+                index.add(name, batch, self.embedder.embed([chunk.text for chunk in batch]))
+            added += len(chunks)
+        index.flush()
+        self.retrieval_cache.invalidate(collection_name)
+        return added
+
+    def queue_document(self, file_name: str, collection_name: Optional[str] = None) -> IngestionJob:
+        """Embed a document in the background.
+
+        Args:
+            file_name: Path to the document file to embed
+            collection_name: Collection to embed into, defaults to the current knowledge base collection
+
+        Returns:
+            The queued job, whose progress is tracked in the database
+        """
+        return self.ingestion_queue.submit(file_name, collection_name or self.collection_name)
+
+    def _run_ingestion_job(self, job: IngestionJob, progress: Callable[[int, int], None],
+                           cancel: threading.Event) -> IngestStats:
+        return self.embed_document(job.file_name, collection_name=job.collection_name,
+                                   progress=progress, cancel=cancel)
+
+    def forget_document(self, file_name: str) -> None:
+        """Drop a document from the knowledge base.
+
+        Args:
+            file_name: Path of the document, as it was embedded
+        """
+        ledger = IngestLedger(self.engine, self.collection_name, self.KB.embedding_model,
+                              self.get_collection_settings().chunking)
+        # The ledger keeps the document until its embeddings are gone, so a failed removal can be retried
+        pages = set(ledger.page_hashes(file_name)) | {chunk.page_start for chunk in ledger.get_chunks(file_name)}
+        if pages:
+            self._remove_pages(self.collection_name, file_name, sorted(pages))
+        ledger.forget_document(file_name)
+
+    def rescan_folder(self, folder: Optional[str] = None) -> ScanReport:
+        """Embed new and modified documents of a folder and drop deleted ones.
+
+        A manifest of the folder is kept per project, so files unchanged since
+        the previous scan are not even read.
+
+        Args:
+            folder: Folder to scan, defaults to the documents folder of the current project
+
+        Returns:
+            Report of the changes found
+        """
+        folder = folder or (self.current_project.documents_folder if self.current_project else None)
+        if not folder:
+            raise ValueError("No documents folder to scan")
+        with self._scan_lock:
+            return scan_folder(self.engine, folder, self.project_id or 0, self.embed_document, self.forget_document)
+
+    def watch_folder(self, folder: Optional[str] = None, interval: float = 30.0,
+                     on_change: Optional[Callable[[ScanReport], None]] = None) -> FolderWatcher:
+        """Re-scan a folder periodically in the background, replacing any previous watcher.
+
+        Args:
+            folder: Folder to watch, defaults to the documents folder of the current project
+            interval: Seconds between scans
+            on_change: Called with the report of scans that found changes
+
+        Returns:
+            The running watcher
+        """
+        self.stop_watching_folder()
+        self._folder_watcher = FolderWatcher(lambda: self.rescan_folder(folder), interval, on_change)
+        return self._folder_watcher
+
+    def stop_watching_folder(self) -> None:
+        """Stop the background folder watcher, if any."""
+        if self._folder_watcher is not None:
+            self._folder_watcher.stop()
+            self._folder_watcher = None
+
+    def retrieve_docs(self, query: str, num_docs: int = 15, collection_name: Optional[str] = None) -> str:
+        """Retrieve knowledge base passages relevant to a query.
+
+        Results are served from `retrieval_cache` while the collection is unchanged.
+
+        Args:
+            query: Query text
+            num_docs: Number of passages to retrieve
+            collection_name: Collection to search, defaults to the current knowledge base collection
+
+        Returns:
+            Retrieved passages as text
+        """
+        collection_name = collection_name or self.collection_name
+        with self._knowledge_base(collection_name) as kb:
+            fetch = partial(kb.retrieve_docs, query, num_docs=num_docs)
+            if self.use_local_index:
+                index = self.local_index(collection_name)
+                ledger = IngestLedger(self.engine, collection_name, kb.embedding_model)
+                missing = set(ledger.embedded_documents()) - index.documents
+                if len(index) and not missing:
+                    fetch = partial(self._search_local_index, index, query, num_docs)
+                elif len(index):
+                    logger.info(f"{len(missing)} documents of {collection_name} are not in the local index, "
+                                f"searching the knowledge base instead. Run build_local_index to add them.")
+            return self.retrieval_cache.retrieve(collection_name, kb.embedding_model, query, num_docs, fetch)
+
+    def _search_local_index(self, index: LocalIndex, query: str, num_docs: int) -> str:
+        return format_passages(index.search(self.embedder.embed([query])[0], num_docs))
+
+    def _kb_key(self, collection_name: str) -> Tuple[str, str, str]:
+        return collection_name, self.dburl, self.embedding_model
+
+    def _new_knowledge_base(self, collection_name: str) -> LocalKnowledgeBase:
+        """Memory-mapped knowledge base of a collection, a view of its local index."""
+        return LocalKnowledgeBase(self.local_index(collection_name), self.embedder)
+
+    @contextmanager
+    def _knowledge_base(self, collection_name: str) -> Iterator["DocEmbedder"]:
+        """Use the knowledge base of a collection, borrowing a pooled instance for other collections."""
+        if collection_name == self.collection_name:
+            yield self.KB
+            return
+        with self._borrowed_knowledge_base(collection_name) as kb:
+            yield kb
+
+    @contextmanager
+    def _borrowed_knowledge_base(self, collection_name: str) -> Iterator["DocEmbedder"]:
+        """Borrow a knowledge base instance of a collection for exclusive use, such as one ingestion batch."""
+        if self.vector_store == "mmap":
+            yield self._new_knowledge_base(collection_name)
+            return
+        with KB_POOL.checkout(self._kb_key(collection_name)) as kb:
+            yield kb
+
+    def _embed_batch(self, collection_name: str, doc_name: str, chunks: List[Chunk]) -> None:
+        """Embed a batch of chunks with a knowledge base instance borrowed for the batch.
+
+        With the local index enabled, the index is where the chunks are searched, so
+        they are embedded for it alone rather than a second time by the knowledge base.
+        """
+        try:
+            if self.use_local_index:
+                self.local_index(collection_name).add(doc_name, chunks,
+                                                      self.embedder.embed([chunk.text for chunk in chunks]))
+                return
+            with self._borrowed_knowledge_base(collection_name) as kb:
+                embed_chunks = getattr(kb, "embed_chunks", None)
+                if embed_chunks is not None:
+                    embed_chunks(doc_name, chunks)
+                else:
+                    for chunk in chunks:
+                        kb.embed_text(chunk.text, doc_name, chunk.page_start)
+        finally:
+            self.retrieval_cache.invalidate(collection_name)
+
+    def _remove_pages(self, collection_name: str, doc_name: str, page_numbers: List[int]) -> None:
+        """Drop the embeddings of the chunks starting on pages of a document.
+
+        Raises:
+            RuntimeError: If the knowledge base cannot drop them, see `delete_embedded_pages`
+        """
+        try:
+            with self._knowledge_base(collection_name) as kb:
+                delete_pages = getattr(kb, "delete_pages", None)
+                if delete_pages is not None:
+                    delete_pages(doc_name, page_numbers)
+                else:
+                    delete_embedded_pages(kb, doc_name, page_numbers)
+            if self.use_local_index:
+                self.local_index(collection_name).remove_pages(doc_name, page_numbers)
+        finally:
+            self.retrieval_cache.invalidate(collection_name)
 
     def get_man_list(self, n: int = 100) -> List[Manuscript]:
         """Get a list of manuscripts from the database.
@@ -147,7 +838,7 @@ class Workflow:
             List of Manuscript objects
         """
         with Session(self.engine) as session:
-            statement = select(Manuscript).limit(n)
+            statement = select(Manuscript).options(selectinload(Manuscript.sections)).limit(n)
             manuscripts = session.exec(statement).all()
         return manuscripts
 
@@ -172,25 +863,43 @@ class Workflow:
         Returns:
             Newly created Manuscript object
         """
-        title = self.libby.ask(
-            f"Please provide a title for the document, based on this concept: {concept}.\n\n Only return the title, without additional text.")
+        return _drain(self.setup_manuscript_stream(concept))
+
+    def setup_manuscript_stream(self, concept: str) -> Generator[str, None, Manuscript]:
+        """Streaming variant of ``setup_manuscript``.
+
+        Args:
+            concept: Initial concept/idea for the manuscript
+
+        Yields:
+            Markdown text of the manuscript generated so far
+
+        Returns:
+            Newly created Manuscript object, saved once generation is complete
+        """
+        title = ""
+        for chunk in self._ask_stream(TITLE_PROMPT.format(concept=concept), self._prompt_prefix()):
+            title += chunk
+            yield f"# {title}"
         try:
-            knowledge = self.KB.retrieve_docs(concept, num_docs=15).strip('"')
+            knowledge = self.retrieve_docs(concept, num_docs=15).strip('"')
         except Exception as exc:
             logger.error(f"Error retrieving documents from knowledge base: {exc}\nEmbedding model:{self.KB.embedding_model}")
             knowledge = ""
-        self.libby.set_context(self.base_prompt + f"\n\n{concept}" + f"\n\n{knowledge}")
-        abstract = self.libby.ask(
-            "Please write an abstract for a document, based on the context provided. Only return the abstract text, without additional text.")
+        abstract = ""
+        for chunk in self._ask_stream(ABSTRACT_PROMPT, self._concept_context(concept, knowledge)):
+            abstract += chunk
+            yield f"# {title}\n\n## Abstract\n{abstract}"
 
         markdown_content = f"# {title}\n\n## Abstract\n{abstract}"
-        manuscript = Manuscript(source=markdown_content)
+        manuscript = Manuscript.from_text(markdown_content)
         self._save_manuscript(manuscript)
         if self.current_project:
-            with Session(self.engine) as session:
+            with Session(self.engine, expire_on_commit=False) as session:
                 self.current_project.manuscript_id = manuscript.id
                 session.add(self.current_project)
                 session.commit()
+        self.manuscript = manuscript
         return manuscript
 
     def get_most_recent_project(self) -> int:
@@ -218,6 +927,9 @@ class Workflow:
 
     def get_manuscript(self, manuscript_id: int) -> Manuscript:
         """Retrieve a manuscript from the database by ID.
+
+        Manuscripts stored before sections were split into rows are migrated on
+        first load.
         
         Args:
             manuscript_id: ID of the manuscript to retrieve
@@ -225,9 +937,15 @@ class Workflow:
         Returns:
             Manuscript object if found, None otherwise
         """
-        with Session(self.engine) as session:
-            statement = select(Manuscript).where(Manuscript.id == manuscript_id)
+        with Session(self.engine, expire_on_commit=False) as session:
+            statement = (select(Manuscript)
+                         .where(Manuscript.id == manuscript_id)
+                         .options(selectinload(Manuscript.sections)))
             manuscript = session.exec(statement).first()
+            if manuscript and manuscript.legacy_source and not manuscript.sections:
+                manuscript.set_source(manuscript.legacy_source)
+                session.add(manuscript)
+                session.commit()
             self.manuscript = manuscript
         return manuscript
 
@@ -238,6 +956,21 @@ class Workflow:
             manuscript_id: ID of the manuscript to modify
             section_name: Name of the section to add
             
+        Returns:
+            Updated Manuscript object if successful, None otherwise
+        """
+        return _drain(self.add_section_stream(manuscript_id, section_name))
+
+    def add_section_stream(self, manuscript_id: int, section_name: str) -> Generator[str, None, Optional[Manuscript]]:
+        """Streaming variant of ``add_section``.
+
+        Args:
+            manuscript_id: ID of the manuscript to modify
+            section_name: Name of the section to add
+
+        Yields:
+            Markdown text of the manuscript with the section generated so far
+
         Returns:
             Updated Manuscript object if successful, None otherwise
         """
@@ -245,15 +978,48 @@ class Workflow:
         if not manuscript:
             return None
 
-        self.libby.set_context(self.base_prompt + f"\n\nManuscript:\n\n{manuscript.source}")
-        section = self.libby.ask(
-            f"Please write the {section_name} section of the manuscript, based on the context provided. Only return the section text, without additional text.")
+        source = manuscript.source
+        section = ""
+        for chunk in self._ask_stream(SECTION_PROMPT.format(section_name=section_name),
+                                      self._manuscript_context(source, section_name)):
+            section += chunk
+            yield f"{source}\n\n## {section_name.capitalize()}\n{section}"
 
         # Add the new section to the markdown content
-        if section.startswith(f"## {section_name.capitalize()}"):
-            section = section.split("\n", 1)[1].strip()
-        new_content = f"{manuscript.source}\n\n## {section_name.capitalize()}\n{section}"
-        manuscript.source = new_content
+        manuscript.append_section(section_name.capitalize(), strip_section_heading(section, section_name))
+        self._save_manuscript(manuscript)
+        yield manuscript.source
+        return manuscript
+
+    def add_sections(self, manuscript_id: int, section_names: List[str], max_workers: int = 4) -> Optional[Manuscript]:
+        """Generate several sections concurrently and add them to a manuscript in a single save.
+
+        Every section is written from the same frozen context (title, abstract, outline and
+        knowledge retrieved once), so the sections do not wait on each other. Sections the
+        manuscript already has are skipped.
+
+        Args:
+            manuscript_id: ID of the manuscript to modify
+            section_names: Names of the sections to add, in manuscript order
+            max_workers: Maximum number of sections generated at the same time
+
+        Returns:
+            Updated Manuscript object if successful, None otherwise
+        """
+        manuscript = self.get_manuscript(manuscript_id)
+        if not manuscript:
+            return None
+        names = outline_section_names(manuscript, section_names)
+        if not names:
+            return manuscript
+
+        context = self._outline_context(manuscript.source, names)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aiwrite-sections") as executor:
+            sections = list(executor.map(
+                lambda name: "".join(self._ask_stream(SECTION_PROMPT.format(section_name=name), context)), names))
+
+        for name, section in zip(names, sections):
+            manuscript.append_section(name.capitalize(), strip_section_heading(section, name))
         self._save_manuscript(manuscript)
         return manuscript
 
@@ -264,6 +1030,21 @@ class Workflow:
             manuscript_id: ID of the manuscript to modify
             section_name: Name of the section to enhance
             
+        Returns:
+            Updated Manuscript object if successful, None otherwise
+        """
+        return _drain(self.enhance_section_stream(manuscript_id, section_name))
+
+    def enhance_section_stream(self, manuscript_id: int, section_name: str) -> Generator[str, None, Optional[Manuscript]]:
+        """Streaming variant of ``enhance_section``.
+
+        Args:
+            manuscript_id: ID of the manuscript to modify
+            section_name: Name of the section to enhance
+
+        Yields:
+            Markdown text of the manuscript with the section enhanced so far
+
         Returns:
             Updated Manuscript object if successful, None otherwise
         """
@@ -272,22 +1053,22 @@ class Workflow:
             return None
 
         # Find and replace the existing section
-        section_header = f"## {section_name.capitalize()}"
-        if section_header not in manuscript.source:
-            return self.add_section(manuscript_id, section_name)
+        section = manuscript.get_section(section_slug(section_name))
+        if section is None:
+            return (yield from self.add_section_stream(manuscript_id, section_name))
 
-        self.libby.set_context(self.base_prompt + f"\n\nManuscript:\n\n{manuscript.source}")
-        enhanced_section = self.libby.ask(
-            f"Please enhance the {section_name} section of the manuscript, based on the context provided. Only return the enhanced section text, without additional text.")
+        context = self._manuscript_context(manuscript.source, section_name)
+        position = manuscript.sections.index(section)
+        before = "".join(s.content for s in manuscript.sections[:position]) + section.heading
+        after = "".join(s.content for s in manuscript.sections[position + 1:])
+        enhanced_section = ""
+        for chunk in self._ask_stream(ENHANCE_PROMPT.format(section_name=section_name), context):
+            enhanced_section += chunk
+            yield before + enhanced_section + after
 
         # Replace the existing section with the enhanced one
-        parts = manuscript.source.split(section_header)
-        if len(parts) > 1:
-            before_section = parts[0]
-            after_section = parts[1].split("\n## ", 1)[1] if "\n## " in parts[1] else ""
-            new_content = f"{before_section}{section_header}\n{enhanced_section}\n\n## {after_section}" if after_section else f"{before_section}{section_header}\n{enhanced_section}"
-            manuscript.source = new_content
-            self._save_manuscript(manuscript)
+        section.set_body(enhanced_section)
+        self._save_manuscript(manuscript)
         return manuscript
 
     def update_from_text(self, manuscript_id: int, text: str) -> None:
@@ -300,10 +1081,9 @@ class Workflow:
         """Update the manuscript content from a markdown text"""
         manuscript = self.get_manuscript(manuscript_id)
         parsed = parse_manuscript_text(text)
-        if not parsed:
+        if not parsed or manuscript is None or manuscript.source == text:
             return
-        manuscript.source = text
-        manuscript.last_updated = datetime.datetime.now()
+        manuscript.set_source(text)
         self._save_manuscript(manuscript)
 
     def get_manuscript_sections(self, manuscript_id: int) -> Dict[str, str]:
@@ -328,12 +1108,54 @@ class Workflow:
         Returns:
             String containing critical feedback
         """
-        self.libby.set_context(self.base_prompt + f"\n\nManuscript:\n\n{self.get_manuscript_text(manuscript_id)}")
-        criticized_section = self.libby.ask(
-            f"Please criticize the {section_name} section of the manuscript, based on the context provided. "
-            f"Only return your critical opinion of the section, indicating changes that could be applied to improve it.")
+        criticized_section = ""
+        for criticized_section in self.criticize_section_stream(manuscript_id, section_name):
+            pass
         return criticized_section
 
+    def criticize_section_stream(self, manuscript_id: int, section_name: str) -> Iterator[str]:
+        """Streaming variant of ``criticize_section``.
+
+        Args:
+            manuscript_id: ID of the manuscript containing the section
+            section_name: Name of the section to critique
+
+        Yields:
+            Critical feedback generated so far
+        """
+        context = self._manuscript_context(self.get_manuscript_text(manuscript_id), section_name)
+        criticized_section = ""
+        for chunk in self._ask_stream(CRITIQUE_PROMPT.format(section_name=section_name), context):
+            criticized_section += chunk
+            yield criticized_section
+
+    def criticize_sections(self, manuscript_id: int, section_names: Optional[List[str]] = None,
+                           max_workers: int = 4) -> Iterator[Tuple[str, str]]:
+        """Get critical feedback on several sections concurrently.
+
+        All critiques are based on a single snapshot of the manuscript.
+
+        Args:
+            manuscript_id: ID of the manuscript containing the sections
+            section_names: Sections to critique; all sections (without the title) if not given
+            max_workers: Maximum number of critiques generated at the same time
+
+        Yields:
+            ``(section_name, critique)`` pairs, in the order the critiques complete
+        """
+        source = self.get_manuscript_text(manuscript_id)
+        if section_names is None:
+            section_names = [name for name in parse_manuscript_text(source) if name != "title"]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aiwrite-review") as executor:
+            futures = {
+                executor.submit(lambda name: "".join(self._ask_stream(CRITIQUE_PROMPT.format(section_name=name),
+                                                                      self._manuscript_context(source, name))),
+                                name): name
+                for name in section_names
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
     def delete_manuscript(self, manuscript_id: int) -> None:
         """Delete a manuscript from the database.
         
@@ -383,7 +1205,7 @@ class Workflow:
             # If project doesn't exist or table is empty, create new one
             if not project:
                 # Create empty manuscript
-                empty_manuscript = Manuscript(source="# New Manuscript\n\n## Abstract\n")
+                empty_manuscript = Manuscript.from_text("# New Manuscript\n\n## Abstract\n")
                 session.add(empty_manuscript)
                 session.commit()
                 session.refresh(empty_manuscript)
@@ -426,8 +1248,101 @@ class Workflow:
                 session.delete(project)
                 session.commit()
 
+    def _prompt_prefix(self) -> str:
+        """Start shared by every model context: the base prompt and the project metadata.
+
+        Contexts continue with the frozen manuscript snapshot, and put what
+        changes from call to call last, so that consecutive calls on the same
+        manuscript share a long prefix that providers with prompt caching skip
+        re-processing.
+        """
+        prefix = self.base_prompt
+        if self.current_project:
+            prefix += f"\n\nProject: {self.current_project.name}\nLanguage: {self.current_project.language}"
+        return prefix
+
+    def _concept_context(self, concept: str, knowledge: str) -> str:
+        """Build the model context for writing from a concept and retrieved knowledge."""
+        return self._prompt_prefix() + f"\n\n{knowledge}" + f"\n\n{concept}"
+
+    def _outline_context(self, source: str, section_names: List[str]) -> str:
+        """Build the frozen model context shared by sections generated from an outline."""
+        parsed = parse_manuscript_text(source)
+        title = parsed.get("title", "")
+        abstract = parsed.get("abstract", "")
+        try:
+            knowledge = self.retrieve_docs(f"{title}\n{abstract}", num_docs=15).strip('"')
+        except Exception as exc:
+            logger.error(f"Error retrieving documents from knowledge base: {exc}")
+            knowledge = ""
+        return (self._prompt_prefix() + f"\n\nManuscript:\n\n# {title}\n\n## Abstract\n{abstract}"
+                + f"\n\n{knowledge}" + f"\n\nOutline: {', '.join(section_names)}")
+
+    def _manuscript_context(self, source: str, section_name: str) -> str:
+        """Build the model context for working on one section of a manuscript, within the token budget."""
+        manuscript, _ = self.context_builder.build(split_manuscript_sections(source), section_slug(section_name))
+        return self._prompt_prefix() + f"\n\nManuscript:\n\n{manuscript}"
+
+    @contextmanager
+    def _checkout_bot(self) -> Iterator["LibbyDBot"]:
+        """Borrow an AI model instance from `LLM_POOL` for the duration of one call.
+
+        The model context lives on the instance, so concurrent calls each get
+        their own; idle instances are kept for reuse.
+        """
+        with LLM_POOL.checkout(self._model) as bot:
+            yield bot
+
+    def _ask_stream(self, question: str, context: str) -> Iterator[str]:
+        """Ask the AI model a question, yielding the answer as it is generated.
+
+        Models whose ``ask`` cannot stream yield the whole answer as one chunk,
+        as do answers served from the response cache. Answers are cached only
+        once complete.
+
+        Args:
+            question: Question to ask
+            context: Context the question is answered in
+
+        Yields:
+            Chunks of the answer text
+
+        Raises:
+            CacheMissError: When the response cache is in replay mode and has no answer
+        """
+        cache = self.response_cache
+        if cache is None:
+            yield from self._ask_model(question, context)
+            return
+        model = self._model
+        cached = cache.get(model, context, question)
+        if cached is not None:
+            yield cached
+            return
+        answer = []
+        for chunk in self._ask_model(question, context):
+            answer.append(chunk)
+            yield chunk
+        cache.put(model, context, question, "".join(answer))
+
+    def _ask_model(self, question: str, context: str) -> Iterator[str]:
+        """Send a question to the AI model, yielding the answer as it is generated."""
+        self.prefix_tracker.record(self._model, context)
+        with self._checkout_bot() as bot:
+            bot.set_context(context)
+            if "stream" not in inspect.signature(bot.ask).parameters:
+                yield bot.ask(question)
+                return
+            response = bot.ask(question, stream=True)
+            if isinstance(response, str):
+                yield response
+            else:
+                yield from response
+
     def _save_manuscript(self, manuscript: Manuscript) -> Manuscript:
         """Save a manuscript to the database.
+
+        Only section rows that were added, changed or removed are written.
         
         Args:
             manuscript: Manuscript object to save
@@ -435,14 +1350,171 @@ class Workflow:
         Returns:
             Saved Manuscript object
         """
-        with Session(self.engine) as session:
+        with Session(self.engine, expire_on_commit=False) as session:
             # Update last_updated timestamp
             manuscript.last_updated = datetime.datetime.now()
             session.add(manuscript)
             session.commit()
-            session.refresh(manuscript)
+        self._refresh_summaries(manuscript)
         return manuscript
 
+    def _refresh_summaries(self, manuscript: Manuscript) -> None:
+        """Summarize changed sections in the background, once the manuscript outgrows the context budget."""
+        sections = [(section.slug, section.content) for section in manuscript.sections]
+        budget = self.context_builder.budget
+        if budget and sum(estimate_tokens(content) for _, content in sections) > budget:
+            self.section_summaries.refresh(sections)
+
+    def _section_summary(self, slug: str, content: str) -> Optional[str]:
+        """Cached summary of a manuscript section, see `SummaryStore.lookup`."""
+        return self.section_summaries.lookup(slug, content)
+
+    def _summarize_text(self, text: str) -> str:
+        """Summarize part of a manuscript with the AI model."""
+        return "".join(self._ask_stream(SUMMARY_PROMPT, self._prompt_prefix() + f"\n\nManuscript text:\n\n{text}"))
+
+
+def _drain(stream: Generator[str, None, T]) -> T:
+    """Consume a streaming generator and return its return value."""
+    while True:
+        try:
+            next(stream)
+        except StopIteration as stop:
+            return stop.value
+
+
+def outline_section_names(manuscript: Manuscript, section_names: List[str]) -> List[str]:
+    """
+    Normalize an outline into the names of the sections still missing from a manuscript
+    :param manuscript: Manuscript the outline is for
+    :param section_names: Section names, in manuscript order
+    :return: Unique section slugs, in order, that the manuscript does not have yet
+    """
+    slugs = dict.fromkeys(section_slug(name) for name in section_names)
+    return [slug for slug in slugs if slug and manuscript.get_section(slug) is None]
+
+
+def strip_section_heading(section: str, section_name: str) -> str:
+    """
+    Remove the heading a model sometimes repeats at the top of a generated section
+    :param section: Generated section text
+    :param section_name: Name of the section
+    :return: Section text without its heading
+    """
+    if section.startswith(f"## {section_name.capitalize()}"):
+        section = section.split("\n", 1)[1].strip() if "\n" in section else ""
+    return section
+
+
+def section_slug(name: str) -> str:
+    """
+    Normalize a section name into the key used to look it up
+    :param name: Section name or heading text
+    :return: Lower-case section slug
+    """
+    return name.strip().lower()
+
+
+class SectionSpan(NamedTuple):
+    """Location of a ``## `` section within a manuscript text.
+
+    Attributes:
+        name: Lower-case section name
+        header_start: Offset of the ``## `` heading
+        body_start: Offset of the first character after the heading line
+        body_end: Offset where the section ends (next heading or end of text)
+    """
+    name: str
+    header_start: int
+    body_start: int
+    body_end: int
+
+
+class ManuscriptIndex(NamedTuple):
+    """Section index of a manuscript text.
+
+    Attributes:
+        title: Title from the first ``# `` heading, if any
+        sections: Sections in document order
+    """
+    title: Optional[str]
+    sections: Tuple[SectionSpan, ...]
+
+    def find(self, name: str) -> Optional[SectionSpan]:
+        """Get the first section with the given name, if any."""
+        slug = section_slug(name)
+        for span in self.sections:
+            if span.name == slug:
+                return span
+        return None
+
+
+_INDEX_CACHE_SIZE = 64
+_index_cache: "OrderedDict[bytes, ManuscriptIndex]" = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def index_manuscript_text(text: str) -> ManuscriptIndex:
+    """
+    Index the sections of a markdown text in a single pass, memoized by content hash
+    :param text: Markdown text
+    :return: ManuscriptIndex with the title and the offsets of every ``## `` section
+    """
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    with _index_cache_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+
+    title = None
+    sections = []
+    pos = 0
+    length = len(text)
+    while pos < length:
+        newline = text.find("\n", pos)
+        line_end = length if newline == -1 else newline
+        next_line = length if newline == -1 else newline + 1
+        if text.startswith("## ", pos):
+            if sections:
+                sections[-1] = sections[-1]._replace(body_end=pos)
+            sections.append(SectionSpan(section_slug(text[pos + 3:line_end]), pos, next_line, length))
+        elif title is None and text.startswith("# ", pos):
+            title = text[pos + 2:line_end].strip()
+        pos = next_line
+    index = ManuscriptIndex(title, tuple(sections))
+
+    with _index_cache_lock:
+        _index_cache[key] = index
+        if len(_index_cache) > _INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def split_manuscript_sections(text: str) -> List[Tuple[str, str]]:
+    """
+    Split a markdown text into its sections
+    :param text: Markdown text
+    :return: List of (slug, chunk) pairs whose chunks concatenate back to ``text``.
+             Each chunk starts with the whitespace preceding its ``## `` heading;
+             the title block before the first heading has an empty slug.
+    """
+    chunks = []
+    if not text:
+        return chunks
+    start = 0
+    slug = ""
+    for span in index_manuscript_text(text).sections:
+        cut = span.header_start
+        while cut > start and text[cut - 1].isspace():
+            cut -= 1
+        if cut > start or slug:
+            chunks.append((slug, text[start:cut]))
+        start = cut
+        slug = span.name
+    chunks.append((slug, text[start:]))
+    return chunks
+
 
 def parse_manuscript_text(text: str) -> Dict[str, str]:
     """
@@ -454,16 +1526,10 @@ def parse_manuscript_text(text: str) -> Dict[str, str]:
     if not text:
         return parsed
 
-    # Extract title
-    title_parts = text.split('# ', 1)
-    if len(title_parts) > 1:
-        parsed['title'] = title_parts[1].split('\n', 1)[0].strip()
-
-    # Extract sections
-    sections = text.split('## ')
-    for section in sections[1:]:
-        section_name = section.split('\n', 1)[0].lower()
-        section_content = section.split('\n', 1)[1].strip() if '\n' in section else ''
-        parsed[section_name] = section_content
+    index = index_manuscript_text(text)
+    if index.title is not None:
+        parsed['title'] = index.title
+    for span in index.sections:
+        parsed[span.name] = text[span.body_start:span.body_end].strip()
 
     return parsed
@@ -0,0 +1,95 @@
+"""Recall and latency of the IVF vector index against exact search.
+
+Exact search scores every stored vector, as `LocalIndex` does for collections
+below `LocalIndex.MIN_TRAIN_ROWS` or with ``exact=True``. Vectors are synthetic and
+clustered, like sentence embeddings are.
+
+    python benchmarks/ann.py --sizes 10000 100000 1000000 --dim 384 --json ann.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiwrite.vectorindex import IVFIndex, exact_search, normalize  # noqa: E402
+
+
+def clustered_vectors(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Unit vectors scattered around random cluster centers, generated in blocks to bound memory."""
+    rng = np.random.default_rng(seed)
+    centers = np.random.default_rng(0).normal(size=(clusters, dim)).astype(np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100_000):
+        size = min(100_000, n - start)
+        block = centers[rng.integers(clusters, size=size)] + rng.normal(size=(size, dim)).astype(np.float32)
+        vectors[start:start + size] = normalize(block)
+    return vectors
+
+
+def percentiles(seconds: list) -> dict:
+    return {"p50_ms": float(np.percentile(seconds, 50) * 1000), "p95_ms": float(np.percentile(seconds, 95) * 1000)}
+
+
+def run(size: int, dim: int, k: int, queries: int, nprobes: list) -> dict:
+    vectors = clustered_vectors(size, dim, clusters=max(16, size // 500), seed=1)
+    probes = clustered_vectors(queries, dim, clusters=max(16, size // 500), seed=2)
+    result = {"chunks": size, "dim": dim, "k": k, "queries": queries}
+
+    truth, timings = [], []
+    for query in probes:
+        started = time.perf_counter()
+        rows, _ = exact_search(vectors, query, k)
+        timings.append(time.perf_counter() - started)
+        truth.append(set(rows.tolist()))
+    result["exact"] = percentiles(timings)
+
+    index = IVFIndex()
+    started = time.perf_counter()
+    index.train(vectors)
+    result["train_seconds"] = time.perf_counter() - started
+    result["nlist"] = len(index.centroids)
+    result["ivf"] = []
+    for nprobe in nprobes:
+        index.nprobe = nprobe
+        timings, recall = [], []
+        for query, expected in zip(probes, truth):
+            started = time.perf_counter()
+            found = index.search(vectors, query, k) or exact_search(vectors, query, k)
+            timings.append(time.perf_counter() - started)
+            recall.append(len(expected & set(found[0].tolist())) / k)
+        result["ivf"].append({"nprobe": nprobe, f"recall@{k}": float(np.mean(recall)), **percentiles(timings)})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("-k", type=int, default=15)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        result = run(size, args.dim, args.k, args.queries, args.nprobe)
+        results.append(result)
+        print(f"{size} chunks, exact: {result['exact']['p50_ms']:.2f} ms p50, "
+              f"{result['exact']['p95_ms']:.2f} ms p95; IVF with {result['nlist']} lists trained in "
+              f"{result['train_seconds']:.1f}s")
+        for ivf in result["ivf"]:
+            print(f"  nprobe {ivf['nprobe']:>3}: recall@{args.k} {ivf[f'recall@{args.k}']:.3f}, "
+                  f"{ivf['p50_ms']:.2f} ms p50, {ivf['p95_ms']:.2f} ms p95")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
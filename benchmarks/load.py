@@ -0,0 +1,139 @@
+"""Load test of the workflow against the mock model server.
+
+Starts `mockserver.MockModelServer` (or uses ``--url``), points the OpenAI
+and Ollama clients at it and runs ``--users`` workflows at the same time,
+each generating ``--requests`` manuscripts and sections. Reports the latency
+and time to first streamed token of each operation, the failures and the
+server counters.
+
+    python benchmarks/load.py --model llama3.2 --users 8 --requests 5 --ttft 0.5 --tokens-per-second 30 --json load.json
+
+To measure the Gradio or Flet app instead, run ``benchmarks/mockserver.py`` and
+start the app with the environment variables it prints.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Callable, Dict, Generator, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mockserver import MockModelServer, add_arguments, client_environment, config_from_arguments  # noqa: E402
+
+
+def percentiles(seconds: list) -> dict:
+    if not seconds:
+        return {}
+    return {f"p{q}_ms": float(np.percentile(seconds, q) * 1000) for q in (50, 95, 99)}
+
+
+class Recorder:
+    """Latencies, times to first token and failures of the operations of one user."""
+
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = {}
+        self.first_token: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def stream(self, operation: str, start: Callable[[], Generator]):
+        """Run a streaming workflow call, returning its return value or None if it failed."""
+        started = time.perf_counter()
+        stream = start()
+        try:
+            next(stream)
+            self.first_token.setdefault(operation, []).append(time.perf_counter() - started)
+            while True:
+                next(stream)
+        except StopIteration as stop:
+            self.latency.setdefault(operation, []).append(time.perf_counter() - started)
+            return stop.value
+        except Exception as exc:
+            errors = self.errors.setdefault(operation, {})
+            errors[type(exc).__name__] = errors.get(type(exc).__name__, 0) + 1
+            return None
+
+
+def run_user(user: int, args: argparse.Namespace, workdir: str) -> Recorder:
+    from aiwrite.workflow import Workflow
+
+    recorder = Recorder()
+    path = os.path.join(workdir, f"user{user}")
+    os.makedirs(path)
+    # Workflow strips the leading slash of db_path
+    workflow = Workflow(dburl=f"sqlite:///{path}/aiwrite.db", model=args.model, db_path=os.path.relpath(path),
+                        embedding_model=args.embedding_model, response_cache="off")
+    try:
+        for i in range(args.requests):
+            manuscript = recorder.stream("setup_manuscript",
+                                         lambda: workflow.setup_manuscript_stream(f"user {user} concept {i}"))
+            if manuscript is None:
+                continue
+            recorder.stream("add_section", lambda: workflow.add_section_stream(manuscript.id, "introduction"))
+            recorder.stream("enhance_section", lambda: workflow.enhance_section_stream(manuscript.id, "introduction"))
+    finally:
+        workflow.section_summaries.shutdown()
+        workflow.engine.dispose()
+    return recorder
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Use a running server instead of starting one")
+    parser.add_argument("--model", default="llama3.2", help="Model of the workflows, as named for libbydbot")
+    parser.add_argument("--embedding-model", default="text-embedding-3-small")
+    parser.add_argument("--users", type=int, default=4, help="Workflows running at the same time")
+    parser.add_argument("--requests", type=int, default=5, help="Manuscripts generated per user")
+    parser.add_argument("--json", help="Write the results to this file")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = MockModelServer(config_from_arguments(args)).start()
+        url = server.url
+    # The clients read their endpoints when they are built, so this comes before any workflow
+    os.environ.update(client_environment(url))
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as workdir, ThreadPoolExecutor(args.users) as executor:
+        recorders = list(executor.map(lambda user: run_user(user, args, workdir), range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    operations = sorted({operation for recorder in recorders for operation in recorder.latency}
+                        | {operation for recorder in recorders for operation in recorder.errors})
+    results = {"url": url, "model": args.model, "users": args.users, "requests": args.requests,
+               "seconds": elapsed, "operations": {}}
+    for operation in operations:
+        latency = [seconds for recorder in recorders for seconds in recorder.latency.get(operation, [])]
+        first_token = [seconds for recorder in recorders for seconds in recorder.first_token.get(operation, [])]
+        errors: Dict[str, int] = {}
+        for recorder in recorders:
+            for name, count in recorder.errors.get(operation, {}).items():
+                errors[name] = errors.get(name, 0) + count
+        results["operations"][operation] = {"completed": len(latency), "per_second": len(latency) / elapsed,
+                                            "latency": percentiles(latency), "first_token": percentiles(first_token),
+                                            "errors": errors}
+        print(f"{operation:<17} {len(latency):>4} done, {sum(errors.values()):>3} failed, "
+              f"latency p50 {results['operations'][operation]['latency'].get('p50_ms', 0):8.0f} ms "
+              f"p95 {results['operations'][operation]['latency'].get('p95_ms', 0):8.0f} ms, first token p50 "
+              f"{results['operations'][operation]['first_token'].get('p50_ms', 0):6.0f} ms")
+    if server is not None:
+        results["server"] = {"config": asdict(server.config), "stats": asdict(server.stats)}
+        print(f"Server: {json.dumps(results['server']['stats'])}")
+        server.stop()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
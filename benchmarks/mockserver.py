@@ -0,0 +1,380 @@
+"""Local model server speaking the OpenAI and Ollama chat and embedding APIs.
+
+Answers are deterministic pseudo-text and vectors, served with a configurable
+time to first token and token rate, optionally failing a share of requests or
+rejecting requests beyond a concurrency limit. Point the clients at it with
+``OPENAI_BASE_URL=<url>/v1`` and ``OLLAMA_HOST=<url>``.
+
+    python benchmarks/mockserver.py --port 11434 --ttft 0.5 --tokens-per-second 30 --error-rate 0.02
+
+Endpoints: ``/v1/chat/completions``, ``/v1/embeddings``, ``/v1/models``,
+``/api/chat``, ``/api/generate``, ``/api/embed``, ``/api/embeddings``,
+``/api/tags``, and ``/stats`` with the request counters.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.fakes import fake_text  # noqa: E402
+
+
+@dataclass
+class ServerConfig:
+    """Behaviour of the mock server.
+
+    Attributes:
+        ttft: Seconds before the first token of an answer
+        tokens_per_second: Rate of the following tokens, 0 for no delay
+        answer_tokens: Tokens of an answer, unless the request asks for fewer
+        error_rate: Share of requests failed with ``error_status``
+        error_status: HTTP status of failed requests
+        max_concurrency: Requests served at the same time, 0 for no limit
+        queue_timeout: Seconds a request waits for a free slot before it is rejected with status 429
+        embedding_dim: Dimension of the embedding vectors
+        embed_latency: Seconds per embedded text
+        seed: Seed of the error injection
+        models: Model names listed by the server
+    """
+    ttft: float = 0.2
+    tokens_per_second: float = 50.0
+    answer_tokens: int = 200
+    error_rate: float = 0.0
+    error_status: int = 500
+    max_concurrency: int = 8
+    queue_timeout: float = 30.0
+    embedding_dim: int = 768
+    embed_latency: float = 0.0
+    seed: int = 0
+    models: List[str] = field(default_factory=lambda: ["llama3.2", "qwen3", "gpt-4o", "text-embedding-3-small"])
+
+
+@dataclass
+class ServerStats:
+    requests: int = 0
+    streamed: int = 0
+    failed: int = 0
+    rejected: int = 0
+    tokens: int = 0
+    embedded: int = 0
+    active: int = 0
+    peak_active: int = 0
+
+
+def embedding(text: str, dim: int) -> List[float]:
+    """Deterministic unit vector of a text."""
+    seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).normal(size=dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class MockModelServer:
+    """Mock model server running on a background thread.
+
+    Attributes:
+        config: Behaviour of the server
+        stats: Request counters
+    """
+
+    def __init__(self, config: ServerConfig = ServerConfig(), host: str = "127.0.0.1", port: int = 0):
+        """Bind the server, port 0 picks a free port.
+
+        Args:
+            config: Behaviour of the server
+            host: Address to listen on
+            port: Port to listen on
+        """
+        self.config = config
+        self.stats = ServerStats()
+        self._lock = threading.Lock()
+        self._random = random.Random(config.seed)
+        self._slots = threading.BoundedSemaphore(config.max_concurrency) if config.max_concurrency else None
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockModelServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-model-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockModelServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def count(self, **increments: int) -> None:
+        with self._lock:
+            for name, increment in increments.items():
+                setattr(self.stats, name, getattr(self.stats, name) + increment)
+
+    def admit(self) -> Optional[int]:
+        """Take a slot for a request.
+
+        Returns:
+            None if the request is served, else the HTTP status to fail it with
+        """
+        self.count(requests=1)
+        with self._lock:
+            failed = self._random.random() < self.config.error_rate
+        if failed:
+            self.count(failed=1)
+            return self.config.error_status
+        if self._slots is not None and not self._slots.acquire(timeout=self.config.queue_timeout):
+            self.count(rejected=1)
+            return 429
+        with self._lock:
+            self.stats.active += 1
+            self.stats.peak_active = max(self.stats.peak_active, self.stats.active)
+        return None
+
+    def leave(self) -> None:
+        with self._lock:
+            self.stats.active -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def answer(self, messages: list, max_tokens: Optional[int]) -> List[str]:
+        """Tokens of the answer to a conversation."""
+        words = fake_text(json.dumps(messages, sort_keys=True), min(max_tokens or self.config.answer_tokens,
+                                                                    self.config.answer_tokens))
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def timed(self, tokens: List[str]) -> Iterator[str]:
+        """Yield tokens at the configured time to first token and token rate."""
+        started = time.monotonic()
+        for i, token in enumerate(tokens):
+            delay = self.config.ttft + (i / self.config.tokens_per_second if self.config.tokens_per_second else 0)
+            time.sleep(max(0.0, started + delay - time.monotonic()))
+            self.count(tokens=1)
+            yield token
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.config.embed_latency * len(texts))
+        self.count(embedded=len(texts))
+        return [embedding(text, self.config.embedding_dim) for text in texts]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def mock(self) -> MockModelServer:
+        return self.server.mock
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if self.path == "/stats":
+            self._send_json({"config": asdict(self.mock.config), "stats": asdict(self.mock.stats)})
+        elif self.path == "/v1/models":
+            self._send_json({"object": "list", "data": [{"id": model, "object": "model", "owned_by": "mock"}
+                                                        for model in self.mock.config.models]})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": model, "model": model} for model in self.mock.config.models]})
+        else:
+            self._send_json({"error": f"Unknown endpoint {self.path}"}, 404)
+
+    def do_POST(self) -> None:
+        routes = {"/v1/chat/completions": self._openai_chat, "/v1/embeddings": self._openai_embeddings,
+                  "/api/chat": self._ollama_chat, "/api/generate": self._ollama_generate,
+                  "/api/embed": self._ollama_embed, "/api/embeddings": self._ollama_embeddings}
+        route = routes.get(self.path.split("?")[0])
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if route is None:
+            self._send_json({"error": f"Unknown endpoint {self.path}"}, 404)
+            return
+        status = self.mock.admit()
+        if status is not None:
+            self._send_json({"error": {"message": "Injected failure" if status != 429 else "Too many requests",
+                                       "code": status}}, status)
+            return
+        try:
+            route(json.loads(body or b"{}"))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.mock.leave()
+
+    def _openai_chat(self, request: dict) -> None:
+        model = request.get("model", "")
+        tokens = self.mock.answer(request.get("messages", []), request.get("max_tokens"))
+        created = int(time.time())
+        if not request.get("stream"):
+            content = "".join(self.mock.timed(tokens))
+            self._send_json({"id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+                             "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                          "finish_reason": "stop"}],
+                             "usage": self._usage(request.get("messages", []), tokens)})
+            return
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None) -> bytes:
+            data = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(data)}\n\n".encode()
+
+        self.mock.count(streamed=1)
+        self._start_stream("text/event-stream")
+        self._write_chunk(chunk({"role": "assistant", "content": ""}))
+        for token in self.mock.timed(tokens):
+            self._write_chunk(chunk({"content": token}))
+        self._write_chunk(chunk({}, "stop"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_stream()
+
+    def _openai_embeddings(self, request: dict) -> None:
+        texts = request.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        vectors = self.mock.embed(texts)
+        self._send_json({"object": "list", "model": request.get("model", ""),
+                         "data": [{"object": "embedding", "index": i, "embedding": vector}
+                                  for i, vector in enumerate(vectors)],
+                         "usage": {"prompt_tokens": sum(len(text.split()) for text in texts),
+                                   "total_tokens": sum(len(text.split()) for text in texts)}})
+
+    def _ollama_chat(self, request: dict) -> None:
+        self._ollama_stream(request, request.get("messages", []),
+                            lambda text: {"message": {"role": "assistant", "content": text}})
+
+    def _ollama_generate(self, request: dict) -> None:
+        messages = [{"role": "system", "content": request.get("system", "")},
+                    {"role": "user", "content": request.get("prompt", "")}]
+        self._ollama_stream(request, messages, lambda text: {"response": text})
+
+    def _ollama_stream(self, request: dict, messages: list, content) -> None:
+        model = request.get("model", "")
+        tokens = self.mock.answer(messages, (request.get("options") or {}).get("num_predict"))
+        started = time.monotonic()
+
+        def line(text: str, done: bool) -> dict:
+            data = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    **content(text), "done": done}
+            if done:
+                data.update(done_reason="stop", total_duration=int((time.monotonic() - started) * 1e9),
+                            prompt_eval_count=self._usage(messages, tokens)["prompt_tokens"], eval_count=len(tokens))
+            return data
+
+        # Ollama streams unless asked not to
+        if request.get("stream", True) is False:
+            self._send_json(line("".join(self.mock.timed(tokens)), True))
+            return
+        self.mock.count(streamed=1)
+        self._start_stream("application/x-ndjson")
+        for token in self.mock.timed(tokens):
+            self._write_chunk((json.dumps(line(token, False)) + "\n").encode())
+        self._write_chunk((json.dumps(line("", True)) + "\n").encode())
+        self._end_stream()
+
+    def _ollama_embed(self, request: dict) -> None:
+        texts = request.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        self._send_json({"model": request.get("model", ""), "embeddings": self.mock.embed(texts)})
+
+    def _ollama_embeddings(self, request: dict) -> None:
+        self._send_json({"embedding": self.mock.embed([request.get("prompt", "")])[0]})
+
+    @staticmethod
+    def _usage(messages: list, tokens: List[str]) -> dict:
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in messages)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens)}
+
+    def _send_json(self, data: dict, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of `ServerConfig` to a command line parser."""
+    defaults = ServerConfig()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--answer-tokens", type=int, default=defaults.answer_tokens)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="Share of failed requests")
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--max-concurrency", type=int, default=defaults.max_concurrency,
+                        help="Requests served at once, 0 for no limit")
+    parser.add_argument("--queue-timeout", type=float, default=defaults.queue_timeout,
+                        help="Seconds a request waits for a slot before it is rejected with 429")
+    parser.add_argument("--embedding-dim", type=int, default=defaults.embedding_dim)
+    parser.add_argument("--embed-latency", type=float, default=defaults.embed_latency, help="Seconds per text")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_arguments(args: argparse.Namespace) -> ServerConfig:
+    return ServerConfig(ttft=args.ttft, tokens_per_second=args.tokens_per_second, answer_tokens=args.answer_tokens,
+                        error_rate=args.error_rate, error_status=args.error_status,
+                        max_concurrency=args.max_concurrency, queue_timeout=args.queue_timeout,
+                        embedding_dim=args.embedding_dim, embed_latency=args.embed_latency, seed=args.seed)
+
+
+def client_environment(url: str) -> List[Tuple[str, str]]:
+    """Environment variables pointing the OpenAI and Ollama clients at a server."""
+    return [("OPENAI_BASE_URL", f"{url}/v1"), ("OPENAI_API_KEY", os.getenv("OPENAI_API_KEY", "mock")),
+            ("OLLAMA_HOST", url)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockModelServer(config_from_arguments(args), args.host, args.port)
+    print(f"Mock model server on {server.url}. Point the apps at it with:")
+    for name, value in client_environment(server.url):
+        print(f"  export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(asdict(server.stats)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Import time and cold start of the workflow and the two GUIs.
+
+Every measurement runs in a fresh interpreter, so module caches do not carry
+over between runs. Databases go to a temporary directory. The Flet app builds
+its first view on a stand-in page, which keeps the controls instead of sending
+them to a client, and GUIs whose packages are not installed are skipped.
+
+    python benchmarks/startup.py --repeat 5 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: 1x1 transparent PNG, the logo passed to the Gradio interface
+LOGO = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+
+# Each scenario prints a JSON object of timings in seconds as its last line
+SCENARIOS = {
+    "import aiwrite.workflow": """
+        started = time.perf_counter()
+        import aiwrite.workflow
+        timings["import"] = time.perf_counter() - started
+    """,
+    "Workflow()": """
+        started = time.perf_counter()
+        from aiwrite.workflow import Workflow
+        timings["import"] = time.perf_counter() - started
+        started = time.perf_counter()
+        workflow = Workflow(dburl=DBURL, model="llama3.2", db_path="data")
+        timings["construct"] = time.perf_counter() - started
+        started = time.perf_counter()
+        workflow.get_man_list()
+        timings["first query"] = time.perf_counter() - started
+        started = time.perf_counter()
+        workflow.libby
+        timings["model client"] = time.perf_counter() - started
+    """,
+    "gradio create_interface": """
+        started = time.perf_counter()
+        from aiwrite.gradgui.app import create_interface
+        timings["import"] = time.perf_counter() - started
+        started = time.perf_counter()
+        create_interface("data", DBURL, LOGO)
+        timings["create_interface"] = time.perf_counter() - started
+    """,
+    "flet main": """
+        import types
+        started = time.perf_counter()
+        import main
+        timings["import"] = time.perf_counter() - started
+
+        class Storage(dict):
+            def set(self, key, value):
+                self[key] = value
+
+            def contains_key(self, key):
+                return key in self
+
+        class Page(types.SimpleNamespace):
+            def update(self, *controls):
+                pass
+
+            def go(self, route):
+                self.route = route
+                self.on_route_change(route)
+                timings.setdefault("first paint", time.perf_counter() - started)
+
+        page = Page(client_storage=Storage(), overlay=[], views=[], route="/")
+        started = time.perf_counter()
+        main.main(page)
+        timings["main"] = time.perf_counter() - started
+    """,
+}
+
+#: Packages a scenario needs besides the workflow's own
+REQUIRES = {"gradio create_interface": "gradio", "flet main": "flet"}
+
+
+def run_scenario(body: str, workdir: str) -> dict:
+    """Run a scenario in a fresh interpreter and return its timings."""
+    script = "import json, time\n" + f"DBURL = {f'sqlite:///{workdir}/data/aiwrite.db'!r}\nLOGO = {LOGO!r}\n" \
+             + "timings = {}\n" + textwrap.dedent(body) + "print(json.dumps(timings))\n"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.getenv("PYTHONPATH")])))
+    output = subprocess.run([sys.executable, "-c", script], cwd=workdir, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, count: int) -> list:
+    """Modules with the largest cumulative import time, from ``python -X importtime``."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.getenv("PYTHONPATH")])))
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=env,
+                            capture_output=True, text=True, check=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append({"module": name.strip(), "cumulative_ms": int(cumulative) / 1000})
+    # Only top level packages, their submodules are part of the cumulative time
+    top = {}
+    for entry in imports:
+        package = entry["module"].split(".")[0]
+        if entry["cumulative_ms"] > top.get(package, {}).get("cumulative_ms", -1):
+            top[package] = entry
+    return sorted(top.values(), key=lambda entry: entry["cumulative_ms"], reverse=True)[:count]
+
+
+def installed(package: str) -> bool:
+    return subprocess.run([sys.executable, "-c", f"import {package}"], capture_output=True).returncode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per scenario, the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = {"scenarios": {}, "slowest_imports": slowest_imports("aiwrite.workflow", args.top)}
+    for name, body in SCENARIOS.items():
+        if name in REQUIRES and not installed(REQUIRES[name]):
+            print(f"{name}: skipped, {REQUIRES[name]} is not installed")
+            continue
+        runs = []
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as workdir:
+                runs.append(run_scenario(body, workdir))
+        medians = {step: statistics.median(run[step] for run in runs) for step in runs[0]}
+        results["scenarios"][name] = {f"{step}_ms": seconds * 1000 for step, seconds in medians.items()}
+        print(f"{name}: " + ", ".join(f"{step} {seconds * 1000:.0f} ms" for step, seconds in medians.items()))
+    print("Slowest imports of aiwrite.workflow:")
+    for entry in results["slowest_imports"]:
+        print(f"  {entry['module']:<30} {entry['cumulative_ms']:8.1f} ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
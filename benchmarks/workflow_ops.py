@@ -0,0 +1,161 @@
+"""Latency of workflow operations with fake model and knowledge base clients.
+
+The libbydbot clients are replaced by the deterministic stand-ins of
+`tests.fakes`, so runs are offline and repeatable, and the model latency is set on
+the command line. Manuscript operations run on manuscripts of each size in
+``--sections``, and document embedding and retrieval on collections of each
+size in ``--pages``. Results are tagged with the git commit, so runs of
+different versions can be compared.
+
+    python benchmarks/workflow_ops.py --sections 5 20 80 --pages 10 100 --json workflow.json
+    python benchmarks/workflow_ops.py --first-token 0.3 --per-token 0.02 --answer-words 100
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+import fitz
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiwrite.workflow import Project, Workflow, parse_manuscript_text  # noqa: E402
+from tests.fakes import Latency, fake_text, installed  # noqa: E402
+
+
+def percentiles(seconds: list) -> dict:
+    return {"p50_ms": float(np.percentile(seconds, 50) * 1000), "p95_ms": float(np.percentile(seconds, 95) * 1000)}
+
+
+def timed(operation: Callable[[int], object], repeat: int) -> dict:
+    """Time ``repeat`` calls of an operation, which gets the number of the call."""
+    seconds = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        operation(i)
+        seconds.append(time.perf_counter() - started)
+    return {"runs": repeat, **percentiles(seconds)}
+
+
+def manuscript_text(sections: int, words: int = 300) -> str:
+    """Markdown manuscript with a title, an abstract and numbered sections."""
+    parts = ["# Benchmark Manuscript", "## Abstract\n" + " ".join(fake_text("abstract", 150))]
+    parts += [f"## Section {i}\n" + " ".join(fake_text(f"section {i}", words)) for i in range(sections)]
+    return "\n\n".join(parts)
+
+
+def make_pdf(path: str, pages: int) -> str:
+    with fitz.open() as doc:
+        for number in range(pages):
+            page = doc.new_page()
+            page.insert_textbox(page.rect + (72, 72, -72, -72), " ".join(fake_text(f"page {number}", 250)))
+        doc.save(path)
+    return path
+
+
+def open_workflow(workdir: str) -> Workflow:
+    # Workflow strips the leading slash of db_path
+    return Workflow(dburl=f"sqlite:///{workdir}/aiwrite.db", model="fake-model", db_path=os.path.relpath(workdir),
+                    collection_name="benchmark", embedding_model="fake-embedding", response_cache="off")
+
+
+def close_workflow(workflow: Workflow) -> None:
+    workflow.section_summaries.shutdown()
+    workflow.engine.dispose()
+
+
+def manuscript_operations(sections: int, repeat: int) -> List[dict]:
+    text = manuscript_text(sections)
+    results = []
+
+    def record(operation: str, timings: dict) -> None:
+        results.append({"operation": operation, "sections": sections, "tokens": len(text) // 4, **timings})
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workflow = open_workflow(workdir)
+        try:
+            for i in range(10):
+                workflow.save_project(Project(name=f"Project {i}", documents_folder=workdir, language="en",
+                                              model="fake-model"))
+            record("parse_manuscript_text", timed(lambda i: parse_manuscript_text(text), repeat))
+            record("setup_manuscript", timed(lambda i: workflow.setup_manuscript(f"concept {i}"), repeat))
+            manuscript_id = workflow.setup_manuscript("benchmark").id
+            workflow.update_from_text(manuscript_id, text)
+            # Every call changes the text, unchanged texts are not saved
+            record("update_from_text",
+                   timed(lambda i: workflow.update_from_text(manuscript_id, f"{text}\n\nEdit {i}."), repeat))
+            record("add_section", timed(lambda i: workflow.add_section(manuscript_id, f"appendix {i}"), repeat))
+            record("enhance_section", timed(lambda i: workflow.enhance_section(manuscript_id, "Section 1"), repeat))
+            record("get_manuscript_sections", timed(lambda i: workflow.get_manuscript_sections(manuscript_id), repeat))
+            record("get_man_list", timed(lambda i: workflow.get_man_list(), repeat))
+            record("get_projects", timed(lambda i: workflow.get_projects(), repeat))
+        finally:
+            close_workflow(workflow)
+    return results
+
+
+def collection_operations(pages: int, repeat: int) -> List[dict]:
+    results = []
+
+    def record(operation: str, timings: dict) -> None:
+        results.append({"operation": operation, "pages": pages, **timings})
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workflow = open_workflow(workdir)
+        try:
+            documents = [make_pdf(os.path.join(workdir, f"doc{i}.pdf"), pages) for i in range(repeat)]
+            record("embed_document", timed(lambda i: workflow.embed_document(documents[i]), repeat))
+            # Unchanged documents are skipped by the ingest ledger
+            record("embed_document unchanged", timed(lambda i: workflow.embed_document(documents[i]), repeat))
+            record("retrieve_docs", timed(lambda i: workflow.retrieve_docs(f"signal estimate {i}"), repeat))
+            record("get_embedded_documents", timed(lambda i: workflow.KB.get_embedded_documents(), repeat))
+        finally:
+            close_workflow(workflow)
+    return results
+
+
+def git_commit() -> str:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, nargs="+", default=[5, 20, 80], help="Manuscript sizes")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100], help="Pages per embedded document")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--first-token", type=float, default=0.0, help="Model delay before the first word (s)")
+    parser.add_argument("--per-token", type=float, default=0.0, help="Model delay between words (s)")
+    parser.add_argument("--answer-words", type=int, default=200)
+    parser.add_argument("--embed", type=float, default=0.0, help="Knowledge base delay per embedded text (s)")
+    parser.add_argument("--retrieve", type=float, default=0.0, help="Knowledge base delay per search (s)")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    latency = Latency(first_token=args.first_token, per_token=args.per_token, answer_words=args.answer_words,
+                      embed=args.embed, retrieve=args.retrieve)
+    results = []
+    with installed(latency):
+        for sections in args.sections:
+            results += manuscript_operations(sections, args.repeat)
+        for pages in args.pages:
+            results += collection_operations(pages, args.repeat)
+    for result in results:
+        size = f"{result['sections']} sections" if "sections" in result else f"{result['pages']} pages"
+        print(f"{result['operation']:<26} {size:>12}: {result['p50_ms']:9.2f} ms p50, {result['p95_ms']:9.2f} ms p95")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"commit": git_commit(), "latency": vars(latency), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
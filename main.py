@@ -1,12 +1,30 @@
+import atexit
+import os
+import threading
+import time
+import weakref
 from typing import List, Any
 
 import dotenv
 import flet as ft
 
+from aiwrite.autosave import AutosaveWriter
 from aiwrite.workflow import Workflow, parse_manuscript_text, Project
 
 dotenv.load_dotenv()
 
+#: Model selector of the settings page, built with the page
+model_dropdown = None
+#: Autosave writers of the open sessions, each closed when its session disconnects
+AUTOSAVE_WRITERS: "weakref.WeakSet[AutosaveWriter]" = weakref.WeakSet()
+
+
+@atexit.register
+def close_autosave_writers() -> None:
+    """Write the pending edits of sessions still open when the server exits."""
+    for writer in list(AUTOSAVE_WRITERS):
+        writer.close()
+
 
 def build_appbar(page: ft.Page) -> ft.AppBar:
     """
@@ -24,6 +42,11 @@ def build_appbar(page: ft.Page) -> ft.AppBar:
         page.file_picker.save_file(dialog_title="Save manscript as", file_name="manuscript.md",
                                    file_type=ft.FilePickerFileType.ANY)
 
+    def exit_app(e):
+        page.autosave.close()
+        page.WKF.ingestion_queue.shutdown()
+        page.window.destroy()
+
     # def change_model(e):
     #     page.client_storage.set("model", e.control.value.lower())
     #     page.WKF.set_model(e.control.value.lower())
@@ -38,8 +61,7 @@ def build_appbar(page: ft.Page) -> ft.AppBar:
         toolbar_height=80,
         actions=[
             ft.IconButton(ft.Icons.SAVE, tooltip="Export Manuscript", on_click=save_file),
-            ft.IconButton(ft.Icons.EXIT_TO_APP, tooltip="Exit Ai Write",
-                          on_click=lambda e: page.window.destroy()),
+            ft.IconButton(ft.Icons.EXIT_TO_APP, tooltip="Exit Ai Write", on_click=exit_app),
         ],
     )
     return appbar
@@ -103,13 +125,15 @@ def build_manuscript_card(page: ft.Page) -> ft.Card:
             # Show progress ring
             generate_progress.visible = True
             page.update()
+            page.autosave.flush()
             
-            # Generate section
-            man = page.WKF.add_section(page.client_storage.get("manid"), section_name.value.lower())
+            # Generate section, showing the text as it arrives
+            for text in page.WKF.add_section_stream(page.client_storage.get("manid"), section_name.value.lower()):
+                page.text_field.value = text
+                page.md.value = text
+                page.update()
             
             # Update UI
-            page.text_field.value = page.WKF.get_manuscript_text(page.client_storage.get("manid"))
-            page.md.value = page.text_field.value
             generate_progress.visible = False
             update_section_dropdown(page)
             page.update()
@@ -130,17 +154,57 @@ def build_manuscript_card(page: ft.Page) -> ft.Card:
         page.open(dialog)
         page.update()
 
+    def add_outline(e):
+        def handle_dialog(e):
+            names = [name.strip() for name in outline.value.split(",") if name.strip()]
+            if not names:
+                return
+            page.dialog.open = False
+            # Show progress ring
+            generate_progress.visible = True
+            page.update()
+            page.autosave.flush()
+
+            # Generate all sections concurrently
+            man = page.WKF.add_sections(page.client_storage.get("manid"), names)
+
+            # Update UI
+            page.text_field.value = man.source if man else page.text_field.value
+            page.md.value = page.text_field.value
+            generate_progress.visible = False
+            update_section_dropdown(page)
+            page.update()
+
+        outline = ft.TextField(label="Sections (comma-separated)", autofocus=True,
+                               hint_text="introduction, methods, results, discussion")
+        dialog = ft.AlertDialog(
+            title=ft.Text("Generate Sections from Outline"),
+            modal=True,
+            content=outline,
+            actions=[
+                ft.TextButton("Generate", on_click=handle_dialog),
+                ft.TextButton("Cancel", on_click=lambda e: setattr(page.dialog, "open", False))
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        page.dialog = dialog
+        page.open(dialog)
+        page.update()
+
     def enhance_text(e):
         # Show progress ring
         enhance_progress.visible = True
         page.update()
+        page.autosave.flush()
         
-        # Enhance section
-        man = page.WKF.enhance_section(page.client_storage.get("manid"), page.client_storage.get("section"))
+        # Enhance section, showing the text as it arrives
+        for text in page.WKF.enhance_section_stream(page.client_storage.get("manid"),
+                                                    page.client_storage.get("section")):
+            page.text_field.value = text
+            page.md.value = text
+            page.update()
         
         # Update UI
-        page.text_field.value = page.WKF.get_manuscript_text(page.client_storage.get("manid"))
-        page.md.value = page.text_field.value
         enhance_progress.visible = False
         update_section_dropdown(page)
         page.update()
@@ -164,6 +228,8 @@ def build_manuscript_card(page: ft.Page) -> ft.Card:
                             ft.Row([
                                 ft.ElevatedButton("Generate", on_click=add_section,
                                                   tooltip=f"Generate a new section"),
+                                ft.ElevatedButton("Outline", on_click=add_outline,
+                                                  tooltip=f"Generate several sections at once"),
                                 generate_progress
                             ], spacing=10),
                             ft.Row([
@@ -237,6 +303,8 @@ def build_manuscript_review_card(page: ft.Page) -> ft.Card:
     
     # Create a column to hold all section review controls
     review_controls = ft.Column(scroll=ft.ScrollMode.AUTO)
+    # Review result and progress ring of each section, filled by "Review All"
+    review_panels = {}
     
     # Create a review panel for each section
     for section_name, section_content in sections.items():
@@ -264,21 +332,24 @@ def build_manuscript_review_card(page: ft.Page) -> ft.Card:
             stroke_width=2,
             visible=False
         )
+        review_panels[section_name] = (review_result, review_progress)
 
         def create_review_handler(section_name, review_result, progress):
             def on_criticize(e):
                 # Show progress ring
                 progress.visible = True
                 page.update()
+                page.autosave.flush()
                 
-                # Get critique
-                critic = page.WKF.criticize_section(
+                # Get critique, showing it as it arrives
+                for critic in page.WKF.criticize_section_stream(
                     page.client_storage.get("manid"), 
                     section_name
-                )
+                ):
+                    review_result.value = critic
+                    page.update()
                 
                 # Update UI
-                review_result.value = critic
                 progress.visible = False
                 page.update()
             return on_criticize
@@ -312,10 +383,51 @@ def build_manuscript_review_card(page: ft.Page) -> ft.Card:
             )
         )
 
+    review_status = ft.Text("")
+
+    def review_all(e):
+        # The title is not a section of its own
+        names = [name for name in review_panels if name != "title"]
+        review_button.disabled = True
+        review_status.value = ""
+        for name in names:
+            review_panels[name][1].visible = True
+        page.update()
+        try:
+            page.autosave.flush()
+            # Critique all sections concurrently, filling each card as its result arrives
+            for section_name, critic in page.WKF.criticize_sections(
+                page.client_storage.get("manid"),
+                names,
+                max_workers=int(os.getenv("REVIEW_CONCURRENCY", "4"))
+            ):
+                review_result, progress = review_panels[section_name]
+                review_result.value = critic
+                progress.visible = False
+                page.update()
+        except Exception as exc:
+            review_status.value = f"Review failed: {exc}"
+        finally:
+            for name in names:
+                review_panels[name][1].visible = False
+            review_button.disabled = False
+            page.update()
+
+    review_button = ft.ElevatedButton(
+        "Review All",
+        icon=ft.Icons.COFFEE,
+        on_click=review_all,
+        tooltip="Review all sections in parallel"
+    )
+
     return ft.Card(
         content=ft.Container(
             content=ft.Column([
-                ft.Text("Manuscript Review", size=20, weight=ft.FontWeight.BOLD),
+                ft.Row([
+                    ft.Text("Manuscript Review", size=20, weight=ft.FontWeight.BOLD),
+                    review_button,
+                    review_status,
+                ]),
                 review_controls
             ]),
             padding=20
@@ -342,7 +454,7 @@ def build_markdown_editor(page: ft.Page) -> ft.Row:
         # print('text changed')
         page.md.value = page.text_field.value
         if page.text_field.value:
-            page.WKF.update_from_text(page.client_storage.get("manid"), page.text_field.value)
+            page.autosave.submit(page.client_storage.get("manid"), page.text_field.value)
         page.update()
 
     page.text_field = ft.TextField(
@@ -538,6 +650,31 @@ def build_settings_page(page: ft.Page) -> ft.Container:
     folder_picker = ft.FilePicker(on_result=handle_folder_pick)
     page.overlay.append(folder_picker)
 
+    scan_status = ft.Text("", size=12, italic=True)
+
+    def show_scan_report(report) -> None:
+        scan_status.value = f"Last scan: {report}"
+        page.update()
+
+    def rescan_folder(e):
+        if not documents_folder.value:
+            return
+        scan_status.value = "Scanning..."
+        page.update()
+        try:
+            show_scan_report(page.WKF.rescan_folder(documents_folder.value))
+        except Exception as exc:
+            scan_status.value = f"Scan failed: {exc}"
+            page.update()
+
+    def toggle_watch(e):
+        if e.control.value and documents_folder.value:
+            page.WKF.watch_folder(documents_folder.value,
+                                  interval=float(os.getenv("FOLDER_SCAN_INTERVAL", "30")),
+                                  on_change=show_scan_report)
+        else:
+            page.WKF.stop_watching_folder()
+
     documents_folder = ft.TextField(
         label="Documents Folder",
         value=page.WKF.current_project.documents_folder if page.WKF.current_project else "",
@@ -556,11 +693,12 @@ def build_settings_page(page: ft.Page) -> ft.Container:
         on_change=lambda e: update_project_field(page, "language", e.control.value)
     )
 
-    # Model selector
+    # Model selector, offering only the selected model until the models are listed, see load_available_models
+    model = page.WKF.current_project.model if page.WKF.current_project else "llama3.2"
     model_dropdown = ft.Dropdown(
         label="LLM Model",
-        value=page.WKF.current_project.model if page.WKF.current_project else "llama3.2",
-        options=[ft.DropdownOption(text=m, key=m) for m in page.WKF.libby.llm.available_models],
+        value=model,
+        options=[ft.DropdownOption(text=m, key=m) for m in page.available_models or [model]],
         on_change=lambda e: update_project_field(page, "model", e.control.value)
     )
 
@@ -603,10 +741,13 @@ def build_settings_page(page: ft.Page) -> ft.Container:
                 ft.ElevatedButton(
                     "Re-scan Folder",
                     icon=ft.Icons.REFRESH,
-                    on_click=lambda _: page.WKF.KB.embed_path(documents_folder.value) if documents_folder.value else None,
-                    tooltip="Re-scan and re-embed documents in the selected folder"
-                )
+                    on_click=rescan_folder,
+                    tooltip="Embed new and modified documents in the selected folder and drop deleted ones"
+                ),
+                ft.Switch(label="Watch", value=False, on_change=toggle_watch,
+                          tooltip="Keep re-scanning the folder in the background")
             ]),
+            scan_status,
             language_dropdown,
             model_dropdown,
             ft.Text("Base Prompt Configuration", size=16, weight=ft.FontWeight.BOLD),
@@ -616,6 +757,21 @@ def build_settings_page(page: ft.Page) -> ft.Container:
     )
 
 
+def load_available_models(page: ft.Page) -> None:
+    """
+    List the models of the AI client and offer them in the model selector.
+
+    Listing the models builds the model client, so this runs after the first page is drawn.
+
+    Args:
+        page: The Flet page object
+    """
+    page.available_models = page.WKF.libby.llm.available_models
+    if model_dropdown is not None:
+        model_dropdown.options = [ft.DropdownOption(text=m, key=m) for m in page.available_models]
+        page.update()
+
+
 def update_project_fields(page: ft.Page, project_id: str) -> None:
     """
     Load a project's settings and update all related fields in the UI.
@@ -681,14 +837,13 @@ def update_project_fields(page: ft.Page, project_id: str) -> None:
 
 def update_base_prompt(page: ft.Page, new_prompt: str) -> None:
     """
-    Update the base prompt in the workflow and set it in the LLM context.
+    Update the base prompt in the workflow, the start of every model context.
     
     Args:
         page: The Flet page object
         new_prompt: The new base prompt value
     """
     page.WKF.base_prompt = new_prompt
-    page.WKF.libby.set_context(new_prompt)
 
 def update_project_field(page: ft.Page, field: str, value: Any) -> None:
     """
@@ -725,27 +880,70 @@ def build_knowledge_page(page: ft.Page) -> ft.Container:
     # List to store uploaded files
     uploaded_files = []
     files_column = ft.Column(scroll=ft.ScrollMode.AUTO)
+    # Upload tiles by ingestion job ID, refreshed by a watcher thread while jobs are active
+    job_tiles = {}
+    job_watcher = {"running": False}
+    job_watcher_lock = threading.Lock()
 
     def handle_upload_result(e: ft.FilePickerResultEvent):
         if e.files:
             for f in e.files:
                 # Create a list tile for each uploaded file
+                job = page.WKF.queue_document(f.path)
+                progress_bar = ft.ProgressBar(value=0, width=300)
                 file_tile = ft.ListTile(
                     leading=ft.Icon(ft.Icons.PICTURE_AS_PDF),
                     title=ft.Text(f.name),
+                    subtitle=ft.Column([progress_bar, ft.Text("Queued", size=12)], tight=True),
                     trailing=ft.IconButton(
                         ft.Icons.DELETE_OUTLINE,
                         icon_color="red",
                         data=f.name,
-                        on_click=lambda e: remove_file(e, e.control.data)
+                        tooltip="Cancel and remove",
+                        on_click=lambda e, job_id=job.id: remove_file(e, e.control.data, job_id)
                     ),
                 )
+                job_tiles[job.id] = file_tile
                 files_column.controls.append(file_tile)
-                page.WKF.embed_document(f.path)
                 uploaded_files.append(f.name)
-                page.update()
+            page.update()
+            start_job_watcher()
 
-    def remove_file(e, filename):
+    def start_job_watcher():
+        with job_watcher_lock:
+            if job_watcher["running"]:
+                return
+            job_watcher["running"] = True
+        threading.Thread(target=watch_jobs, name="aiwrite-job-watcher", daemon=True).start()
+
+    def watch_jobs():
+        """Refresh the progress of the upload tiles until their jobs have ended."""
+        while True:
+            jobs = {job.id: job for job in page.WKF.ingestion_queue.get_jobs()}
+            for job_id, tile in list(job_tiles.items()):
+                job = jobs.get(job_id)
+                if job is None:
+                    continue
+                progress_bar, status = tile.subtitle.controls
+                if job.pages_total:
+                    progress_bar.value = job.pages_done / job.pages_total
+                eta = job.eta_seconds
+                status.value = job.message or (f"{job.status}: {job.pages_done}/{job.pages_total} pages"
+                                               + (f", {eta:.0f}s left" if eta is not None else ""))
+                if not job.active:
+                    progress_bar.value = 1 if job.status == "done" else progress_bar.value
+                    del job_tiles[job_id]
+            page.update()
+            with job_watcher_lock:
+                if not job_tiles:
+                    job_watcher["running"] = False
+                    return
+            time.sleep(1)
+
+    def remove_file(e, filename, job_id=None):
+        if job_id is not None:
+            page.WKF.ingestion_queue.cancel(job_id)
+            job_tiles.pop(job_id, None)
         # Find and remove the list tile for this file
         for control in files_column.controls[:]:
             if control.title.value == filename:
@@ -800,6 +998,10 @@ def main(page: ft.Page) -> None:
     page.client_storage.set("language", "en")
     page.client_storage.set("project_name", "My Manuscript Project")
     page.WKF = Workflow(model=page.client_storage.get("model"))
+    page.autosave = AutosaveWriter(page.WKF.update_from_text,
+                                   idle_seconds=float(os.getenv("AUTOSAVE_IDLE_SECONDS", "1.5")))
+    AUTOSAVE_WRITERS.add(page.autosave)
+    page.on_disconnect = lambda e: page.autosave.close()
     # Load most recent project on startup
     most_recent_project_id = page.WKF.get_most_recent_project()
     page.client_storage.set('project_id', most_recent_project_id)
@@ -809,6 +1011,7 @@ def main(page: ft.Page) -> None:
         page.client_storage.set("manid", manid)
         if manid:
             page.WKF.set_knowledge_base(collection_name=f"man_{most_recent_project_id}")
+    page.available_models = []
     page.appbar = build_appbar(page)
     nav_bar = build_navigation_bar(page)
     page.theme = ft.Theme(color_scheme_seed="green")
@@ -824,6 +1027,7 @@ def main(page: ft.Page) -> None:
 
     def route_change(route):
         # print(route)
+        page.autosave.flush()
         page.views.clear()
         page.views.append(
             ft.View(
@@ -898,11 +1102,15 @@ def main(page: ft.Page) -> None:
             # prog = ft.ProgressRing(), ft.Text("This may take a while...")
             page.add(ft.ProgressRing(), ft.Text("Generating the text..."))
             # page.update()
+            page.autosave.flush()
             page.client_storage.set("context", page.context.value)
             page.WKF.set_model(page.client_storage.get("model"))
 
-            man = page.WKF.setup_manuscript(page.context.value)
-            editor.value = man.source
+            for text in page.WKF.setup_manuscript_stream(page.context.value):
+                page.text_field.value = text
+                page.md.value = text
+                page.update()
+            page.client_storage.set("manid", page.WKF.manuscript.id)
             page.text_field.on_change(None)
             page.write_button.disabled = True
             page.update()
@@ -926,6 +1134,9 @@ def main(page: ft.Page) -> None:
     page.on_view_pop = view_pop
     page.route = "/projects"
     page.go(page.route)
+    # Resume ingestion jobs interrupted by the last shutdown and list the models once the page is drawn
+    page.WKF.resume_ingestion()
+    load_available_models(page)
 
 
 def run() -> None:
@@ -0,0 +1,167 @@
+"""Deterministic stand-ins for the libbydbot model client and knowledge base.
+
+They answer offline, with the same output for the same input, after a
+configurable delay, so the workflow can be measured without a model server.
+`installed` plugs them into the workflow's client pools:
+
+    with installed(Latency(first_token=0.2, per_token=0.01)):
+        workflow = Workflow(...)
+"""
+import hashlib
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Tuple, Union
+
+import numpy as np
+from sqlalchemy import Column, Integer, MetaData, String, Table, Text, create_engine, insert, select
+
+from aiwrite import workflow as workflow_module
+from aiwrite.embeddings import Embedder
+from aiwrite.pool import InstancePool
+
+#: Table of DocEmbedder's database holding the embedded texts, without the vectors
+EMBEDDING = Table("embedding", MetaData(), Column("id", Integer, primary_key=True), Column("doc_name", String),
+                  Column("page_number", Integer), Column("document", Text), Column("collection_name", String))
+#: Serializes the creation of the table, as ingestion workers build knowledge bases on one database concurrently
+_CREATE_LOCK = threading.Lock()
+
+WORDS = ("model", "network", "data", "method", "result", "analysis", "sample", "effect", "signal", "rate",
+         "system", "estimate", "measure", "error", "test", "value", "process", "study", "field", "structure")
+
+
+@dataclass
+class Latency:
+    """Delays of the stand-ins, in seconds.
+
+    Attributes:
+        first_token: Delay before the first word of an answer
+        per_token: Delay between words of an answer
+        answer_words: Number of words of each answer
+        embed: Delay of each embedded text
+        retrieve: Delay of each knowledge base search
+    """
+    first_token: float = 0.0
+    per_token: float = 0.0
+    answer_words: int = 200
+    embed: float = 0.0
+    retrieve: float = 0.0
+
+
+def fake_text(seed: str, words: int) -> List[str]:
+    """Words of a deterministic pseudo-text, in sentences, derived from a seed."""
+    digest = hashlib.blake2b(seed.encode()).digest()
+    text = []
+    for i in range(words):
+        word = WORDS[(digest[i % len(digest)] + i * 7) % len(WORDS)]
+        text.append((word.capitalize() if i % 12 == 0 else word) + ("." if i % 12 == 11 else ""))
+    return text
+
+
+class _FakeLLM:
+    available_models = ["fake-model", "llama3.2", "gpt-4o"]
+
+
+class FakeLibbyDBot:
+    """Model client answering with pseudo-text derived from the model, context and question."""
+
+    def __init__(self, model: str = "fake-model", latency: Latency = Latency()):
+        self.model = model
+        self.latency = latency
+        self.context = ""
+        self.llm = _FakeLLM()
+        self.calls = 0
+
+    def set_context(self, context: str) -> None:
+        self.context = context
+
+    def ask(self, question: str, stream: bool = False) -> Union[str, Iterator[str]]:
+        self.calls += 1
+        words = fake_text(f"{self.model}\0{self.context}\0{question}", self.latency.answer_words)
+        if stream:
+            return self._stream(words)
+        time.sleep(self.latency.first_token + self.latency.per_token * len(words))
+        return " ".join(words)
+
+    def _stream(self, words: List[str]) -> Iterator[str]:
+        time.sleep(self.latency.first_token)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.latency.per_token)
+            yield word if i == 0 else " " + word
+
+
+class FakeDocEmbedder:
+    """Knowledge base ranking texts by shared words.
+
+    Like DocEmbedder, it keeps one row per embedded text in the ``embedding``
+    table of its database, by document, page and collection, so instances
+    with the same database URL share their texts.
+    """
+
+    def __init__(self, col_name: str, dburl: str = "sqlite://", embedding_model: str = "fake-embedding",
+                 latency: Latency = Latency()):
+        self.collection_name = col_name
+        self.embedding_model = embedding_model
+        self.latency = latency
+        self.engine = create_engine(dburl)
+        with _CREATE_LOCK:
+            EMBEDDING.create(self.engine, checkfirst=True)
+
+    @property
+    def docs(self) -> List[Tuple[str, int, str]]:
+        """Document name, page number and text of the rows of the collection."""
+        with self.engine.connect() as connection:
+            return [tuple(row) for row in connection.execute(
+                select(EMBEDDING.c.doc_name, EMBEDDING.c.page_number, EMBEDDING.c.document)
+                .where(EMBEDDING.c.collection_name == self.collection_name).order_by(EMBEDDING.c.id))]
+
+    def embed_text(self, text: str, doc_name: str, page_number: int) -> None:
+        time.sleep(self.latency.embed)
+        with self.engine.begin() as connection:
+            connection.execute(insert(EMBEDDING).values(doc_name=doc_name, page_number=page_number, document=text,
+                                                        collection_name=self.collection_name))
+
+    def retrieve_docs(self, query: str, num_docs: int = 5, **kwargs) -> str:
+        time.sleep(self.latency.retrieve)
+        terms = set(re.findall(r"\w+", query.lower()))
+        ranked = sorted(self.docs, key=lambda doc: -len(terms & set(re.findall(r"\w+", doc[2].lower()))))
+        return "\n\n".join(f"{name}, page {page}: {text}" for name, page, text in ranked[:num_docs])
+
+    def get_embedded_documents(self) -> List[Tuple[str, str]]:
+        return sorted({(name, self.collection_name) for name, _, _ in self.docs})
+
+
+class CountingEmbedder(Embedder):
+    """Embedder recording the texts it embeds, whose vectors are the text length and position in the call."""
+    model = "test-model"
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded.extend(texts)
+        return np.array([[len(text), i] for i, text in enumerate(texts)], dtype=np.float32)
+
+
+@contextmanager
+def installed(latency: Latency = Latency(),
+              bot: Callable[[str, Latency], FakeLibbyDBot] = FakeLibbyDBot) -> Iterator[None]:
+    """Make workflows use the stand-ins instead of libbydbot clients within a ``with`` block.
+
+    Args:
+        latency: Delays of the stand-ins
+        bot: Builds the model clients from the model name and the delays, e.g. a `FakeLibbyDBot` subclass
+    """
+    pools = workflow_module.LLM_POOL, workflow_module.KB_POOL
+    workflow_module.LLM_POOL = InstancePool(lambda model: bot(model, latency), close=workflow_module.close_client)
+    workflow_module.KB_POOL = InstancePool(
+        lambda key: FakeDocEmbedder(col_name=key[0], dburl=key[1], embedding_model=key[2], latency=latency),
+        close=workflow_module.close_client)
+    try:
+        yield
+    finally:
+        workflow_module.KB_POOL.clear()
+        workflow_module.LLM_POOL, workflow_module.KB_POOL = pools
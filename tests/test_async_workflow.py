@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+from aiwrite.async_workflow import AsyncWorkflow, async_dburl
+from aiwrite.workflow import Workflow, Manuscript
+
+
+class TestAsyncDburl(unittest.TestCase):
+    def test_translates_known_schemes(self):
+        self.assertEqual(async_dburl("sqlite:///data/aiwrite.db"), "sqlite+aiosqlite:///data/aiwrite.db")
+        self.assertEqual(async_dburl("postgresql://u:p@db:5432/platform"), "postgresql+asyncpg://u:p@db:5432/platform")
+        self.assertEqual(async_dburl("sqlite+aiosqlite:///x.db"), "sqlite+aiosqlite:///x.db")
+
+    def test_rejects_unknown_scheme(self):
+        with self.assertRaises(ValueError):
+            async_dburl("mysql://localhost/db")
+
+
+class TestAsyncWorkflow(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        # Workflow strips the leading slash of db_path
+        self.workflow = Workflow(dburl=f"sqlite:///{tmpdir.name}/aiwrite.db", model='llama3.2',
+                                 db_path=os.path.relpath(tmpdir.name), response_cache="off")
+        self.addCleanup(lambda: self.workflow.engine.dispose())
+        self.aworkflow = AsyncWorkflow(self.workflow)
+        self.manuscript = self.workflow._save_manuscript(Manuscript.from_text("# Title\n\n## Abstract\nText"))
+
+    async def test_update_from_text(self):
+        text = "# Title\n\n## Abstract\nText\n\n## Introduction\nMore text"
+        await self.aworkflow.update_from_text(self.manuscript.id, text)
+        self.assertEqual(await self.aworkflow.get_manuscript_text(self.manuscript.id), text)
+        sections = await self.aworkflow.get_manuscript_sections(self.manuscript.id)
+        self.assertEqual(sections['introduction'], "More text")
+
+    async def asyncTearDown(self):
+        await self.aworkflow.delete_manuscript(self.manuscript.id)
+        self.assertIsNone(await self.aworkflow.get_manuscript(self.manuscript.id))
+        await self.aworkflow.close()
+
+
+class TestAsyncWorkflowFreshDatabase(unittest.IsolatedAsyncioTestCase):
+    async def test_creates_the_tables(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        workflow = Workflow(dburl=f"sqlite:///{tmpdir.name}/aiwrite.db", model='llama3.2',
+                            db_path=os.path.relpath(tmpdir.name), response_cache="off")
+        aworkflow = AsyncWorkflow(workflow)
+        self.assertEqual(await aworkflow.get_man_list(), [])
+        self.assertEqual(await aworkflow.get_projects(), [])
+        await aworkflow.close()
+        self.assertIsNone(workflow._engine)
+
+
+if __name__ == '__main__':
+    unittest.main()
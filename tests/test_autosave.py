@@ -0,0 +1,69 @@
+import time
+import unittest
+
+from aiwrite.autosave import AutosaveWriter
+
+
+class TestAutosaveWriter(unittest.TestCase):
+    def setUp(self):
+        self.writes = []
+        self.writer = AutosaveWriter(lambda manuscript_id, text: self.writes.append((manuscript_id, text)),
+                                     idle_seconds=0.05)
+
+    def test_coalesces_burst_of_edits(self):
+        for i in range(20):
+            self.writer.submit(1, f"# Title {i}")
+        time.sleep(0.3)
+        self.assertEqual(self.writes, [(1, "# Title 19")])
+        self.assertEqual(self.writer.saved_writes, 19)
+
+    def test_flush_writes_pending_edits(self):
+        self.writer.idle_seconds = 60
+        self.writer.submit(1, "one")
+        self.writer.submit(2, "two")
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(sorted(self.writes), [(1, "one"), (2, "two")])
+
+    def test_close_flushes(self):
+        self.writer.idle_seconds = 60
+        self.writer.submit(1, "text")
+        self.writer.close()
+        self.assertEqual(self.writes, [(1, "text")])
+        with self.assertRaises(RuntimeError):
+            self.writer.submit(1, "late")
+
+    def test_failed_writes_are_retried(self):
+        failures = [RuntimeError("database is locked")]
+
+        def save(manuscript_id, text):
+            if failures:
+                raise failures.pop()
+            self.writes.append((manuscript_id, text))
+
+        writer = AutosaveWriter(save, idle_seconds=60)
+        self.addCleanup(writer.close)
+        writer.submit(1, "text")
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(self.writes, [(1, "text")])
+
+    def test_failed_write_does_not_replace_newer_edit(self):
+        def save(manuscript_id, text):
+            if text == "older":
+                writer.submit(manuscript_id, "newer")
+                raise RuntimeError("database is locked")
+            self.writes.append((manuscript_id, text))
+
+        writer = AutosaveWriter(save, idle_seconds=60)
+        self.addCleanup(writer.close)
+        writer.submit(1, "older")
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(self.writes, [(1, "newer")])
+
+    def tearDown(self):
+        self.writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
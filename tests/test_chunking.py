@@ -0,0 +1,38 @@
+import unittest
+
+from aiwrite.chunking import ChunkingConfig, Page, chunk_pages, estimate_tokens
+
+
+class TestChunkPages(unittest.TestCase):
+    pages = [
+        Page(0, "Alpha beta gamma. Delta epsilon zeta eta. Theta iota.\n"),
+        Page(1, "Kappa."),
+        Page(2, "Lambda mu nu xi omicron pi rho sigma tau upsilon phi chi psi omega. End."),
+    ]
+
+    def test_chunks_respect_token_budget(self):
+        chunks = chunk_pages(self.pages, ChunkingConfig(chunk_tokens=8, overlap_tokens=3))
+        self.assertTrue(all(estimate_tokens(chunk.text) <= 8 for chunk in chunks))
+        self.assertEqual(chunks[0].text, "Alpha beta gamma.")
+
+    def test_overlap_and_page_spans(self):
+        chunks = chunk_pages(self.pages, ChunkingConfig(chunk_tokens=8, overlap_tokens=3))
+        spanning = [chunk for chunk in chunks if chunk.page_start != chunk.page_end]
+        self.assertEqual([chunk.text for chunk in spanning], ["Theta iota.\nKappa."])
+        # The short last sentence of a chunk is repeated at the start of the next one
+        self.assertTrue(chunks[1].text.endswith("Theta iota."))
+        self.assertTrue(spanning[0].text.startswith("Theta iota."))
+
+    def test_offsets_point_into_pages(self):
+        texts = {page.number: page.text for page in self.pages}
+        for chunk in chunk_pages(self.pages, ChunkingConfig(chunk_tokens=8, overlap_tokens=3)):
+            self.assertTrue(chunk.text.startswith(texts[chunk.page_start][chunk.start:chunk.start + 5]))
+            self.assertTrue(chunk.text.endswith(texts[chunk.page_end][chunk.end - 3:chunk.end]))
+
+    def test_whole_pages(self):
+        chunks = chunk_pages(self.pages, ChunkingConfig(chunk_tokens=0))
+        self.assertEqual([chunk.text for chunk in chunks], [page.text for page in self.pages])
+
+
+if __name__ == '__main__':
+    unittest.main()
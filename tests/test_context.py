@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+from aiwrite.chunking import estimate_tokens
+from aiwrite.context import ContextBuilder, PrefixTracker, common_prefix_length, lead_summary
+from aiwrite.workflow import Project, Workflow, split_manuscript_sections
+
+
+def section(name: str, words: str, sentences: int = 40) -> str:
+    return f"\n\n## {name}\n" + " ".join(f"The {words} result number {i} is described here." for i in range(sentences))
+
+
+MANUSCRIPT = ("# Graph neural networks\n\n## Abstract\nWe study graph neural networks."
+              + section("Introduction", "introductory")
+              + section("Methods", "message passing")
+              + section("Datasets", "citation graph")
+              + section("Results", "accuracy")
+              + section("Discussion", "message passing"))
+
+
+class TestContextBuilder(unittest.TestCase):
+    def setUp(self):
+        self.sections = split_manuscript_sections(MANUSCRIPT)
+
+    def test_small_manuscript_unchanged(self):
+        builder = ContextBuilder(budget=0)
+        text, stats = builder.build(self.sections, "results")
+        self.assertEqual(text, MANUSCRIPT)
+        self.assertEqual(stats.saved_tokens, 0)
+
+    def test_budget(self):
+        builder = ContextBuilder(budget=1350)
+        text, stats = builder.build(self.sections, "discussion")
+        self.assertLessEqual(stats.tokens, 1350)
+        self.assertEqual(stats.tokens, estimate_tokens(text))
+        self.assertGreater(stats.saved_tokens, 0)
+        self.assertIn("# Graph neural networks", text)
+        self.assertIn("We study graph neural networks.", text)
+        self.assertIn(section("Discussion", "message passing"), text)
+        # The previous section is a neighbour, the methods share the most words with the discussion
+        self.assertEqual(stats.full_sections, ["", "abstract", "methods", "results", "discussion"])
+        self.assertEqual(stats.summarized, ["introduction", "datasets"])
+        self.assertIn("## Datasets\nThe citation graph result number 0 is described here.", text)
+        self.assertEqual((builder.calls, builder.tokens_saved), (1, stats.saved_tokens))
+
+    def test_new_section_and_cached_summaries(self):
+        builder = ContextBuilder(budget=200, summaries=lambda slug, content: f"Summary of {slug}.")
+        text, stats = builder.build(self.sections, "conclusion")
+        self.assertEqual(stats.full_sections, ["", "abstract"])
+        self.assertIn("## Discussion\nSummary of discussion.", text)
+        self.assertEqual(stats.dropped, [])
+        self.assertEqual(text.index("## Introduction") < text.index("## Discussion"), True)
+
+    def test_dropped(self):
+        _, stats = ContextBuilder(budget=30).build(self.sections, "results")
+        self.assertEqual(set(stats.dropped), {"introduction", "methods", "datasets", "discussion"})
+
+    def test_lead_summary(self):
+        self.assertEqual(lead_summary("\n\n## Methods\nFirst one. Second one.", max_tokens=3), "## Methods\nFirst one.")
+
+
+class TestPrefixTracker(unittest.TestCase):
+    def test_common_prefix_length(self):
+        self.assertEqual(common_prefix_length("abcdef", "abcxyz"), 3)
+        self.assertEqual(common_prefix_length("abc", "abcdef"), 3)
+        self.assertEqual(common_prefix_length("", "abc"), 0)
+        self.assertEqual(common_prefix_length("xbc", "abc"), 0)
+
+    def test_record(self):
+        tracker = PrefixTracker(min_tokens=100, history=2)
+        manuscript = MANUSCRIPT[:2000]
+        self.assertFalse(tracker.record("llama3.2", manuscript + "Critique the methods").hit)
+        stats = tracker.record("llama3.2", manuscript + "Critique the results")
+        self.assertTrue(stats.hit)
+        self.assertEqual(stats.reused_tokens, estimate_tokens(manuscript + "Critique the"))
+        self.assertFalse(tracker.record("gpt-4o", manuscript).hit)
+        tracker.record("llama3.2", "Unrelated")
+        tracker.record("llama3.2", "Unrelated again")
+        # Only the last two contexts of a model are remembered
+        self.assertFalse(tracker.record("llama3.2", manuscript).hit)
+        self.assertEqual((tracker.calls, tracker.hits), (6, 1))
+
+
+class TestPromptLayout(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        # Workflow strips the leading slash of db_path
+        self.workflow = Workflow(dburl=f"sqlite:///{tmpdir.name}/aiwrite.db", model="llama3.2",
+                                 db_path=os.path.relpath(tmpdir.name))
+        self.addCleanup(self.workflow.engine.dispose)
+        self.workflow.save_project(Project(name="Graphs", language="pt"))
+
+    def test_stable_prefix_first(self):
+        prefix = self.workflow._prompt_prefix()
+        self.assertTrue(prefix.startswith(self.workflow.base_prompt))
+        self.assertIn("Project: Graphs\nLanguage: pt", prefix)
+        methods = self.workflow._manuscript_context(MANUSCRIPT, "methods")
+        results = self.workflow._manuscript_context(MANUSCRIPT, "results")
+        self.assertEqual(methods, results)
+        self.assertTrue(methods.startswith(prefix + "\n\nManuscript:\n\n# Graph neural networks"))
+        concept = self.workflow._concept_context("message passing", "Retrieved passages")
+        self.assertTrue(concept.startswith(prefix))
+        self.assertTrue(concept.endswith("message passing"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+import httpx
+import numpy as np
+
+from aiwrite.embeddings import CachedEmbedder, Embedder, EmbeddingCache, HTTPEmbedder
+from tests.fakes import CountingEmbedder
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.sqlite")
+        self.cache = EmbeddingCache(self.path)
+        self.backend = CountingEmbedder()
+        self.embedder = CachedEmbedder(self.backend, self.cache)
+
+    def test_repeated_texts_are_embedded_once(self):
+        first = self.embedder.embed(["a", "bb", "a"])
+        second = self.embedder.embed(["bb", "ccc"])
+        self.assertEqual(self.backend.embedded, ["a", "bb", "ccc"])
+        np.testing.assert_array_equal(first[1], second[0])
+        np.testing.assert_array_equal(first[0], first[2])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 4))
+
+    def test_persists_across_instances(self):
+        self.embedder.embed(["a"])
+        self.cache.close()
+        reopened = EmbeddingCache(self.path)
+        self.assertIsNotNone(reopened.get("test-model", ["a"])[0])
+        self.assertIsNone(reopened.get("other-model", ["a"])[0])
+        reopened.close()
+
+    def test_lru_eviction(self):
+        self.cache.max_bytes = 3 * 8
+        self.embedder.embed(["a", "b", "c"])
+        self.embedder.embed(["a"])
+        self.embedder.embed(["d"])
+        self.assertLessEqual(self.cache.size_bytes, self.cache.max_bytes)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNotNone(self.cache.get("test-model", ["a"])[0])
+        self.assertIsNotNone(self.cache.get("test-model", ["d"])[0])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class TestEmbedder(unittest.TestCase):
+    def test_embed_is_abstract(self):
+        class Incomplete(Embedder):
+            model = "test-model"
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class TestHTTPEmbedder(unittest.TestCase):
+    def embedder(self, requests: list) -> HTTPEmbedder:
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={"data": [{"index": 1, "embedding": [0.0, 1.0]},
+                                                      {"index": 0, "embedding": [1.0, 0.0]}]})
+
+        embedder = HTTPEmbedder("text-embedding-3-small")
+        embedder._client = httpx.Client(transport=httpx.MockTransport(handler))
+        return embedder
+
+    def test_openai_without_key(self):
+        requests = []
+        with mock.patch.dict(os.environ, {"OPENAI_BASE_URL": "http://localhost:8000/v1"}):
+            os.environ.pop("OPENAI_API_KEY", None)
+            vectors = self.embedder(requests).embed(["a", "b"])
+        self.assertEqual(vectors.tolist(), [[1.0, 0.0], [0.0, 1.0]])
+        self.assertEqual(str(requests[0].url), "http://localhost:8000/v1/embeddings")
+        self.assertNotIn("authorization", requests[0].headers)
+
+    def test_openai_with_key(self):
+        requests = []
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}):
+            self.embedder(requests).embed(["a", "b"])
+        self.assertEqual(requests[0].headers["authorization"], "Bearer secret")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+from sqlmodel import SQLModel, create_engine
+
+from aiwrite.folders import scan_folder
+from aiwrite.ingest import IngestStats
+
+
+class TestScanFolder(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.tmpdir.name, "docs")
+        os.makedirs(os.path.join(self.folder, "sub"))
+        self.engine = create_engine(f"sqlite:///{self.tmpdir.name}/manifest.db")
+        SQLModel.metadata.create_all(self.engine)
+        self.ingested = []
+        self.forgotten = []
+
+    def write(self, name: str, content: bytes) -> str:
+        path = os.path.join(self.folder, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def ingest(self, path: str) -> IngestStats:
+        with open(path, "rb") as f:
+            if f.read().startswith(b"corrupt"):
+                raise ValueError(f"{path} is not a PDF")
+        self.ingested.append(path)
+        return IngestStats(document=path)
+
+    def scan(self, project_id: int = 1):
+        return scan_folder(self.engine, self.folder, project_id, self.ingest, self.forgotten.append)
+
+    def test_incremental_rescan(self):
+        a = self.write("a.pdf", b"a")
+        b = self.write("sub/b.PDF", b"b")
+        self.write("notes.txt", b"ignored")
+        report = self.scan()
+        self.assertEqual(sorted(report.added), [a, b])
+        self.assertEqual(sorted(self.ingested), [a, b])
+
+        self.ingested.clear()
+        report = self.scan()
+        self.assertFalse(report.changed)
+        self.assertEqual(report.unchanged, 2)
+        self.assertEqual(self.ingested, [])
+
+        self.write("a.pdf", b"a2")
+        os.remove(b)
+        report = self.scan()
+        self.assertEqual((report.modified, report.removed), ([a], [b]))
+        self.assertEqual(self.ingested, [a])
+        self.assertEqual(self.forgotten, [b])
+
+    def test_touched_file_is_not_ingested(self):
+        a = self.write("a.pdf", b"a")
+        self.scan()
+        os.utime(a, (0, 0))
+        report = self.scan()
+        self.assertEqual(report.unchanged, 1)
+        self.assertEqual(self.ingested, [a])
+
+    def test_failed_file_does_not_stop_the_scan(self):
+        a = self.write("a.pdf", b"a")
+        bad = self.write("b.pdf", b"corrupt")
+        c = self.write("c.pdf", b"c")
+        self.scan()
+        os.remove(c)
+        report = self.scan()
+        self.assertEqual((report.failed, report.removed), ([bad], [c]))
+        self.assertEqual(sorted(self.ingested), [a, c])
+        self.assertEqual(self.forgotten, [c])
+
+        # The failed file has no manifest entry, so it is tried again until it can be ingested
+        self.write("b.pdf", b"b")
+        report = self.scan()
+        self.assertEqual((report.added, report.failed, report.unchanged), ([bad], [], 1))
+
+    def test_manifest_per_project(self):
+        self.write("a.pdf", b"a")
+        self.scan(project_id=1)
+        self.assertEqual(len(self.scan(project_id=2).added), 1)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import fitz
+from sqlmodel import SQLModel, create_engine
+
+from aiwrite.chunking import ChunkingConfig
+from aiwrite.ingest import IngestionCancelled, IngestionPipeline, IngestLedger, file_hash
+from aiwrite.workflow import Workflow, delete_embedded_pages
+from tests.fakes import CountingEmbedder, installed
+
+PAGES = ChunkingConfig(chunk_tokens=0)
+
+
+class TestIngestionPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.embedded = []
+        self.lock = threading.Lock()
+
+    def make_pdf(self, pages: int, name: str = "", edited: int = -1) -> str:
+        path = os.path.join(self.tmpdir.name, name or f"doc{pages}.pdf")
+        with fitz.open() as doc:
+            for number in range(pages):
+                doc.new_page().insert_text((72, 72), f"Page {number}" + (" edited" if number == edited else ""))
+            doc.save(path)
+        return path
+
+    def embed_batch(self, doc_name, chunks):
+        with self.lock:
+            self.embedded.append([chunk.page_start for chunk in chunks])
+
+    def test_batches_all_pages(self):
+        pipeline = IngestionPipeline(self.embed_batch, batch_size=4, chunking=PAGES)
+        stats = pipeline.ingest(self.make_pdf(10))
+        self.assertEqual(sorted(n for batch in self.embedded for n in batch), list(range(10)))
+        self.assertTrue(all(len(batch) <= 4 for batch in self.embedded))
+        self.assertEqual((stats.pages, stats.chunks, stats.batches), (10, 10, 3))
+        self.assertGreater(stats.pages_per_second, 0)
+
+    def test_process_pool_extraction(self):
+        pipeline = IngestionPipeline(self.embed_batch, batch_size=8, extract_workers=2, chunking=PAGES)
+        try:
+            stats = pipeline.ingest(self.make_pdf(IngestionPipeline.MIN_PAGES_FOR_POOL))
+        finally:
+            pipeline.close()
+        self.assertEqual(stats.chunks, IngestionPipeline.MIN_PAGES_FOR_POOL)
+        self.assertEqual(len({n for batch in self.embedded for n in batch}), stats.chunks)
+
+    def test_empty_file(self):
+        path = os.path.join(self.tmpdir.name, "empty.pdf")
+        open(path, "w").close()
+        stats = IngestionPipeline(self.embed_batch).ingest(path)
+        self.assertEqual(stats.pages, 0)
+        self.assertEqual(self.embedded, [])
+
+    def test_ledger_skips_embedded_content(self):
+        engine = create_engine(f"sqlite:///{self.tmpdir.name}/ledger.db")
+        SQLModel.metadata.create_all(engine)
+        ledger = IngestLedger(engine, "literature", "model", PAGES)
+        removed = []
+        pipeline = IngestionPipeline(self.embed_batch, batch_size=2, chunking=PAGES,
+                                     remove_pages=lambda name, numbers: removed.extend(numbers))
+        path = self.make_pdf(12, name="paper.pdf")
+        self.assertEqual(pipeline.ingest(path, ledger=ledger).chunks, 12)
+
+        copy = shutil.copy(path, os.path.join(self.tmpdir.name, "copy.pdf"))
+        stats = pipeline.ingest(copy, ledger=ledger)
+        self.assertEqual((stats.chunks, stats.skipped, stats.duplicate_of), (0, 12, path))
+
+        # Only the block holding the edited page is embedded again
+        self.embedded.clear()
+        self.make_pdf(11, name="paper.pdf", edited=9)
+        stats = pipeline.ingest(path, ledger=ledger)
+        self.assertEqual(sorted(n for batch in self.embedded for n in batch), [8, 9, 10])
+        self.assertEqual((stats.skipped, stats.removed), (8, 4))
+        self.assertEqual(removed, list(range(8, 16)))
+        self.assertEqual(sorted(ledger.page_hashes(path)), list(range(11)))
+        self.assertEqual(len(ledger.get_chunks(path)), 11)
+
+        other_model = IngestLedger(engine, "literature", "other-model", PAGES)
+        self.assertEqual(pipeline.ingest(path, ledger=other_model).chunks, 11)
+
+        self.embedded.clear()
+        chunked = IngestLedger(engine, "literature", "model", ChunkingConfig(chunk_tokens=10, overlap_tokens=0))
+        stats = pipeline.ingest(path, ledger=chunked, chunking=ChunkingConfig(chunk_tokens=10, overlap_tokens=0))
+        self.assertEqual(stats.skipped, 0)
+        self.assertLess(stats.chunks, 11)
+
+    def test_cancelled_reingest_is_not_a_duplicate(self):
+        engine = create_engine(f"sqlite:///{self.tmpdir.name}/ledger.db")
+        SQLModel.metadata.create_all(engine)
+        ledger = IngestLedger(engine, "literature", "model", PAGES)
+        path = self.make_pdf(12, name="paper.pdf")
+        IngestionPipeline(self.embed_batch, batch_size=2, chunking=PAGES).ingest(path, ledger=ledger)
+        original = shutil.copy(path, os.path.join(self.tmpdir.name, "original.pdf"))
+
+        # The edited file is cancelled after its first batch
+        self.make_pdf(12, name="paper.pdf", edited=0)
+        cancel = threading.Event()
+
+        def embed_then_cancel(doc_name, chunks):
+            self.embed_batch(doc_name, chunks)
+            cancel.set()
+
+        with self.assertRaises(IngestionCancelled):
+            IngestionPipeline(embed_then_cancel, batch_size=2, max_concurrency=1,
+                              chunking=PAGES).ingest(path, ledger=ledger, cancel=cancel)
+        shutil.copy(original, path)
+        self.embedded.clear()
+        stats = IngestionPipeline(self.embed_batch, batch_size=2, chunking=PAGES).ingest(path, ledger=ledger)
+        self.assertIsNone(stats.duplicate_of)
+        # The block holding the reverted page is embedded again
+        self.assertEqual(sorted(n for batch in self.embedded for n in batch), [0, 1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(ledger.find_duplicate("copy.pdf", file_hash(path)), path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class TestWorkflowIngestion(unittest.TestCase):
+    """Ingestion into the default knowledge base store, played by `FakeDocEmbedder`."""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.enterContext(installed())
+        self.workflow = self.open_workflow()
+
+    def open_workflow(self, **kwargs) -> Workflow:
+        # Workflow strips the leading slash of db_path
+        workflow = Workflow(dburl=f"sqlite:///{self.tmpdir}/aiwrite.db", model="llama3.2",
+                            db_path=os.path.relpath(self.tmpdir), response_cache="off", **kwargs)
+        self.addCleanup(lambda: workflow.engine.dispose())
+        return workflow
+
+    def make_pdf(self, pages: int, edited: int = -1, name: str = "paper.pdf") -> str:
+        path = os.path.join(self.tmpdir, name)
+        with fitz.open() as doc:
+            for number in range(pages):
+                doc.new_page().insert_text((72, 72), f"Page {number}" + (" edited" if number == edited else ""))
+            doc.save(path)
+        return path
+
+    def texts(self):
+        return sorted(text.strip() for _, _, text in self.workflow.KB.docs)
+
+    def test_changed_document_replaces_its_chunks(self):
+        self.workflow.embed_document(self.make_pdf(3))
+        self.assertEqual(self.texts(), ["Page 0\nPage 1\nPage 2"])
+        self.workflow.embed_document(self.make_pdf(3, edited=1))
+        self.assertEqual(self.texts(), ["Page 0\nPage 1 edited\nPage 2"])
+
+    def test_deleted_file_is_dropped_on_rescan(self):
+        folder = os.path.join(self.tmpdir, "docs")
+        os.makedirs(folder)
+        kept = self.make_pdf(2, name="docs/kept.pdf")
+        deleted = self.make_pdf(3, name="docs/deleted.pdf")
+        self.workflow.rescan_folder(folder)
+        self.assertEqual(self.workflow.KB.get_embedded_documents(),
+                         [(deleted, "literature"), (kept, "literature")])
+        os.remove(deleted)
+        report = self.workflow.rescan_folder(folder)
+        self.assertEqual((report.removed, report.failed), ([deleted], []))
+        self.assertEqual(self.workflow.KB.get_embedded_documents(), [(kept, "literature")])
+
+    def test_local_index_embeds_each_chunk_once(self):
+        workflow = self.open_workflow(local_index=True)
+        workflow._embedder = embedder = CountingEmbedder()
+        workflow.embed_document(self.make_pdf(3))
+        self.assertEqual([text.strip() for text in embedder.embedded], ["Page 0\nPage 1\nPage 2"])
+        self.assertEqual(workflow.KB.docs, [])
+        self.assertIn("Page 1", workflow.retrieve_docs("Page 1"))
+
+    def test_refuses_to_leave_stale_chunks(self):
+        class Store:
+            collection_name = "literature"
+            engine = create_engine(f"sqlite:///{self.tmpdir}/other.db")
+
+        with self.assertRaises(RuntimeError):
+            delete_embedded_pages(Store(), "paper.pdf", [0])
+        Store.engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
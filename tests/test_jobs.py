@@ -0,0 +1,109 @@
+import datetime
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from aiwrite.ingest import IngestionCancelled, IngestStats
+from aiwrite.jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, IngestionJob, IngestionQueue
+
+
+class TestIngestionQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{self.tmpdir.name}/jobs.db")
+        SQLModel.metadata.create_all(self.engine)
+        self.release = threading.Event()
+        self.runs = []
+
+    def ingest(self, job, progress, cancel):
+        self.runs.append(job.id)
+        if job.file_name == "broken.pdf":
+            raise ValueError("not a PDF")
+        for done in range(1, 5):
+            if job.file_name == "slow.pdf":
+                self.release.wait(5)
+            if cancel.is_set():
+                raise IngestionCancelled("cancelled")
+            progress(done, 4)
+        return IngestStats(document=job.file_name, pages=4)
+
+    def wait_for(self, queue, job_id, *statuses):
+        for _ in range(200):
+            job = next(j for j in queue.get_jobs() if j.id == job_id)
+            if job.status in statuses:
+                return job
+            time.sleep(0.01)
+        self.fail(f"job {job_id} stuck in {job.status}")
+
+    def test_jobs_run_in_background(self):
+        queue = IngestionQueue(self.engine, self.ingest)
+        ok = queue.submit("paper.pdf", "literature")
+        broken = queue.submit("broken.pdf", "literature")
+        job = self.wait_for(queue, ok.id, DONE)
+        self.assertEqual((job.pages_done, job.pages_total), (4, 4))
+        self.assertIn("not a PDF", self.wait_for(queue, broken.id, FAILED).message)
+        queue.shutdown()
+        self.assertEqual(queue.completed, 2)
+
+    def test_cancel_running_job(self):
+        queue = IngestionQueue(self.engine, self.ingest, max_workers=1)
+        job = queue.submit("slow.pdf", "literature")
+        self.assertTrue(queue.cancel(job.id))
+        self.release.set()
+        self.wait_for(queue, job.id, CANCELLED)
+        self.assertFalse(queue.cancel(job.id))
+        queue.shutdown()
+
+    def test_resume_after_restart(self):
+        queue = IngestionQueue(self.engine, self.ingest, max_workers=1)
+        job = queue.submit("slow.pdf", "literature")
+        queue.shutdown()
+        self.release.set()
+        self.assertEqual(self.wait_for(queue, job.id, QUEUED).status, QUEUED)
+
+        restarted = IngestionQueue(self.engine, self.ingest)
+        self.assertEqual(restarted.resume(), 1)
+        self.wait_for(restarted, job.id, DONE)
+        restarted.shutdown()
+
+    def add_job(self, status: str, heartbeat=None) -> int:
+        with Session(self.engine) as session:
+            job = IngestionJob(file_name="paper.pdf", collection_name="literature", status=status,
+                               heartbeat=heartbeat)
+            session.add(job)
+            session.commit()
+            return job.id
+
+    def test_resumed_job_runs_once(self):
+        job_id = self.add_job(QUEUED)
+        # One queue per session, all resuming at start
+        queues = [IngestionQueue(self.engine, self.ingest) for _ in range(3)]
+        for queue in queues:
+            queue.resume()
+        for queue in queues:
+            queue.shutdown(cancel=False)
+        self.assertEqual(self.runs, [job_id])
+        self.assertEqual(self.wait_for(queues[0], job_id, DONE).status, DONE)
+
+    def test_running_jobs_taken_over_when_stale(self):
+        now = datetime.datetime.now()
+        live = self.add_job(RUNNING, heartbeat=now)
+        stale = self.add_job(RUNNING, heartbeat=now - datetime.timedelta(seconds=120))
+        queue = IngestionQueue(self.engine, self.ingest, stale_after=60)
+        self.assertEqual(queue.resume(), 2)
+        self.wait_for(queue, stale, DONE)
+        queue.shutdown(cancel=False)
+        self.assertEqual(self.runs, [stale])
+        self.assertEqual(self.wait_for(queue, live, RUNNING).status, RUNNING)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
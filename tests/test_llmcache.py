@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+
+from aiwrite.llmcache import CacheMissError, ResponseCache
+from aiwrite.workflow import TITLE_PROMPT, Workflow
+from tests.fakes import installed
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "llm_cache.sqlite")
+
+    def test_keyed_by_model_context_and_prompt(self):
+        cache = ResponseCache(self.path)
+        cache.put("llama3.2", "context", "prompt", "answer")
+        self.assertEqual(cache.get("llama3.2", "context", "prompt"), "answer")
+        self.assertIsNone(cache.get("gpt-4o", "context", "prompt"))
+        self.assertIsNone(cache.get("llama3.2", "other context", "prompt"))
+        self.assertIsNone(cache.get("llama3.2", "contextprompt", ""))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        cache.close()
+        self.assertEqual(ResponseCache(self.path).get("llama3.2", "context", "prompt"), "answer")
+
+    def test_evicts_least_recently_used(self):
+        cache = ResponseCache(self.path, max_bytes=20)
+        cache.put("m", "", "first", "0123456789")
+        cache.put("m", "", "second", "0123456789")
+        cache.get("m", "", "first")
+        cache.put("m", "", "third", "0123456789")
+        self.assertEqual((len(cache), cache.size_bytes, cache.evictions), (2, 20, 1))
+        self.assertIsNone(cache.get("m", "", "second"))
+        self.assertEqual(cache.get("m", "", "first"), "0123456789")
+
+    def test_replay_fails_on_miss(self):
+        cache = ResponseCache(self.path, replay=True)
+        with self.assertRaises(CacheMissError):
+            cache.get("m", "context", "prompt")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class TestWorkflowResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.dburl = f"sqlite:///{self.tmpdir.name}/aiwrite.db"
+        # Workflow strips the leading slash of db_path
+        self.db_path = os.path.relpath(self.tmpdir.name)
+        self.enterContext(installed())
+
+    def workflow(self, mode: str) -> Workflow:
+        workflow = Workflow(dburl=self.dburl, model="llama3.2", db_path=self.db_path, response_cache=mode)
+        self.addCleanup(workflow.response_cache.close)
+        self.addCleanup(workflow.engine.dispose)
+        return workflow
+
+    def test_record_then_replay(self):
+        workflow = self.workflow("on")
+        asked = []
+
+        def ask_model(question, context):
+            asked.append(question)
+            yield "Graph "
+            yield "Networks"
+
+        workflow._ask_model = ask_model
+        prompt = TITLE_PROMPT.format(concept="graphs")
+        self.assertEqual(list(workflow._ask_stream(prompt, workflow.base_prompt)), ["Graph ", "Networks"])
+        self.assertEqual(list(workflow._ask_stream(prompt, workflow.base_prompt)), ["Graph Networks"])
+        self.assertEqual(len(asked), 1)
+        workflow.response_cache.close()
+
+        replay = self.workflow("replay")
+        self.assertEqual("".join(replay._ask_stream(prompt, replay.base_prompt)), "Graph Networks")
+        with self.assertRaises(CacheMissError):
+            replay.setup_manuscript("trees")
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Workflow(dburl=self.dburl, model="llama3.2", db_path=self.db_path, response_cache="sometimes")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from aiwrite import workflow as workflow_module
+from aiwrite.chunking import Chunk
+from aiwrite.pool import InstancePool
+from aiwrite.workflow import Workflow
+from tests.fakes import installed
+
+
+class Client:
+    def __init__(self, key):
+        self.key = key
+
+
+class TestInstancePool(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.closed = []
+        self.pool = InstancePool(Client, idle_timeout=60, max_idle=2, clock=lambda: self.now, close=self.closed.append)
+
+    def test_reuses_released_instances(self):
+        first = self.pool.acquire("llama3.2")
+        second = self.pool.acquire("llama3.2")
+        self.assertIsNot(first, second)
+        self.pool.release("llama3.2", first)
+        with self.pool.checkout("gpt-4o") as other:
+            self.assertEqual(other.key, "gpt-4o")
+        # Switching back gets the warm instance
+        self.assertIs(self.pool.acquire("llama3.2"), first)
+        self.assertIs(self.pool.get("gpt-4o"), other)
+        self.assertIs(self.pool.get("gpt-4o"), other)
+        self.assertEqual((self.pool.created, self.pool.reused), (3, 3))
+
+    def test_idle_eviction(self):
+        expired = Client("a")
+        self.pool.release("a", expired)
+        self.now = 30
+        kept = Client("b")
+        self.pool.release("b", kept)
+        self.now = 61
+        self.assertEqual(self.pool.evict_idle(), 1)
+        self.assertEqual(self.closed, [expired])
+        self.assertIs(self.pool.acquire("b"), kept)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_max_idle(self):
+        clients = [Client("a") for _ in range(3)]
+        for client in clients:
+            self.pool.release("a", client)
+        self.assertEqual((len(self.pool), self.pool.evicted), (2, 1))
+        # The oldest idle instance is the one closed
+        self.assertEqual(self.closed, clients[:1])
+        self.pool.clear()
+        self.assertEqual(self.closed, clients)
+
+    def test_close_failure_keeps_evicting(self):
+        def close(client):
+            self.closed.append(client)
+            raise OSError("connection reset")
+
+        pool = InstancePool(Client, max_idle=0, close=close)
+        pool.release("a", Client("a"))
+        pool.release("a", Client("a"))
+        self.assertEqual((len(pool), len(self.closed)), (0, 2))
+
+
+class TestLazyWorkflow(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.enterContext(installed())
+        # Workflow strips the leading slash of db_path
+        self.workflow = Workflow(dburl=f"sqlite:///{self.tmpdir.name}/aiwrite.db", model="pool-test-model",
+                                 db_path=os.path.relpath(self.tmpdir.name), collection_name="pool-test")
+
+    def test_clients_built_on_first_use(self):
+        LLM_POOL, KB_POOL = workflow_module.LLM_POOL, workflow_module.KB_POOL
+        created = (LLM_POOL.created, KB_POOL.created)
+        self.workflow.set_knowledge_base("pool-test-2")
+        self.assertIsNone(self.workflow._engine)
+        self.assertEqual((LLM_POOL.created, KB_POOL.created), created)
+        self.assertEqual(self.workflow.libby.model, "pool-test-model")
+        self.assertIs(self.workflow.KB, self.workflow.KB)
+        self.assertEqual((LLM_POOL.created, KB_POOL.created), (created[0] + 1, created[1] + 1))
+        self.assertEqual(self.workflow.get_man_list(), [])
+        self.workflow.engine.dispose()
+
+    def test_ingestion_batches_return_their_knowledge_base(self):
+        KB_POOL = workflow_module.KB_POOL
+        chunks = [Chunk(f"chunk {i}", i, i, 0, 7) for i in range(3)]
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda chunk: self.workflow._embed_batch("pool-test-2", "doc.pdf", [chunk]), chunks))
+        # Every instance borrowed by the workers is idle in the pool again
+        self.assertEqual(len(KB_POOL), KB_POOL.created)
+        with KB_POOL.checkout(("pool-test-2", self.workflow.dburl, self.workflow.embedding_model)) as kb:
+            self.assertEqual(len(kb.docs), 3)
+
+    def test_libby_is_not_handed_to_calls(self):
+        LLM_POOL = workflow_module.LLM_POOL
+        libby = self.workflow.libby
+        with self.workflow._checkout_bot() as bot:
+            self.assertIsNot(bot, libby)
+        self.workflow.set_model("pool-test-model-2")
+        # The previous client goes back to the pool
+        with LLM_POOL.checkout("pool-test-model") as bot:
+            self.assertIs(bot, libby)
+        self.assertEqual(self.workflow.libby.model, "pool-test-model-2")
+
+    def test_unchanged_model_keeps_its_client(self):
+        LLM_POOL = workflow_module.LLM_POOL
+        libby = self.workflow.libby
+        created = LLM_POOL.created
+        self.workflow.set_model("pool-test-model")
+        self.assertIs(self.workflow.libby, libby)
+        self.assertEqual((LLM_POOL.created, len(LLM_POOL)), (created, 0))
+
+    def test_evicted_knowledge_bases_are_disposed(self):
+        KB_POOL = workflow_module.KB_POOL
+        kb = self.workflow.KB
+        self.workflow.set_knowledge_base("pool-test-2")
+        self.assertEqual(len(KB_POOL), 1)
+        disposed = []
+        kb.engine.dispose = lambda: disposed.append(kb)
+        KB_POOL.clear()
+        self.assertEqual(disposed, [kb])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from sqlmodel import Session, SQLModel, create_engine
+
+from aiwrite.chunking import Chunk
+from aiwrite.ingest import CollectionSettings
+from aiwrite.quantize import main, migrate_index
+from aiwrite.vectorindex import LocalIndex, dequantize, normalize, quantize
+
+
+def vectors(n: int, dim: int = 48, seed: int = 0) -> np.ndarray:
+    return normalize(np.random.default_rng(seed).normal(size=(n, dim)))
+
+
+class TestQuantize(unittest.TestCase):
+    def test_int8_round_trip(self):
+        original = vectors(100)
+        codes, scales = quantize(original, "int8")
+        self.assertEqual(codes.dtype, np.int8)
+        self.assertEqual(np.abs(codes).max(), 127)
+        self.assertLess(np.abs(dequantize(codes, scales) - original).max(), 0.01)
+
+    def test_zero_vector(self):
+        codes, scales = quantize(np.zeros((1, 4)), "int8")
+        self.assertTrue(np.all(dequantize(codes, scales) == 0))
+
+
+class TestMigration(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmpdir.name, "data", "index")
+        self.engine = create_engine(f"sqlite:///{self.tmpdir.name}/aiwrite.db")
+        SQLModel.metadata.create_all(self.engine)
+        self.vectors = vectors(500)
+        index = LocalIndex(self.engine, self.directory, "literature", "model")
+        index.add("a.pdf", [Chunk(f"chunk {i}", 0, 0, 0, 1) for i in range(500)], self.vectors)
+        index.flush()
+
+    def open(self) -> LocalIndex:
+        return LocalIndex(self.engine, self.directory, "literature", "model")
+
+    def test_int8_with_rescoring(self):
+        index = self.open()
+        report = migrate_index(index, "int8", rescore=True, queries=20, k=5)
+        self.assertEqual((report.dtype_before, report.dtype_after, report.vectors), ("float32", "int8", 500))
+        self.assertEqual(report.scanned_bytes_after, 500 * (48 + 4))
+        self.assertEqual(report.bytes_after, 500 * (48 + 4 + 48 * 4))
+        self.assertEqual(report.recall, 1.0)
+        (best, score), = self.open().search(self.vectors[3], 1)
+        self.assertEqual(best.text, "chunk 3")
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+    def test_without_rescoring_and_back(self):
+        index = self.open()
+        report = migrate_index(index, "int8", rescore=False, queries=20, k=5)
+        self.assertEqual(report.bytes_after, 500 * (48 + 4))
+        self.assertGreater(report.saved_bytes, 0)
+        self.assertFalse(os.path.exists(os.path.join(index.directory, "originals.npy")))
+        index.convert("float32")
+        self.assertFalse(os.path.exists(os.path.join(index.directory, "scales.npy")))
+        (best, _), = index.search(self.vectors[7], 1)
+        self.assertEqual(best.text, "chunk 7")
+
+    def test_command(self):
+        main(["--db", f"sqlite:///{self.tmpdir.name}/aiwrite.db", "--db-path", os.path.join(self.tmpdir.name, "data"),
+              "--embedding-model", "model", "--quantization", "float16"])
+        self.assertEqual(self.open().dtype, "float16")
+        with Session(self.engine) as session:
+            self.assertEqual(session.get(CollectionSettings, "literature").quantization, "float16")
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from aiwrite.retrieval import RetrievalCache
+
+
+class TestRetrievalCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = RetrievalCache(max_entries=2, ttl=60, clock=lambda: self.now)
+        self.fetched = []
+
+    def retrieve(self, query: str, collection: str = "literature", k: int = 15) -> str:
+        def fetch():
+            self.fetched.append(query)
+            return f"{collection}:{query}:{k}"
+        return self.cache.retrieve(collection, "model", query, k, fetch)
+
+    def test_key_and_expiry(self):
+        self.assertEqual(self.retrieve("deep  learning"), "literature:deep  learning:15")
+        self.retrieve(" deep learning\n")
+        self.retrieve("deep learning", k=5)
+        self.assertEqual(self.fetched, ["deep  learning", "deep learning"])
+        self.now = 61
+        self.retrieve("deep learning", k=5)
+        self.assertEqual(len(self.fetched), 3)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+
+    def test_lru_eviction(self):
+        self.retrieve("a")
+        self.retrieve("b")
+        self.retrieve("a")
+        self.retrieve("c")
+        self.assertEqual(self.cache.evictions, 1)
+        self.retrieve("a")
+        self.retrieve("b")
+        self.assertEqual(self.fetched, ["a", "b", "c", "b"])
+
+    def test_invalidate_collection(self):
+        self.retrieve("a")
+        self.retrieve("a", collection="other")
+        self.assertEqual(self.cache.invalidate("literature"), 1)
+        self.retrieve("a")
+        self.retrieve("a", collection="other")
+        self.assertEqual(self.fetched, ["a", "a", "a"])
+
+    def test_result_fetched_during_invalidation_is_dropped(self):
+        def fetch():
+            self.cache.invalidate("literature")
+            return "stale"
+        self.cache.retrieve("literature", "model", "a", 15, fetch)
+        self.assertEqual(len(self.cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
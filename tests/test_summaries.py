@@ -0,0 +1,74 @@
+import tempfile
+import threading
+import unittest
+
+from sqlmodel import SQLModel, create_engine
+
+from aiwrite.context import ContextBuilder
+from aiwrite.summaries import SummaryStore
+
+
+def section(name: str, sentences: int = 50) -> str:
+    return f"\n\n## {name}\n" + " ".join(f"Sentence {i} of the {name.lower()} section." for i in range(sentences))
+
+
+class TestSummaryStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{self.tmpdir.name}/summaries.db")
+        SQLModel.metadata.create_all(self.engine)
+        # Cleanups run last-in first-out: stores are shut down before the database goes away
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(self.engine.dispose)
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def summarize(self, text: str) -> str:
+        self.release.wait()
+        self.calls.append(text)
+        return f"Summary {len(self.calls)}."
+
+    def open(self, **kwargs) -> SummaryStore:
+        store = SummaryStore(self.engine, self.summarize, **kwargs)
+        self.addCleanup(store.shutdown)
+        return store
+
+    def test_refresh_in_background(self):
+        store = self.open()
+        methods = section("Methods")
+        self.release.clear()
+        sections = [("", "# Title"), ("abstract", "\n\n## Abstract\nShort."), ("methods", methods)]
+        self.assertEqual(len(store.refresh(sections)), 1)
+        # Still pending, so not queued twice
+        self.assertEqual(store.refresh(sections), [])
+        self.assertIsNone(store.get(methods))
+        self.release.set()
+        store.wait()
+        self.assertEqual(store.get(methods), "Summary 1.")
+        self.assertEqual(store.refresh(sections), [])
+        self.assertEqual(len(self.calls), 1)
+        # Summaries are kept in the database and follow the content
+        self.assertEqual(self.open().get(methods), "Summary 1.")
+        self.assertEqual(len(store.refresh([("methods", methods + " Edited.")])), 1)
+
+    def test_long_sections_summarized_by_parts(self):
+        store = self.open(part_tokens=200)
+        self.assertEqual(store.summarize(section("Results", sentences=100)), "Summary 5.")
+        self.assertEqual(len(self.calls), 5)
+        self.assertEqual(self.calls[-1], "\n\n".join(f"Summary {i}." for i in range(1, 5)))
+
+    def test_context_uses_summaries(self):
+        store = self.open()
+        sections = [("", "# Title"), ("introduction", section("Introduction")), ("methods", section("Methods")),
+                    ("results", section("Results")), ("discussion", section("Discussion"))]
+        for future in store.refresh(sections):
+            future.result()
+        text, stats = ContextBuilder(budget=1000, summaries=store.lookup).build(sections, "discussion")
+        self.assertEqual(stats.summarized, ["introduction", "methods"])
+        self.assertIn("## Introduction\nSummary ", text)
+        self.assertIn(section("Discussion"), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from sqlmodel import SQLModel, create_engine
+
+from aiwrite.chunking import Chunk
+from aiwrite.vectorindex import IVFIndex, LocalIndex, LocalKnowledgeBase, exact_search, normalize
+
+
+def clustered(n: int, dim: int = 32, clusters: int = 20, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return normalize(centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim)))
+
+
+def chunks(n: int, page: int = 0):
+    return [Chunk(f"chunk {page}.{i}", page, page, 0, 1) for i in range(n)]
+
+
+class TestIVFIndex(unittest.TestCase):
+    def test_recall(self):
+        vectors = clustered(5000)
+        queries = clustered(50, seed=1)
+        index = IVFIndex(nprobe=8)
+        index.train(vectors[:4000])
+        index.add(vectors[4000:])
+        recall = []
+        for query in queries:
+            expected, _ = exact_search(vectors, query, 10)
+            rows, scores = index.search(vectors, query, 10)
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+            recall.append(len(set(rows) & set(expected)) / 10)
+        self.assertGreater(np.mean(recall), 0.9)
+
+    def test_exact_search_skips_dead_rows(self):
+        vectors = normalize(np.eye(4))
+        alive = np.array([False, True, True, True])
+        rows, _ = exact_search(vectors, vectors[0], 2, alive)
+        self.assertNotIn(0, rows)
+        self.assertEqual(len(exact_search(vectors, vectors[0], 10, alive)[0]), 3)
+
+
+class TestLocalIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{self.tmpdir.name}/index.db")
+        SQLModel.metadata.create_all(self.engine)
+
+    def open(self) -> LocalIndex:
+        index = LocalIndex(self.engine, os.path.join(self.tmpdir.name, "index"), "literature", "model/v1")
+        index.MIN_TRAIN_ROWS = 500
+        return index
+
+    def test_add_search_remove_reload(self):
+        vectors = clustered(600)
+        index = self.open()
+        index.add("a.pdf", chunks(300, page=0), vectors[:300])
+        self.assertFalse(index.trained)
+        index.add("b.pdf", chunks(300, page=1), vectors[300:])
+        self.assertTrue(index.trained)
+        (best, score), = index.search(vectors[42], 1)
+        self.assertEqual((best.document, best.text), ("a.pdf", "chunk 0.42"))
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+        self.assertEqual(index.remove_pages("a.pdf", [0]), 300)
+        self.assertEqual(index.documents, {"b.pdf"})
+        self.assertTrue(all(chunk.document == "b.pdf" for chunk, _ in index.search(vectors[42], 5)))
+        index.flush()
+
+        reopened = self.open()
+        self.assertTrue(reopened.trained)
+        self.assertEqual(len(reopened), 300)
+        (best, _), = reopened.search(vectors[342], 1)
+        self.assertEqual(best.text, "chunk 1.42")
+
+    def test_other_instance_sees_changes(self):
+        writer, reader = self.open(), self.open()
+        vectors = clustered(4)
+        writer.add("a.pdf", chunks(4), vectors)
+        self.assertEqual(reader.documents, {"a.pdf"})
+        writer.remove_pages("a.pdf", [0])
+        self.assertEqual(reader.search(vectors[0], 5), [])
+
+    def test_float16_storage(self):
+        index = LocalIndex(self.engine, os.path.join(self.tmpdir.name, "index"), "half", "model", dtype="float16")
+        vectors = clustered(2000)
+        index.add("a.pdf", chunks(2000), vectors)
+        self.assertEqual(index.size_bytes, 2000 * 32 * 2)
+        (best, score), = index.search(vectors[7], 1)
+        self.assertEqual(best.text, "chunk 0.7")
+        self.assertAlmostEqual(score, 1.0, places=2)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+
+class TestLocalKnowledgeBase(unittest.TestCase):
+    def test_embed_retrieve_delete(self):
+        class Embedder:
+            def embed(self, texts):
+                return np.array([[text.count("cat"), text.count("dog"), 1] for text in texts], dtype=np.float32)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            engine = create_engine(f"sqlite:///{tmpdir}/kb.db")
+            SQLModel.metadata.create_all(engine)
+            kb = LocalKnowledgeBase(LocalIndex(engine, tmpdir, "literature", "model"), Embedder())
+            kb.embed_text("cat cat cat", "pets.pdf", 0)
+            kb.embed_chunks("pets.pdf", [Chunk("dog dog dog", 1, 1, 0, 11)])
+            self.assertEqual(kb.retrieve_docs("dog", num_docs=1), "[pets.pdf, p. 2]\ndog dog dog")
+            self.assertEqual(kb.get_embedded_documents(), [("pets.pdf", "literature")])
+            kb.delete_pages("pets.pdf", [1])
+            self.assertEqual(kb.retrieve_docs("dog", num_docs=1), "[pets.pdf, p. 1]\ncat cat cat")
+            engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
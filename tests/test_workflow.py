@@ -1,8 +1,15 @@
+import itertools
+import os
+import re
+import tempfile
+import time
 import unittest
 from datetime import datetime
 from typing import Dict
 
-from aiwrite.workflow import Workflow, Manuscript, Project, parse_manuscript_text
+from aiwrite.workflow import Workflow, Manuscript, Project, parse_manuscript_text, split_manuscript_sections, \
+    index_manuscript_text
+from tests.fakes import FakeLibbyDBot, installed
 
 
 class TestWorkflow(unittest.TestCase):
@@ -101,5 +108,187 @@ class TestWorkflow(unittest.TestCase):
                 print(f"Error deleting project: {e}")
 
 
+class TestManuscriptSections(unittest.TestCase):
+    def setUp(self):
+        with open('tests/fixtures/test_manuscript.md', 'r') as f:
+            self.text = f.read()
+
+    def test_split_round_trip(self):
+        chunks = split_manuscript_sections(self.text)
+        self.assertEqual(''.join(chunk for _, chunk in chunks), self.text)
+        self.assertEqual([slug for slug, _ in chunks],
+                         ['', 'abstract', 'introduction', 'methods', 'discussion', 'conclusion'])
+
+    def test_index_offsets(self):
+        text = "# Title\n\n## Abstract\nText\n### Detail\nMore\n## Methods\n"
+        index = index_manuscript_text(text)
+        self.assertEqual(index.title, "Title")
+        self.assertEqual([span.name for span in index.sections], ['abstract', 'methods'])
+        abstract = index.find('Abstract')
+        self.assertEqual(text[abstract.header_start:abstract.body_start], "## Abstract\n")
+        self.assertEqual(text[abstract.body_start:abstract.body_end], "Text\n### Detail\nMore\n")
+        self.assertIs(index_manuscript_text(text), index)
+
+    def test_set_source_reuses_unchanged_sections(self):
+        manuscript = Manuscript.from_text(self.text)
+        methods = manuscript.get_section('methods')
+        manuscript.set_source(self.text.replace('## Introduction', '## Introduction\nNew sentence.'))
+        self.assertIs(manuscript.get_section('methods'), methods)
+        self.assertIn('New sentence.', manuscript.get_section('introduction').body)
+
+    def test_append_section(self):
+        manuscript = Manuscript.from_text("# Title\n\n## Abstract\nText")
+        manuscript.append_section("Introduction", "Intro text")
+        self.assertEqual(manuscript.source, "# Title\n\n## Abstract\nText\n\n## Introduction\nIntro text")
+        self.assertEqual(parse_manuscript_text(manuscript.source)['introduction'], "Intro text")
+
+
+class ScriptedBot(FakeLibbyDBot):
+    """Streams every answer in three chunks, numbered by call."""
+    answers = itertools.count(1)
+
+    def ask(self, question, stream=False):
+        chunks = ["Text ", "of ", f"answer {next(self.answers)}."]
+        return iter(chunks) if stream else "".join(chunks)
+
+
+def consume(stream):
+    """Chunks of a streaming call and its return value."""
+    chunks = []
+    while True:
+        try:
+            chunks.append(next(stream))
+        except StopIteration as stop:
+            return chunks, stop.value
+
+
+class TestFakeModelWorkflow(unittest.TestCase):
+    """Workflow calls answered offline by fake model and knowledge base clients."""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.enterContext(installed(bot=ScriptedBot))
+        ScriptedBot.answers = itertools.count(1)
+        # Workflow strips the leading slash of db_path
+        self.workflow = Workflow(dburl=f"sqlite:///{tmpdir.name}/aiwrite.db", model="llama3.2",
+                                 db_path=os.path.relpath(tmpdir.name), response_cache="off")
+        self.addCleanup(lambda: self.workflow.engine.dispose())
+
+    def assertGrowing(self, chunks):
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertTrue(chunk.startswith(previous), f"{chunk!r} does not extend {previous!r}")
+
+    def test_setup_manuscript_stream(self):
+        chunks, manuscript = consume(self.workflow.setup_manuscript_stream("graphs"))
+        self.assertGrowing(chunks)
+        self.assertEqual(chunks[:3], ["# Text ", "# Text of ", "# Text of answer 1."])
+        self.assertEqual(chunks[-1], "# Text of answer 1.\n\n## Abstract\nText of answer 2.")
+        self.assertEqual(self.workflow.get_manuscript_text(manuscript.id), chunks[-1])
+
+    def test_add_and_enhance_section_stream(self):
+        manuscript = self.workflow.setup_manuscript("graphs")
+        chunks, updated = consume(self.workflow.add_section_stream(manuscript.id, "introduction"))
+        self.assertGrowing(chunks[:-1])
+        self.assertEqual(chunks[-2], chunks[-1])
+        self.assertEqual(updated.source, chunks[-1])
+        self.workflow.add_section(manuscript.id, "methods")
+
+        chunks, updated = consume(self.workflow.enhance_section_stream(manuscript.id, "introduction"))
+        self.assertEqual(len(chunks), 3)
+        # The sections after the enhanced one stay in place while it streams
+        self.assertTrue(all(chunk.endswith("## Methods\nText of answer 4.") for chunk in chunks))
+        self.assertEqual(updated.source, chunks[-1])
+        sections = self.workflow.get_manuscript_sections(manuscript.id)
+        self.assertEqual((sections["introduction"], sections["methods"]), ("Text of answer 5.", "Text of answer 4."))
+        self.assertEqual(self.workflow.get_manuscript_text(manuscript.id), chunks[-1])
+
+    def test_criticize_section_stream(self):
+        manuscript = self.workflow.setup_manuscript("graphs")
+        chunks = list(self.workflow.criticize_section_stream(manuscript.id, "abstract"))
+        self.assertEqual(chunks, ["Text ", "Text of ", "Text of answer 3."])
+
+    def test_add_section_after_setup_in_a_project(self):
+        project = self.workflow.save_project(Project(name="Graphs", documents_folder="docs", language="en",
+                                                     model="llama3.2"))
+        manuscript = self.workflow.setup_manuscript("graphs")
+        # The project is still usable after the session that linked the manuscript to it closed
+        self.assertIn("Project: Graphs\nLanguage: en", self.workflow._prompt_prefix())
+        updated = self.workflow.add_section(manuscript.id, "introduction")
+        self.assertIn("## Introduction\nText of answer 3.", updated.source)
+        self.assertEqual(self.workflow.get_project(project.id).manuscript_id, manuscript.id)
+
+    def test_blocking_calls_return_the_streamed_result(self):
+        manuscript = self.workflow.setup_manuscript("graphs")
+        updated = self.workflow.add_section(manuscript.id, "introduction")
+        self.assertIsInstance(updated, Manuscript)
+        self.assertEqual(updated.source, self.workflow.get_manuscript_text(manuscript.id))
+        self.assertIsNone(self.workflow.add_section(manuscript.id + 1, "introduction"))
+
+
+class SectionBot(FakeLibbyDBot):
+    """Answers about a section after that section's delay, failing for the sections in ``failing``."""
+    delays = {}
+    failing = set()
+
+    def ask(self, question, stream=False):
+        match = re.search(r"the (\w+) section", question)
+        name = match.group(1) if match else "manuscript"
+        time.sleep(self.delays.get(name, 0))
+        if name in self.failing:
+            raise RuntimeError(f"model failed on {name}")
+        answer = f"Text of {name}."
+        return iter([answer]) if stream else answer
+
+
+class TestParallelSections(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.enterContext(installed(bot=SectionBot))
+        SectionBot.delays, SectionBot.failing = {}, set()
+        # Workflow strips the leading slash of db_path
+        self.workflow = Workflow(dburl=f"sqlite:///{tmpdir.name}/aiwrite.db", model="llama3.2",
+                                 db_path=os.path.relpath(tmpdir.name), response_cache="off")
+        self.addCleanup(lambda: self.workflow.engine.dispose())
+        self.manuscript = self.workflow.setup_manuscript("graphs")
+
+    def test_add_sections_in_outline_order(self):
+        # Later sections finish first
+        SectionBot.delays = {"introduction": 0.2, "methods": 0.1}
+        manuscript = self.workflow.add_sections(self.manuscript.id, ["Introduction", "methods", "Results",
+                                                                     "introduction", "Abstract"])
+        sections = self.workflow.get_manuscript_sections(self.manuscript.id)
+        self.assertEqual(list(sections), ["title", "abstract", "introduction", "methods", "results"])
+        self.assertEqual([sections[name] for name in ["introduction", "methods", "results"]],
+                         ["Text of introduction.", "Text of methods.", "Text of results."])
+        self.assertEqual(manuscript.source, self.workflow.get_manuscript_text(self.manuscript.id))
+
+    def test_add_sections_saves_nothing_when_one_fails(self):
+        SectionBot.failing = {"methods"}
+        with self.assertRaises(RuntimeError):
+            self.workflow.add_sections(self.manuscript.id, ["introduction", "methods", "results"])
+        self.assertEqual(self.workflow.get_manuscript_text(self.manuscript.id), self.manuscript.source)
+
+    def test_criticize_sections_as_completed(self):
+        self.workflow.add_sections(self.manuscript.id, ["introduction", "methods"])
+        SectionBot.delays = {"abstract": 0.2}
+        critiques = list(self.workflow.criticize_sections(self.manuscript.id))
+        # All sections but the title, the slow one last
+        self.assertEqual(sorted(critiques[:2]), [("introduction", "Text of introduction."),
+                                                 ("methods", "Text of methods.")])
+        self.assertEqual(critiques[2], ("abstract", "Text of abstract."))
+
+    def test_criticize_sections_partial_failure(self):
+        self.workflow.add_sections(self.manuscript.id, ["introduction", "methods"])
+        SectionBot.delays, SectionBot.failing = {"methods": 0.2}, {"methods"}
+        critiques = []
+        with self.assertRaises(RuntimeError):
+            for critique in self.workflow.criticize_sections(self.manuscript.id):
+                critiques.append(critique)
+        # The critiques completed before the failure were delivered
+        self.assertEqual(sorted(name for name, _ in critiques), ["abstract", "introduction"])
+
+
 if __name__ == '__main__':
     unittest.main()